@@ -1,10 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from contextlib import asynccontextmanager
+from starlette.requests import ClientDisconnect
 import os
 import uvicorn
+import telemetry
+import upstream
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await upstream.close()
+
+app = FastAPI(lifespan=lifespan)
+# The gateway starts each request's trace; every downstream call carries its X-Request-ID
+telemetry.install(app, "api-gateway")
+app.add_exception_handler(ClientDisconnect, upstream.caller_gone)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,14 +26,18 @@ app.add_middleware(
 
 @app.post("/getData")
 async def getData(
+    request: Request,
     latitude: float = Form(...),
     longitude: float = Form(...),
     year: int = Form(...),
     maxPower: float = Form(...),
     profileDemand: UploadFile = File(...),
+    endYear: int = Form(None),
+    weatherYear: str = Form(None),
 ):
     strategy_port = os.getenv("ROUTER_STRATEGY_PORT", "8502")
     url = f"http://routerstrategy:{strategy_port}/run"
+    optimizer_flow = os.getenv("OPTIMIZER_FLOW", "matlab")
     
     
     data = {
@@ -32,13 +47,22 @@ async def getData(
         "latitude": latitude,
         "longitude": longitude,
         "year": year,
+        # Octave needs the .mat cell layout; the NumPy optimizer maps .pvc cubes directly
+        "fileFormat": "mat" if optimizer_flow == "matlab" else "pvc",
+        # year..endYear in one multi-year cube; weatherYear then picks the year to optimize for
+        "endYear": endYear,
     }
     
+    # The spooled upload is streamed on in chunks, not read into memory
     files = {
-        "profileDemand": await profileDemand.read(),
+        "profileDemand": (profileDemand.filename, profileDemand.file, profileDemand.content_type),
     }
     
-    resp = requests.post(url, data=data)
+    # Pooled and non-blocking; hanging up on the gateway cancels the call downstream
+    client = upstream.get_client()
+    resp = await upstream.unless_disconnected(
+        request, client.post(url, data=upstream.form_data(data), headers=telemetry.trace_headers())
+    )
     resp.raise_for_status()
     resp_json =resp.json()
     print(resp_json)
@@ -51,12 +75,16 @@ async def getData(
         "latitude": latitude,
         "longitude": longitude,
         "year": year,
-        "flow": "matlab", 
+        "flow": optimizer_flow,
         "azimuth": 1,
         "slope": 1,
         "weatherFile": resp_json.get("filename"),
+        "maxPower": maxPower,
+        "weatherYear": weatherYear,
     }
-    resp = requests.post(url, files=files,data=data)
+    resp = await upstream.unless_disconnected(
+        request, client.post(url, files=files, data=upstream.form_data(data), headers=telemetry.trace_headers())
+    )
     return resp.json()
 
 @app.get("/")
@@ -1,54 +1,63 @@
-import io
+import re
+import httpx
+from urllib.parse import parse_qsl
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 
 from main import app  # adjust if your file is named differently
+import upstream
 
 client = TestClient(app)
 
 
-def mock_requests_post(*args, **kwargs):
+def form_fields(request):
+    """Form fields of a urlencoded or multipart request, without file contents."""
+    body = request.read()
+    if request.headers["content-type"].startswith("multipart/"):
+        return {name.decode(): value.decode() for name, value in re.findall(rb'name="(\w+)"\r\n\r\n([^\r]*)', body)}
+    return dict(parse_qsl(body.decode()))
+
+
+def router(requests_seen):
     """
-    Mocks requests.post used inside the endpoint.
+    Mocks the router behind the shared upstream client.
     First call returns a weather filename,
     second call returns final result.
     """
+    def handler(request):
+        requests_seen.append(request)
+        # Detect first vs second call by payload
+        if form_fields(request).get("flow") == "python":
+            return httpx.Response(200, json={"filename": "weather.csv"})
+        return httpx.Response(200, json={"result": "ok"})
+    return handler
 
-    class MockResponse:
-        def __init__(self, json_data):
-            self._json = json_data
-            self.status_code = 200
-
-        def raise_for_status(self):
-            pass
-
-        def json(self):
-            return self._json
 
-    # Detect first vs second call by payload
-    if kwargs.get("data", {}).get("flow") == "python":
-        return MockResponse({"filename": "weather.csv"})
-    else:
-        return MockResponse({"result": "ok"})
-
-
-@patch("requests.post", side_effect=mock_requests_post)
-def test_get_data_success(mock_post):
+def test_get_data_success():
     file_content = b"timestamp,value\n0,10\n1,20"
-
-    response = client.post(
-        "/getData",
-        data={
-            "latitude": 52.0,
-            "longitude": 5.0,
-            "year": 2024,
-            "maxPower": 1000,
-        },
-        files={
-            "profileDemand": ("demand.csv", file_content, "text/csv"),
-        },
-    )
+    seen = []
+
+    with patch.object(upstream, "_client", httpx.AsyncClient(transport=httpx.MockTransport(router(seen)))):
+        response = client.post(
+            "/getData",
+            data={
+                "latitude": 52.0,
+                "longitude": 5.0,
+                "year": 2024,
+                "maxPower": 1000,
+            },
+            files={
+                "profileDemand": ("demand.csv", file_content, "text/csv"),
+            },
+        )
 
     assert response.status_code == 200
     assert response.json() == {"result": "ok"}
-    assert mock_post.call_count == 2
+    assert len(seen) == 2
+    assert form_fields(seen[1])["maxPower"] == "1000.0"
+    assert "weatherYear" not in form_fields(seen[1])  # unset fields are left to the router's defaults
+    # The demand profile is streamed on to the router as a file
+    assert b'filename="demand.csv"' in seen[1].content and file_content in seen[1].content
+    # The gateway starts the trace; both router calls carry it
+    trace_id = response.headers["X-Request-ID"]
+    assert [r.headers["X-Request-ID"] for r in seen] == [trace_id] * 2
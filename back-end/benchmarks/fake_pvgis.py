@@ -0,0 +1,89 @@
+"""
+Local stand-in for the PVGIS seriescalc API, for benchmarks.
+
+Answers every seriescalc request with a deterministic hourly P series, one
+block per year of startyear..endyear (8784 hours in leap years), after a
+configurable latency. A configurable fraction of requests fails with 503,
+so client retries and backoff show up in the numbers.
+
+    python fake_pvgis.py [--port 8600] [--latency 0.05] [--jitter 0.02] [--error-rate 0] [--seed 0]
+
+Point pythoncalls at it with PVGIS_BASE_URL=http://<host>:<port>/api/v5_2/.
+The same settings can come from FAKE_PVGIS_LATENCY, FAKE_PVGIS_JITTER,
+FAKE_PVGIS_ERROR_RATE and FAKE_PVGIS_SEED (see docker-compose.bench.yml).
+"""
+import argparse
+import asyncio
+import calendar
+import json
+import os
+import random
+from functools import lru_cache
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+
+FAKE_PVGIS_PORT = int(os.getenv("FAKE_PVGIS_PORT", 8600))
+CONFIG = {
+    "latency": float(os.getenv("FAKE_PVGIS_LATENCY", 0.05)),
+    "jitter": float(os.getenv("FAKE_PVGIS_JITTER", 0.02)),
+    "error_rate": float(os.getenv("FAKE_PVGIS_ERROR_RATE", 0.0)),
+}
+_random = random.Random(int(os.getenv("FAKE_PVGIS_SEED", 0)))
+_counts = {"requests": 0, "errors": 0}
+
+app = FastAPI()
+
+
+@lru_cache(maxsize=16)
+def seriescalc_body(startyear, endyear):
+    """Encoded response for a year range; the same bytes serve every orientation."""
+    hourly = []
+    for year in range(startyear, endyear + 1):
+        hours = np.arange(8784 if calendar.isleap(year) else 8760)
+        daylight = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None)
+        season = 0.6 + 0.4 * np.sin(2 * np.pi * (hours / hours.size - 0.25))
+        power = np.round(900 * daylight * season * (0.9 + 0.01 * (year % 10)), 2)
+        hourly += [{"time": f"{year}{1 + h // 744:02d}01:{h % 24:02d}10", "P": float(p)} for h, p in zip(hours, power)]
+    data = {
+        "inputs": {"meteo_data": {"year_min": startyear, "year_max": endyear}},
+        "outputs": {"hourly": hourly},
+        "meta": {"source": "fake_pvgis"},
+    }
+    return json.dumps(data).encode()
+
+
+@app.get("/api/v5_2/seriescalc")
+async def seriescalc(startyear: int = 2019, endyear: int = None):
+    _counts["requests"] += 1
+    await asyncio.sleep(max(0.0, CONFIG["latency"] + _random.uniform(-CONFIG["jitter"], CONFIG["jitter"])))
+    if _random.random() < CONFIG["error_rate"]:
+        _counts["errors"] += 1
+        return JSONResponse(status_code=503, content={"message": "fake_pvgis: simulated overload"})
+    body = await asyncio.to_thread(seriescalc_body, startyear, endyear or startyear)
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/stats")
+def stats():
+    """Requests served and errors injected since startup, with the active settings."""
+    return {**_counts, **CONFIG}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=FAKE_PVGIS_PORT)
+    parser.add_argument("--latency", type=float, default=CONFIG["latency"], help="mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=CONFIG["jitter"], help="uniform +- spread of the delay")
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"], help="fraction of requests answered 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    CONFIG.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    _random.seed(args.seed)
+    uvicorn.run(app, host="0.0.0.0", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+End-to-end benchmark suite for the back-end, compared against a stored baseline.
+
+Starts a local fake PVGIS server (fake_pvgis.py) and a savedata instance on
+a scratch data directory, then runs each stage in its service directory so
+it measures that service's own code:
+
+    fetch      getData fetch throughput against the fake PVGIS server
+    serialize  save_pv .mat export, .pvc and .pvz write time and size
+    transfer   savedata streaming upload and download
+    optimizer  NumPy optimizer runtime at several grid resolutions
+    gateway    /getData latency through the running stack (only with --gateway-url,
+               e.g. docker compose -f docker-compose.yml -f docker-compose.bench.yml up)
+
+Results go to --out as JSON. With a baseline (default baseline.json next to
+this file) every metric is compared against it. A change beyond the
+metric's tolerance in its worse direction is a regression, and the exit
+status is then 1. --save-baseline stores the run as the new baseline.
+
+    python run_benchmarks.py [--stages fetch serialize ...] [--quick] [--save-baseline]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+import numpy as np
+import requests
+import scipy.io
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACK_END = os.path.dirname(HERE)
+STAGES = ("fetch", "serialize", "transfer", "optimizer", "gateway")
+DEFAULT_TOLERANCE = 0.25
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server for {url} exited with status {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server for {url} did not come up within {timeout} s")
+
+
+@contextmanager
+def server(command, cwd, probe_path, port, env=None):
+    """Run a server process for the duration of the block; yields its base URL."""
+    process = subprocess.Popen(command, cwd=cwd, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(url + probe_path, process)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_stage(service, script, *args):
+    """Run a bench script in a service directory and return its --json metrics."""
+    completed = subprocess.run(
+        [sys.executable, script, *args, "--json"], cwd=os.path.join(BACK_END, service),
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{service}/{script} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def demand_mat(hours=8760, seed=0):
+    buffer = io.BytesIO()
+    demand = np.random.default_rng(seed).uniform(20000, 60000, hours)
+    scipy.io.savemat(buffer, {"Pd": demand.reshape(-1, 1)})
+    return buffer.getvalue()
+
+
+def bench_gateway(url, repeat):
+    """Latency of /getData; the first call builds the cube, the rest reuse it."""
+    form = {"latitude": 52.0, "longitude": 5.0, "year": 2019, "maxPower": 100}
+    files = {"profileDemand": ("demand.mat", demand_mat(), "application/octet-stream")}
+    latencies = []
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        response = requests.post(f"{url}/getData", data=form, files=files, timeout=3600)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    warm = np.array(latencies[1:])
+    return {
+        "gateway.cold_s": {"value": round(latencies[0], 4), "unit": "s", "better": "lower"},
+        "gateway.warm_p50_s": {"value": round(float(np.percentile(warm, 50)), 4), "unit": "s", "better": "lower"},
+        "gateway.warm_p95_s": {"value": round(float(np.percentile(warm, 95)), 4), "unit": "s", "better": "lower"},
+    }
+
+
+def run(args):
+    metrics, skipped = {}, []
+    quick = ["--repeat", "1"] if args.quick else []
+    with tempfile.TemporaryDirectory() as scratch:
+        if "fetch" in args.stages:
+            port = free_port()
+            command = [sys.executable, "fake_pvgis.py", "--port", str(port), "--latency", str(args.latency),
+                       "--jitter", str(args.jitter), "--error-rate", str(args.error_rate)]
+            with server(command, HERE, "/stats", port) as pvgis_url:
+                metrics.update(run_stage("pythoncalls", "bench_pipeline.py", "fetch", "--pvgis-url", f"{pvgis_url}/api/v5_2/",
+                                         "--resolution", str(30 if args.quick else 15)))
+        if "serialize" in args.stages:
+            metrics.update(run_stage("pythoncalls", "bench_pipeline.py", "serialize",
+                                     "--resolution", str(10 if args.quick else 5), *quick))
+        if "transfer" in args.stages:
+            port = free_port()
+            command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+            env = {"DATA_DIR": os.path.join(scratch, "data"), "SHARED_DATA_DIR": ""}
+            with server(command, os.path.join(BACK_END, "savedata"), "/listSavedFiles", port, env) as savedata_url:
+                metrics.update(run_stage("pythoncalls", "bench_pipeline.py", "transfer", "--savedata-url", savedata_url,
+                                         "--resolution", str(10 if args.quick else 5)))
+        if "optimizer" in args.stages:
+            resolutions = ["15", "10"] if args.quick else ["10", "5", "3"]
+            metrics.update(run_stage("matlab", "bench_optimizer.py", "--resolutions", *resolutions, *quick))
+        if "gateway" in args.stages:
+            if args.gateway_url:
+                metrics.update(bench_gateway(args.gateway_url.rstrip("/"), 1 if args.quick else 5))
+            else:
+                skipped.append("gateway")
+    return metrics, skipped
+
+
+def compare(metrics, baseline, default_tolerance):
+    """Rows of (name, baseline, value, change, status) and whether anything regressed."""
+    rows, regressed = [], False
+    for name, entry in sorted(metrics.items()):
+        base = baseline.get("metrics", {}).get(name)
+        if base is None:
+            rows.append((name, None, entry["value"], None, "new"))
+            continue
+        if entry["better"] is None:
+            rows.append((name, base["value"], entry["value"], None, "info"))
+            continue
+        if base["value"] == 0:
+            # Counts that should stay at zero (failed requests) regress on any increase
+            change = None
+            worse = entry["value"] > 0 if entry["better"] == "lower" else False
+        else:
+            change = (entry["value"] - base["value"]) / abs(base["value"])
+            tolerance = base.get("tolerance", default_tolerance)
+            worse = change > tolerance if entry["better"] == "lower" else change < -tolerance
+        regressed |= worse
+        rows.append((name, base["value"], entry["value"], change, "REGRESSION" if worse else "ok"))
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--out", default=os.path.join(HERE, "results", "latest.json"))
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative change for metrics without their own tolerance in the baseline")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake PVGIS response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of fake PVGIS requests answered 503")
+    parser.add_argument("--gateway-url", help="API gateway of a running stack, e.g. http://localhost:1234")
+    parser.add_argument("--quick", action="store_true", help="smaller grids and fewer repeats, for a smoke run")
+    args = parser.parse_args()
+
+    metrics, skipped = run(args)
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+            "fake_pvgis": {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate},
+            "skipped": skipped,
+        },
+        "metrics": metrics,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.out}" + (f" (skipped: {', '.join(skipped)})" if skipped else ""))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("no baseline to compare against; store one with --save-baseline")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("quick") != args.quick:
+        print("warning: baseline and this run differ in --quick; their metrics are not comparable")
+    rows, regressed = compare(metrics, baseline, args.tolerance)
+    for name, base, value, change, status in rows:
+        base_text = "-" if base is None else f"{base:.4g}"
+        change_text = "" if change is None else f"{change:+.1%}"
+        print(f"{name:>34}  {base_text:>10} -> {value:<10.4g} {change_text:>8}  {status}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
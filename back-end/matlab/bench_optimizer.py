@@ -0,0 +1,49 @@
+"""
+Benchmark: full optimizer runs at several grid resolutions.
+
+Uses the synthetic inputs of bench_scoring.py and times optimize() from the
+cube in memory to the result dict, exhaustive and lazy, best of --repeat.
+
+    python bench_optimizer.py [--resolutions 10 5 3] [--repeat 3] [--json]
+
+With --json the metrics are printed as one JSON object (name -> value,
+unit, better) for benchmarks/run_benchmarks.py.
+"""
+import argparse
+import json
+import time
+from bench_scoring import synthetic_inputs
+from optimizer import optimize
+
+
+def metric(value, unit, better):
+    return {"value": round(float(value), 4), "unit": unit, "better": better}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[10, 5, 3])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print the metrics as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for resolution in args.resolutions:
+        demand, cube = synthetic_inputs(resolution)
+        for lazy in (False, True):
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = optimize(demand, cube, resolution, resolution, lazy=lazy)
+                best = min(best or float("inf"), time.perf_counter() - started)
+            name = f"optimizer.{'lazy' if lazy else 'exhaustive'}_{resolution}deg_s"
+            results[name] = metric(best, "s", "lower")
+            if not args.json:
+                steps = sum(p["kwp"] for p in result["panels"].values()) // 10
+                print(f"{resolution:>3} deg {cube.shape}  {'lazy' if lazy else 'exhaustive':>10}: {best:7.3f} s  {steps} steps")
+    if args.json:
+        print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Scaling benchmark: one greedy scoring pass and a full optimization on 1..N threads.
+
+Uses a synthetic cube with the shape of a real grid (2x2 degrees by default:
+46 slopes x 91 azimuths x 8760 hours) and checks every thread count picks
+the same placements as the serial run.
+
+    python bench_scoring.py [--resolution 2] [--max-workers 8] [--repeat 5]
+"""
+import argparse
+import os
+import time
+import numpy as np
+from optimizer import ParallelScorer, optimize, score_all
+
+
+def synthetic_inputs(resolution, hours=8760, seed=0):
+    rng = np.random.default_rng(seed)
+    num_slopes, num_azimuths = len(range(0, 91, resolution)), len(range(-90, 91, resolution))
+    shift = np.linspace(-3, 3, num_azimuths).reshape(1, -1, 1)
+    hour_of_day = (np.arange(hours) % 24).reshape(1, 1, -1)
+    daylight = np.clip(np.cos((hour_of_day - 12 - shift) / 12 * np.pi), 0, None)
+    cube = np.empty((num_slopes, num_azimuths, hours), dtype=np.float32)
+    for s in range(num_slopes):
+        cube[s] = rng.uniform(0.5, 1.0, (num_azimuths, 1)) * daylight[0] * 800 * rng.uniform(0.3, 1.0, hours)
+    return rng.uniform(20000, 60000, hours), cube
+
+
+def time_pass(flat, demand, workers, repeat):
+    step = np.float32(10)
+    if workers == 1:
+        score = lambda: score_all(flat, demand, step)
+        close = lambda: None
+    else:
+        scorer = ParallelScorer(flat, workers)
+        score, close = (lambda: scorer.score(demand, step)), scorer.close
+    try:
+        score()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            score()
+        return (time.perf_counter() - started) / repeat
+    finally:
+        close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--resolution", type=int, default=2, help="azimuth and slope resolution in degrees")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    demand, cube = synthetic_inputs(args.resolution)
+    flat = cube.reshape(-1, cube.shape[2])
+    print(f"cube {cube.shape}, {cube.nbytes / 1e6:.0f} MB, {os.cpu_count()} cores")
+
+    counts = sorted({1, *(2 ** i for i in range(1, 8) if 2 ** i < args.max_workers), args.max_workers})
+    reference = None
+    baseline = None
+    for workers in counts:
+        per_pass = time_pass(flat, demand.astype(np.float32), workers, args.repeat)
+        started = time.perf_counter()
+        result = optimize(demand, cube, args.resolution, args.resolution, workers=workers)
+        total = time.perf_counter() - started
+        reference = reference or result
+        assert result == reference, f"{workers} workers changed the result"
+        baseline = baseline or per_pass
+        print(
+            f"{workers:>3} workers: pass {per_pass * 1e3:7.1f} ms  speedup {baseline / per_pass:4.2f}x  "
+            f"efficiency {baseline / per_pass / workers:4.0%}  full run {total:6.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+In-process cache of loaded weather cubes for /runOptimizer.
+
+Cubes are keyed by their checksum in savedata, so a cube is loaded once and
+reused by every request for that site until it is evicted. The total size
+of cached cubes stays within ``max_bytes``, least recently used first out.
+Dense .pvc cubes stay memory-mapped, so their pages are shared with the OS
+page cache and can be dropped under pressure; .pvz and .mat cubes are
+decoded onto the heap. Requests for a cube that is still loading wait for
+that load instead of starting their own.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+
+class CubeCache:
+    def __init__(self, max_bytes=2 << 30, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> cube
+        self._loading = {}             # key -> Future of the load in progress
+        self._bytes = 0
+        self.hits = 0
+        self.shared_loads = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """The cube for ``key``, calling ``load()`` only if no one has it or is loading it."""
+        with self._lock:
+            cube = self._entries.get(key)
+            if cube is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cube
+            pending = self._loading.get(key)
+            if pending is None:
+                pending = self._loading[key] = Future()
+                self.misses += 1
+                owner = True
+            else:
+                self.shared_loads += 1
+                owner = False
+        if not owner:
+            return pending.result()
+
+        try:
+            cube = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+        evicted = []
+        with self._lock:
+            del self._loading[key]
+            if cube.nbytes <= self.max_bytes:
+                self._entries[key] = cube
+                self._bytes += cube.nbytes
+                while self._bytes > self.max_bytes:
+                    evicted.append(self._entries.popitem(last=False)[1])
+                    self._bytes -= evicted[-1].nbytes
+                    self.evictions += 1
+        pending.set_result(cube)
+        if self.on_evict:
+            for old in evicted:
+                self.on_evict(old)
+        return cube
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_loads + self.misses
+            mapped = sum(c.nbytes for c in self._entries.values() if isinstance(c, np.memmap))
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self._bytes - mapped,
+                "mapped_bytes": mapped,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "shared_loads": self.shared_loads,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.shared_loads) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -1,54 +1,352 @@
-from fastapi import FastAPI, UploadFile, Form, File
-import subprocess
+from fastapi import FastAPI, UploadFile, Form, File, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 import uvicorn
 import os
-import json
 import requests
 import shutil
+import json
+import time
+import uuid
+import numpy as np
+import telemetry
+from optimizer import ELECTRICITY_COSTS, PPV_MAX, PV_COST, PV_LIFETIME, load_cube, load_demand, optimize, sweep
+from cube_cache import CubeCache
+from result_cache import ResultCache, cache_key
+from worker_pool import JobTimeout, PoolFull, WorkerError, WorkerPool
+from transfer import TransferError, download_file
 
 MATLAB_PORT = int(os.getenv("MATLAB", 1000))
-app = FastAPI()
+OPTIMIZER_LAZY = os.getenv("OPTIMIZER_LAZY", "1") == "1"
+OPTIMIZER_THREADS = int(os.getenv("OPTIMIZER_THREADS", 1))
+SHARED_DATA_DIR = os.getenv("SHARED_DATA_DIR", "")
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", 64 << 20))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_BYTES = int(os.getenv("RESULT_CACHE_DISK_BYTES", 1 << 30))
+OCTAVE_WORKERS = int(os.getenv("OCTAVE_WORKERS", os.cpu_count() or 1))
+OCTAVE_QUEUE_SIZE = int(os.getenv("OCTAVE_QUEUE_SIZE", 32))
+OCTAVE_JOB_TIMEOUT = float(os.getenv("OCTAVE_JOB_TIMEOUT", 600))
+OCTAVE_MAX_JOBS = int(os.getenv("OCTAVE_MAX_JOBS", 50))
+CUBE_CACHE_BYTES = int(os.getenv("CUBE_CACHE_BYTES", 2 << 30))
+CUBE_CACHE_DIR = os.getenv("CUBE_CACHE_DIR", "tmp/cubes")
+
+_octave_pool = None
+
+def get_octave_pool():
+    global _octave_pool
+    if _octave_pool is None:
+        _octave_pool = WorkerPool(
+            size=OCTAVE_WORKERS, queue_size=OCTAVE_QUEUE_SIZE, timeout=OCTAVE_JOB_TIMEOUT, max_jobs=OCTAVE_MAX_JOBS
+        )
+    return _octave_pool
+
+@asynccontextmanager
+async def lifespan(app):
+    get_octave_pool().start()  # interpreters warm up before the first request
+    yield
+    await get_octave_pool().shutdown()
+
+app = FastAPI(lifespan=lifespan)
+telemetry.install(app, "matlab")
+
+CUBE_LOAD_SECONDS = telemetry.histogram("cube_load_seconds", "Time to load a weather cube on a cube cache miss", ("source",))
+OPTIMIZER_SECONDS = telemetry.histogram("optimizer_seconds", "Optimizer run time, by runner", ("runner",))
+OPTIMIZER_ITERATIONS = telemetry.histogram(
+    "optimizer_iterations", "kWp steps placed per optimizer run, by runner", ("runner",),
+    (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+)
+telemetry.gauge(
+    "octave_pool_jobs", "Octave jobs running (busy) or waiting for an interpreter (queued)", ("state",),
+    fn=lambda: {(state,): _octave_pool.stats()[state] if _octave_pool else 0 for state in ("busy", "queued")},
+)
+telemetry.gauge(
+    "cube_cache_bytes", "Bytes held by the loaded-cube cache, resident or memory-mapped", ("kind",),
+    fn=lambda: {(kind,): _cube_cache.stats()[f"{kind}_bytes"] if _cube_cache else 0 for kind in ("resident", "mapped")},
+)
+
+def record_run(runner: str, seconds: float, output, step_kwp: float = PPV_MAX):
+    """Runtime and iteration count (installed kWp / step) of one optimizer result."""
+    OPTIMIZER_SECONDS.observe(seconds, runner=runner)
+    if isinstance(output, dict) and "panels" in output:
+        total_kwp = sum(panel["kwp"] for panel in output["panels"].values())
+        OPTIMIZER_ITERATIONS.observe(round(total_kwp / step_kwp), runner=runner)
+
+_result_cache = None
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(RESULT_CACHE_BYTES, RESULT_CACHE_DIR or None, RESULT_CACHE_DISK_BYTES)
+    return _result_cache
+
+_cube_cache = None
+
+def release_cube(cube):
+    """Evicted cubes downloaded into CUBE_CACHE_DIR take their file with them."""
+    if isinstance(cube, np.memmap) and os.path.dirname(os.path.abspath(cube.filename)) == os.path.abspath(CUBE_CACHE_DIR):
+        os.remove(cube.filename)
+
+def get_cube_cache():
+    global _cube_cache
+    if _cube_cache is None:
+        _cube_cache = CubeCache(CUBE_CACHE_BYTES, on_evict=release_cube)
+    return _cube_cache
+
+# ------------------------
+# Helpers: stage the demand profile and weather file in tmp/
+# ------------------------
+def staged_path(tmp_dir: str, filename: str):
+    """A path in tmp_dir unique to this request; the extension is kept for Octave's load()."""
+    return os.path.join(tmp_dir, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+
+def save_demand_profile(demandProfile: UploadFile, content: bytes, tmp_dir: str):
+    demand_path = staged_path(tmp_dir, demandProfile.filename)
+    print(demand_path)
+    with open(demand_path, "wb") as f:
+        f.write(content)
+    return demand_path
+
+def resolve_weather_file(weatherData: str, year: int):
+    """savedata's view of the weather file: its checksum, and its path on the shared volume."""
+    response = requests.get(
+        "http://savedata:8505/resolveFile", params={"filename": weatherData, "year": year}, headers=telemetry.trace_headers()
+    )
+    if response.status_code != 200:
+        return {}
+    resolved = response.json()
+    if not (SHARED_DATA_DIR and resolved.get("path") and os.path.exists(resolved["path"])):
+        resolved["path"] = None
+    return resolved
+
+def download_weather_file(weatherData: str, year: int, tmp_dir: str, resolved: dict):
+    if resolved.get("path"):
+        return resolved["path"], None
+
+    # Streamed to disk, resumed with Range and checked against savedata's SHA-256
+    BASE_URL = "http://savedata:8505/getFile"
+    weather_path = staged_path(tmp_dir, weatherData)
+    try:
+        download_file(BASE_URL, weather_path, params={"filename": weatherData, "year": year})
+    except (TransferError, requests.RequestException) as e:
+        return None, str(e)
+    return weather_path, None
+
+def load_weather_cube(weatherData: str, year: int, resolved: dict, weather_year: str = None):
+    """
+    Weather cube of a request as a (slopes, azimuths, hours) array, from the
+    cube cache when savedata vouches for its contents with a checksum.
+
+    Downloaded .pvc cubes are kept in CUBE_CACHE_DIR and memory-mapped there
+    while cached; other formats are decoded and their download removed.
+    ``weather_year`` picks the year of a multi-year cube; each choice is
+    cached on its own.
+    """
+    checksum = resolved.get("checksum")
+    key = f"{checksum}-{weather_year}" if checksum and weather_year else checksum
+
+    def load():
+        if resolved.get("path"):
+            with CUBE_LOAD_SECONDS.time(source="shared"):
+                return load_cube(resolved["path"], weather_year)
+        with CUBE_LOAD_SECONDS.time(source="download"):
+            os.makedirs(CUBE_CACHE_DIR, exist_ok=True)
+            name = (key or uuid.uuid4().hex) + os.path.splitext(weatherData)[1]
+            path = download_file(
+                "http://savedata:8505/getFile", os.path.join(CUBE_CACHE_DIR, name), params={"filename": weatherData, "year": year}
+            )
+            cube = load_cube(path, weather_year)
+        if not (key and isinstance(cube, np.memmap)):
+            os.remove(path)  # a mapping stays valid after its file is unlinked
+        return cube
+
+    return get_cube_cache().get(key, load) if key else load()
+
+def result_key(runner: str, demand: bytes, resolved: dict, azimuth: int, slope: int, max_kwp: float = None,
+               weather_year: str = None):
+    """Cache key of a run, or None when savedata cannot vouch for the weather file's contents."""
+    if not resolved.get("checksum"):
+        return None
+    return cache_key(
+        runner, demand, resolved["checksum"], azimuth, slope,
+        electricity_costs=ELECTRICITY_COSTS, lifetime=PV_LIFETIME, step_kwp=PPV_MAX, pv_cost=PV_COST, max_kwp=max_kwp,
+        weather_year=weather_year,
+    )
+
+# Scenario keys of /runSweep -> optimize() keyword arguments; the tariff is in € per kWh
+SCENARIO_KEYS = {"tariff": "electricity_costs", "lifetime": "lifetime", "pv_cost": "pv_cost", "step_kwp": "step_kwp", "max_kwp": "max_kwp"}
+
+def parse_scenarios(scenarios: str):
+    """The optimize() keyword arguments of each scenario in a /runSweep form; raises ValueError."""
+    try:
+        parsed = json.loads(scenarios)
+    except ValueError:
+        raise ValueError("scenarios must be a JSON list of parameter sets") from None
+    if not isinstance(parsed, list) or not parsed or not all(isinstance(p, dict) for p in parsed):
+        raise ValueError("scenarios must be a non-empty JSON list of parameter sets")
+    converted = []
+    for scenario in parsed:
+        unknown = set(scenario) - set(SCENARIO_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown scenario parameters: {', '.join(sorted(unknown))}")
+        values = {}
+        for key, value in scenario.items():
+            if value is None and key == "max_kwp":
+                continue
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                raise ValueError(f"{key} must be a non-negative number")
+            values[SCENARIO_KEYS[key]] = value / 1000 if key == "tariff" else value
+        if values.get("step_kwp", PPV_MAX) <= 0:
+            raise ValueError("step_kwp must be positive")
+        converted.append(values)
+    return parsed, converted
+
+def cached_result(key, response: Response):
+    """Cached output for ``key`` (None on a miss); X-Cache tells the caller which it was."""
+    output = get_result_cache().get(key) if key else None
+    response.headers["X-Cache"] = "HIT" if output is not None else "MISS"
+    return output
+
+def remove_tmp_file(path: str, tmp_dir: str):
+    """Delete a staged file; files read in place from the shared volume are kept."""
+    if os.path.dirname(path) == tmp_dir:
+        os.remove(path)
 
 @app.post("/runMatlab")
 async def runMatlab(
+    response: Response,
     azimuth: int = Form(...),
     slope: int = Form(...),
     weatherData: str = Form(...),
     year: int = Form(...),
-    demandProfile: UploadFile = File(...)
+    demandProfile: UploadFile = File(...),
+    maxKwp: float = Form(None),
 ):
+    demand = await demandProfile.read()
+    resolved = await run_in_threadpool(resolve_weather_file, weatherData, year)
+    key = result_key("octave", demand, resolved, azimuth, slope, maxKwp)
+    output = cached_result(key, response)
+    if output is not None:
+        return {"output": output}
 
     tmp_dir = "tmp"
     os.makedirs(tmp_dir, exist_ok=True)
-    demand_path = os.path.join(tmp_dir, demandProfile.filename)
-    print(demand_path)
-    with open(demand_path, "wb") as f:
-        f.write(await demandProfile.read())
+    demand_path = save_demand_profile(demandProfile, demand, tmp_dir)
 
-    BASE_URL = "http://savedata:8505/getFile"
-    weather_path = os.path.join(tmp_dir, weatherData)
-    response = requests.get(BASE_URL, params={"filename": weatherData, "year": year})
-    if response.status_code == 200:
-        with open(weather_path, "wb") as f:
-            f.write(response.content)
-    else:
-        return {"error": f"Failed to download file: {response.status_code}"}
-
-    result = subprocess.run(
-        ["octave", "--no-gui", "--no-window-system", "calculation.m", demand_path, weather_path, str(azimuth), str(slope)],
-        capture_output=True,
-        text=True,
-        env={**os.environ, "DISPLAY": ""}
-    )
+    weather_path, error = await run_in_threadpool(download_weather_file, weatherData, year, tmp_dir, resolved)
+    if error:
+        os.remove(demand_path)
+        return {"error": error}
+
+    job = {"demand_path": demand_path, "weather_path": weather_path, "azimuth": azimuth, "slope": slope, "max_kwp": maxKwp}
+    started = time.perf_counter()
+    try:
+        output = await get_octave_pool().submit(job)
+    except PoolFull as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except JobTimeout as e:
+        return JSONResponse(status_code=504, content={"error": str(e)})
+    except WorkerError as e:
+        return {"error": str(e)}
+    finally:
+        os.remove(demand_path)
+        remove_tmp_file(weather_path, tmp_dir)
+
+    record_run("octave", time.perf_counter() - started, output)
+    if key:
+        get_result_cache().put(key, output)
+    return {"output": output}
+
+@app.post("/runOptimizer")
+async def runOptimizer(
+    response: Response,
+    azimuth: int = Form(...),
+    slope: int = Form(...),
+    weatherData: str = Form(...),
+    year: int = Form(...),
+    demandProfile: UploadFile = File(...),
+    maxKwp: float = Form(None),
+    weatherYear: str = Form(None),
+    lazy: bool = Form(OPTIMIZER_LAZY),
+):
+    """
+    Same inputs and output as /runMatlab, computed in-process with NumPy.
+
+    ``weatherYear`` runs a multi-year cube against one of its years,
+    "average" (the default) or "worst".
+    """
+    demand = await demandProfile.read()
+    resolved = await run_in_threadpool(resolve_weather_file, weatherData, year)
+    key = result_key("numpy", demand, resolved, azimuth, slope, maxKwp, weatherYear)
+    output = cached_result(key, response)
+    if output is not None:
+        return {"output": output}
+
+    try:
+        # Parsed from the upload itself; nothing is staged on disk that concurrent requests could share
+        demand_profile = load_demand(demand)
+        cube = await run_in_threadpool(load_weather_cube, weatherData, year, resolved, weatherYear)
+        started = time.perf_counter()
+        output = await run_in_threadpool(
+            optimize, demand_profile, cube, azimuth, slope, max_kwp=maxKwp, lazy=lazy, workers=OPTIMIZER_THREADS
+        )
+        record_run("numpy", time.perf_counter() - started, output)
+    except (ValueError, TransferError, requests.RequestException) as e:
+        return {"error": str(e)}
+
+    if key:
+        get_result_cache().put(key, output)
+    return {"output": output}
+
+@app.post("/runSweep")
+async def runSweep(
+    azimuth: int = Form(...),
+    slope: int = Form(...),
+    weatherData: str = Form(...),
+    year: int = Form(...),
+    demandProfile: UploadFile = File(...),
+    scenarios: str = Form(...),
+    weatherYear: str = Form(None),
+    lazy: bool = Form(OPTIMIZER_LAZY),
+):
+    """
+    /runOptimizer for a JSON list of parameter sets (tariff, lifetime,
+    pv_cost, step_kwp, max_kwp) over one weather cube and demand profile.
+    """
+    try:
+        requested, parameter_sets = parse_scenarios(scenarios)
+    except ValueError as e:
+        return {"error": str(e)}
+    demand = await demandProfile.read()
+    resolved = await run_in_threadpool(resolve_weather_file, weatherData, year)
 
+    try:
+        demand_profile = load_demand(demand)
+        cube = await run_in_threadpool(load_weather_cube, weatherData, year, resolved, weatherYear)
+        started = time.perf_counter()
+        outputs = await run_in_threadpool(
+            sweep, demand_profile, cube, azimuth, slope, parameter_sets, lazy=lazy, workers=OPTIMIZER_THREADS
+        )
+        # One sweep shares its greedy runs between scenarios; its time is recorded once
+        OPTIMIZER_SECONDS.observe(time.perf_counter() - started, runner="sweep")
+    except (ValueError, TransferError, requests.RequestException) as e:
+        return {"error": str(e)}
+    return {"results": [{"scenario": scenario, "output": output} for scenario, output in zip(requested, outputs)]}
 
-    os.remove(demand_path)
-    os.remove(weather_path)
+@app.get("/poolStats")
+def poolStats():
+    """Size, load and failure counts of the Octave worker pool."""
+    return get_octave_pool().stats()
 
-    if result.returncode != 0:
-        return {"error": result.stderr}
+@app.get("/cacheStats")
+def cacheStats():
+    """Hit, miss and eviction counts of the optimizer result cache."""
+    return get_result_cache().stats()
 
-    return {"output": json.loads(result.stdout)}
+@app.get("/cubeCacheStats")
+def cubeCacheStats():
+    """Resident and mapped size, hit ratio and evictions of the loaded-cube cache."""
+    return get_cube_cache().stats()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=MATLAB_PORT, log_level="info")
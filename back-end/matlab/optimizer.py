@@ -0,0 +1,343 @@
+"""
+Native NumPy port of the greedy PV placement in calculation.m.
+
+The weather cube is held as one contiguous float32 array of shape
+(slopes, azimuths, hours) instead of a cell array, so every greedy
+iteration scores all orientations with a handful of vectorized passes.
+With ``workers`` > 1 those passes are split across threads.
+"""
+import heapq
+import io
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.io
+import pvcube
+import pvcodec
+
+# ------------------------
+# Economic parameters (same defaults as calculation.m)
+# ------------------------
+ELECTRICITY_COSTS = 0.13 / 1000   # € per Wh
+PV_LIFETIME = 20                  # years
+PPV_MAX = 10                      # kWp added per iteration
+PV_COST = 1200                    # € per kWp
+
+DEFAULT_SCENARIO = {
+    "electricity_costs": ELECTRICITY_COSTS,
+    "lifetime": PV_LIFETIME,
+    "step_kwp": PPV_MAX,
+    "pv_cost": PV_COST,
+    "max_kwp": None,            # no cap on the total kWp
+}
+
+# Number of orientations scored per vectorized pass; keeps temporaries small
+CHUNK_ROWS = 512
+
+
+# ------------------------
+# Loading helpers
+# ------------------------
+def _first_variable(mat):
+    names = [k for k in mat if not k.startswith("__")]
+    if not names:
+        raise ValueError("No variables found in .mat file")
+    return mat[names[0]]
+
+
+def load_demand(source):
+    """
+    Load a demand profile (Wh per hour) the way Octave's load() does, from a
+    path or from the uploaded file's bytes.
+    """
+    def opened():
+        return io.BytesIO(source) if isinstance(source, bytes) else source
+
+    try:
+        data = _first_variable(scipy.io.loadmat(opened()))
+    except (ValueError, scipy.io.matlab.MatReadError):
+        data = np.loadtxt(opened())
+    return np.asarray(data, dtype=np.float64).ravel()
+
+
+def load_cube(path, weather_year=None):
+    """
+    Load a weather file as a float32 (slopes, azimuths, hours) cube.
+
+    Dense .pvc cubes are memory-mapped in place; compressed .pvz cubes and
+    .mat cell arrays are decoded into a new contiguous array. Multi-year
+    cubes are reduced to the year ``weather_year`` picks (see
+    pvcube.select_year), which is a new array too.
+    """
+    if pvcube.is_cube(path):
+        return pvcube.select_year(*pvcube.open_cube(path), weather_year)
+    if pvcodec.is_pvz(path):
+        reader = pvcodec.PvzReader(path)
+        return pvcube.select_year(reader.to_dense(), reader.header, weather_year)
+
+    cells = _first_variable(scipy.io.loadmat(path))
+    num_slopes, num_azimuths = cells.shape
+    hours = np.asarray(cells[0, 0]).size
+
+    cube = np.empty((num_slopes, num_azimuths, hours), dtype=np.float32)
+    for s in range(num_slopes):
+        for a in range(num_azimuths):
+            cube[s, a] = np.asarray(cells[s, a], dtype=np.float32).ravel()
+    return cube
+
+
+# ------------------------
+# Scoring
+# ------------------------
+def _score_rows(rows, demand, step, buf):
+    """Usable energy sum(min(demand, step * x)) for every row of ``rows``."""
+    n = rows.shape[0]
+    supply = np.multiply(rows, step, out=buf[:n])
+    np.minimum(supply, demand, out=supply)
+    # Summing a float64 copy keeps every row on the same pairwise-sum path
+    return supply.astype(np.float64).sum(axis=-1)
+
+
+def score_all(flat, demand, step, chunk_rows=CHUNK_ROWS, out=None, buf=None):
+    """Score every orientation of a (orientations, hours) view of the cube."""
+    gains = np.empty(flat.shape[0], dtype=np.float64) if out is None else out
+    if buf is None:
+        buf = np.empty((min(chunk_rows, flat.shape[0]), flat.shape[1]), dtype=np.float32)
+    for start in range(0, flat.shape[0], chunk_rows):
+        stop = min(start + chunk_rows, flat.shape[0])
+        gains[start:stop] = _score_rows(flat[start:stop], demand, step, buf)
+    return gains
+
+
+class ParallelScorer:
+    """
+    score_all split into contiguous orientation ranges on a thread pool.
+
+    NumPy releases the GIL inside the multiply, minimum and sum passes, so
+    the threads run on separate cores over the one shared cube; nothing is
+    copied per iteration. Each range writes its own slice of one gains
+    array, and every row is scored exactly as in the serial pass, so the
+    winner and its gain are the same.
+    """
+
+    def __init__(self, flat, workers, chunk_rows=CHUNK_ROWS):
+        self.flat = flat
+        self.chunk_rows = chunk_rows
+        bounds = np.linspace(0, flat.shape[0], workers + 1).astype(int)
+        self.ranges = [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        self.bufs = [np.empty((min(chunk_rows, hi - lo), flat.shape[1]), dtype=np.float32) for lo, hi in self.ranges]
+        self.gains = np.empty(flat.shape[0], dtype=np.float64)
+        self.executor = ThreadPoolExecutor(len(self.ranges))
+
+    def _score_range(self, i, demand, step):
+        lo, hi = self.ranges[i]
+        score_all(self.flat[lo:hi], demand, step, self.chunk_rows, out=self.gains[lo:hi], buf=self.bufs[i])
+
+    def score(self, demand, step):
+        for future in [self.executor.submit(self._score_range, i, demand, step) for i in range(len(self.ranges))]:
+            future.result()
+        return self.gains
+
+    def close(self):
+        self.executor.shutdown()
+
+
+# ------------------------
+# Candidate selection
+# ------------------------
+def best_exhaustive(flat, pd, step, num_slopes, num_azimuths, scorer=None):
+    """Score every orientation; return (flat index, gain) of the winner."""
+    gains = scorer.score(pd, step) if scorer else score_all(flat, pd, step)
+
+    # Octave's min() over sum_Pgrid_all(:) walks the grid column-major,
+    # so ties go to the lowest azimuth index first
+    column_major = gains.reshape(num_slopes, num_azimuths).T.ravel()
+    best = int(np.argmax(column_major))
+    a, s = divmod(best, num_slopes)
+    return s * num_azimuths + a, column_major[best]
+
+
+class LazyGreedy:
+    """
+    Lazy evaluation of the greedy step with a max-heap of upper bounds.
+
+    Removing PV output from the demand can only lower the gain of any
+    orientation, so a gain scored in an earlier iteration is an upper bound
+    for the current one. Initial bounds are the annual yield of each
+    orientation. Only the heap top is re-scored until a fresh score wins,
+    which selects the same orientation (including column-major tie-breaking)
+    as the exhaustive scan.
+    """
+
+    def __init__(self, flat, step, num_slopes, num_azimuths, scorer=None):
+        self.flat = flat
+        self.step = step
+        self.rescored = 0
+
+        # min(inf, step * x) == step * x, so yields go through the same
+        # summation path as the gains and stay valid upper bounds
+        no_limit = np.full(flat.shape[1], np.inf, dtype=np.float32)
+        yields = scorer.score(no_limit, step).copy() if scorer else score_all(flat, no_limit, step)
+        self.buf = np.empty((1, flat.shape[1]), dtype=np.float32)
+
+        idx = np.arange(flat.shape[0])
+        column_major = (idx % num_azimuths) * num_slopes + idx // num_azimuths
+        self.heap = [(-float(g), int(c), int(i), -1) for g, c, i in zip(yields, column_major, idx)]
+        heapq.heapify(self.heap)
+
+    def best(self, pd, iteration):
+        """Return (flat index, gain) of the winner for the current demand."""
+        while True:
+            neg_bound, column_major, index, scored_at = self.heap[0]
+            if scored_at == iteration:
+                # The winner stays in the heap; its stale gain bounds the next round
+                heapq.heapreplace(self.heap, (neg_bound, column_major, index, scored_at))
+                return index, -neg_bound
+
+            gain = _score_rows(self.flat[index:index + 1], pd, self.step, self.buf)[0]
+            self.rescored += 1
+            heapq.heapreplace(self.heap, (-float(gain), column_major, index, iteration))
+
+
+# ------------------------
+# Greedy optimizer
+# ------------------------
+def optimize(
+    demand,
+    cube,
+    azimuth_res,
+    slope_res,
+    electricity_costs=ELECTRICITY_COSTS,
+    lifetime=PV_LIFETIME,
+    step_kwp=PPV_MAX,
+    pv_cost=PV_COST,
+    max_kwp=None,
+    lazy=False,
+    workers=1,
+):
+    """
+    Run the calculation.m greedy loop and return its JSON result as a dict.
+
+    Each iteration adds ``step_kwp`` to the orientation that removes the most
+    energy from the grid. Like the Octave loop, the iteration whose cost
+    reduction first drops below the capex is still included; ``max_kwp``
+    additionally stops before the total would exceed it. With ``lazy``
+    the winner is found through LazyGreedy instead of scoring every
+    orientation; the placements are identical. ``workers`` > 1 scores
+    orientations on that many threads (see ParallelScorer).
+    """
+    scenario = {
+        "electricity_costs": electricity_costs, "lifetime": lifetime, "step_kwp": step_kwp,
+        "pv_cost": pv_cost, "max_kwp": max_kwp,
+    }
+    return sweep(demand, cube, azimuth_res, slope_res, [scenario], lazy=lazy, workers=workers)[0]
+
+
+def sweep(demand, cube, azimuth_res, slope_res, scenarios, lazy=False, workers=1):
+    """
+    optimize() for many parameter sets over one cube and demand profile.
+
+    Each scenario is a dict of optimize() keyword arguments; missing ones
+    take the calculation.m defaults. Costs and the kWp cap only decide where
+    the greedy sequence stops, not which orientation each step picks, so
+    all scenarios with the same step size share one sequence, run as far as
+    the longest of them needs. Returns the results in scenario order.
+    """
+    cube = np.ascontiguousarray(cube, dtype=np.float32)
+    num_slopes, num_azimuths, hours = cube.shape
+    flat = cube.reshape(num_slopes * num_azimuths, hours)
+
+    pd_initial = np.asarray(demand, dtype=np.float64).ravel()
+    if pd_initial.size != hours:
+        raise ValueError(f"Demand profile has {pd_initial.size} hours, weather data has {hours}")
+
+    scenarios = [{**DEFAULT_SCENARIO, **scenario} for scenario in scenarios]
+    by_step = {}
+    for i, scenario in enumerate(scenarios):
+        by_step.setdefault(scenario["step_kwp"], []).append(i)
+
+    results = [None] * len(scenarios)
+    scorer = ParallelScorer(flat, workers) if workers > 1 else None
+    try:
+        for step_kwp, members in by_step.items():
+            distribution = np.zeros((num_slopes, num_azimuths), dtype=np.float64)
+            pd = pd_initial.astype(np.float32)
+            steps = greedy_steps(flat, pd, step_kwp, num_slopes, num_azimuths, lazy, scorer)
+            installed = 0.0
+            active = list(members)
+
+            def finish(i):
+                results[i] = build_result(pd_initial, pd, distribution, azimuth_res, slope_res)
+                active.remove(i)
+
+            while active:
+                for i in [i for i in active if exceeds_cap(scenarios[i], installed + step_kwp)]:
+                    finish(i)
+                if not active:
+                    break
+                best, gain, pd = next(steps)
+                distribution[divmod(best, num_azimuths)] += step_kwp
+                installed += step_kwp
+                for i in list(active):
+                    scenario = scenarios[i]
+                    cost_reduction = gain * scenario["electricity_costs"] * scenario["lifetime"]
+                    if cost_reduction <= scenario["pv_cost"] * step_kwp:
+                        finish(i)
+    finally:
+        if scorer:
+            scorer.close()
+    return results
+
+
+def exceeds_cap(scenario, total_kwp):
+    return scenario["max_kwp"] is not None and total_kwp > scenario["max_kwp"]
+
+
+def greedy_steps(flat, pd, step_kwp, num_slopes, num_azimuths, lazy=False, scorer=None):
+    """
+    The greedy placement sequence: for every ``step_kwp`` added, yields the
+    flat index of the chosen orientation, its gain and the remaining demand.
+    It never ends on its own; callers stop asking once they are done.
+    """
+    step = np.float32(step_kwp)
+    lazy_greedy = LazyGreedy(flat, step, num_slopes, num_azimuths, scorer) if lazy else None
+    iteration = 0
+    while True:
+        if lazy_greedy:
+            best, gain = lazy_greedy.best(pd, iteration)
+        else:
+            best, gain = best_exhaustive(flat, pd, step, num_slopes, num_azimuths, scorer)
+        pd = np.maximum(pd - step * flat[best], 0)
+        yield best, gain, pd
+        iteration += 1
+
+
+def build_result(pd_initial, pd_final, distribution, azimuth_res, slope_res):
+    """Format the outcome exactly like the JSON printed by calculation.m."""
+    num_slopes, num_azimuths = distribution.shape
+
+    panels = {}
+    for a in range(num_azimuths):
+        for s in range(num_slopes):
+            if distribution[s, a] != 0:
+                kwp = float(distribution[s, a])
+                panels[f"panel{len(panels) + 1}"] = {
+                    "kwp": int(kwp) if kwp.is_integer() else round(kwp, 3),
+                    "azimuth": int(-90 + a * azimuth_res),
+                    "slope": int(s * slope_res),
+                }
+
+    total = float(np.sum(pd_initial))
+    usable = float(np.sum(pd_initial - pd_final))
+    percentage = 100 * usable / total if total else 0.0
+
+    return {
+        "panels": panels,
+        "ppv_usable": round(usable, 2),
+        "ppv_percentage": round(percentage, 2),
+        "energy_from_grid": round(total, 2),
+    }
+
+
+def run_optimizer(demand_path, weather_path, azimuth_res, slope_res, lazy=False, workers=1):
+    """Load both input files and run the greedy optimizer on them."""
+    return optimize(load_demand(demand_path), load_cube(weather_path), azimuth_res, slope_res, lazy=lazy, workers=workers)
@@ -0,0 +1,146 @@
+"""
+Content-addressed cache of optimizer results.
+
+A result is keyed by the SHA-256 of everything that determines it: the
+demand profile bytes, the weather cube's checksum in savedata, the grid
+resolution, the cost parameters and which runner produced it. Submitting
+the same form again is then a dictionary lookup instead of an Octave run.
+
+Results are small JSON documents. The memory tier is an LRU bounded by the
+total size of their encodings; the optional disk tier keeps one file per
+key under ``disk_dir``, bounded the same way by evicting the least recently
+used files.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+def cache_key(runner, demand_bytes, weather_checksum, azimuth_res, slope_res, **params):
+    """Hex key of one optimizer run; ``params`` are the cost parameters."""
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(demand_bytes).digest())
+    meta = {"runner": runner, "weather": weather_checksum, "azimuth_res": azimuth_res, "slope_res": slope_res, **params}
+    digest.update(json.dumps(meta, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_bytes=64 << 20, disk_dir=None, disk_max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> encoded result
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key):
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(encoded)
+        encoded = self._read_disk(key)
+        with self._lock:
+            if encoded is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, encoded)
+        return json.loads(encoded)
+
+    def put(self, key, result):
+        encoded = json.dumps(result, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._remember(key, encoded)
+        self._write_disk(key, encoded)
+
+    def _remember(self, key, encoded):
+        if len(encoded) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        self._bytes += len(encoded) - (len(previous) if previous is not None else 0)
+        self._entries[key] = encoded
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    # ------------------------
+    # Disk tier
+    # ------------------------
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                encoded = f.read()
+            os.utime(self._path(key))  # mtime is the disk tier's recency
+            return encoded
+        except OSError:
+            return None
+
+    def _write_disk(self, key, encoded):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(encoded)
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += len(encoded)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _disk_files(self):
+        """(mtime_ns, size, path) of every cached result on disk."""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime_ns, stat.st_size, path))
+        return files
+
+    def _evict_disk(self):
+        files = sorted(self._disk_files())
+        self._disk_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            os.remove(path)
+            self._disk_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes if self.disk_dir else None,
+            }
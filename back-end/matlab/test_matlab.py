@@ -1,27 +1,69 @@
+import glob
 import io
+import os
+import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
+import numpy as np
+import scipy.io
 
 from main import app  # adjust if your file is named differently
+from optimizer import optimize, sweep, load_cube, PPV_MAX, PV_COST, ELECTRICITY_COSTS, PV_LIFETIME
+import pvcube
+import transfer
+from result_cache import ResultCache
+from cube_cache import CubeCache
 
 client = TestClient(app)
 
 # Mock response for requests.get
 class MockResponse:
-    def __init__(self, content=b"weather,data", status_code=200):
+    def __init__(self, content=b"weather,data", status_code=200, headers=None):
         self.content = content
         self.status_code = status_code
+        self.headers = headers or {}
 
-@patch("requests.get", return_value=MockResponse())
-@patch("subprocess.run")
-def test_run_matlab(mock_run, mock_get):
-    # Mock subprocess result
-    mock_run.return_value = MagicMock(
-        returncode=0,
-        stdout=json.dumps({"energy": 1234}),
-        stderr=""
-    )
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def json(self):
+        return json.loads(self.content)
+
+def savedata_get(content=b"weather,data", checksum=None):
+    """requests.get stand-in: resolveFile answers with ``checksum``, getFile with ``content``."""
+    def get(url, **kwargs):
+        if url.endswith("/resolveFile"):
+            return MockResponse(json.dumps({"path": None, "shared": False, "checksum": checksum}).encode())
+        return MockResponse(content)
+    return get
+
+# Stands in for a warm Octave interpreter: answers every job line like calculation.m
+FAKE_OCTAVE = r"""
+import sys, time
+for line in sys.stdin:
+    if "slow" in line:
+        time.sleep(5)
+    print('{"energy": 1234}' if "'" in line else "error: parse error")
+    print("__PV_JOB_DONE__", flush=True)
+"""
+
+def fake_octave_pool(**kwargs):
+    from worker_pool import OctaveWorker, WorkerPool
+    return WorkerPool(factory=lambda: OctaveWorker(command=[sys.executable, "-c", FAKE_OCTAVE]), **kwargs)
+
+@patch("requests.get", side_effect=savedata_get())
+def test_run_matlab(mock_get, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "_octave_pool", fake_octave_pool(size=1))
 
     # Create a fake CSV file
     demand_file_content = b"time,power\n0,10\n1,20"
@@ -34,7 +76,7 @@ def test_run_matlab(mock_run, mock_get):
         "year": 2024
     }
 
-    response = client.post("/runMatlab", data=data, files=files)
+    response = client.post("/runMatlab", data=data, files=files, headers={"X-Request-ID": "trace-1"})
 
     # Check status code
     assert response.status_code == 200
@@ -43,12 +85,437 @@ def test_run_matlab(mock_run, mock_get):
     assert response.json() == {"output": {"energy": 1234}}
 
     # Check that requests.get was called correctly
-    mock_get.assert_called_once_with(
+    mock_get.assert_called_with(
         "http://savedata:8505/getFile",
-        params={"filename": "weather.csv", "year": 2024}
+        params={"filename": "weather.csv", "year": 2024},
+        headers={"X-Request-ID": "trace-1"},  # the caller's trace continues to savedata
+        stream=True,
     )
 
-    # Check that subprocess.run was called with correct arguments
-    args = mock_run.call_args[0][0]
-    assert args[0] == "octave"
-    assert "calculation.m" in args
+    # The staged inputs are removed once the worker is done with them
+    assert not glob.glob(os.path.join("tmp", "*demand.csv")) and not glob.glob(os.path.join("tmp", "*weather.csv*"))
+
+@patch("requests.get", side_effect=savedata_get())
+def test_concurrent_matlab_runs_stage_their_own_files(mock_get, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "_octave_pool", fake_octave_pool(size=1))
+    files = {"demandProfile": ("demand.csv", b"time,power\n0,10\n1,20", "text/csv")}
+    data = {"azimuth": 10, "slope": 20, "weatherData": "weather.csv", "year": 2024}
+
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(lambda _: client.post("/runMatlab", data=data, files=files), range(4)))
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert all(r.json() == {"output": {"energy": 1234}} for r in responses)
+    assert not glob.glob(os.path.join("tmp", "*demand.csv")) and not glob.glob(os.path.join("tmp", "*weather.csv*"))
+
+def test_octave_job_command_runs_calculation_with_args():
+    from worker_pool import OctaveWorker
+    worker = OctaveWorker.__new__(OctaveWorker)
+    worker.script = "calculation"
+    command = worker.job_command("tmp/demand.csv", "tmp/it's.mat", 10, 20)
+    assert "args = {'tmp/demand.csv', 'tmp/it''s.mat', '10', '20'};" in command
+    assert "try, calculation;" in command and command.endswith("fflush(stdout);\n")
+    assert "'20', '30'};" in worker.job_command("tmp/demand.csv", "tmp/w.mat", 10, 20, max_kwp=30)
+
+def test_worker_pool_bounds_queue_times_out_and_recycles():
+    import asyncio
+    from worker_pool import JobTimeout, PoolFull
+
+    async def scenario():
+        pool = fake_octave_pool(size=1, queue_size=1, timeout=0.5, max_jobs=2)
+        job = {"demand_path": "d", "weather_path": "w", "azimuth": 1, "slope": 1}
+        assert await pool.submit(job) == {"energy": 1234}
+
+        slow = asyncio.ensure_future(pool.submit({**job, "demand_path": "slow"}))
+        await asyncio.sleep(0.1)
+        queued = asyncio.ensure_future(pool.submit(job))
+        await asyncio.sleep(0)
+        try:
+            await pool.submit(job)
+        except PoolFull:
+            pass
+        else:
+            raise AssertionError("expected PoolFull")
+        try:
+            await slow
+        except JobTimeout:
+            pass
+        else:
+            raise AssertionError("expected JobTimeout")
+        assert await queued == {"energy": 1234}  # served by a fresh interpreter
+        assert await pool.submit(job) == {"energy": 1234}
+        await asyncio.sleep(0.2)  # the worker retires after handing back its second result
+        stats = pool.stats()
+        await pool.shutdown()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["timeouts"] == 1 and stats["completed"] == 3
+    assert stats["recycled"] == 2  # the timed-out interpreter, then one after max_jobs
+
+
+# ------------------------
+# NumPy optimizer
+# ------------------------
+def reference_greedy(demand, cube):
+    """Direct port of the calculation.m loop, one orientation at a time."""
+    num_slopes, num_azimuths, _ = cube.shape
+    pd = demand.astype(np.float32)
+    distribution = np.zeros((num_slopes, num_azimuths))
+    cost_reduction = np.inf
+    while cost_reduction > PV_COST * PPV_MAX:
+        best = None
+        for a in range(num_azimuths):          # column-major, like min(x(:))
+            for s in range(num_slopes):
+                gain = np.minimum(pd, np.float32(PPV_MAX) * cube[s, a]).astype(np.float64).sum()
+                if best is None or gain > best[0]:
+                    best = (gain, s, a)
+        gain, s, a = best
+        distribution[s, a] += PPV_MAX
+        cost_reduction = gain * ELECTRICITY_COSTS * PV_LIFETIME
+        pd = np.maximum(pd - np.float32(PPV_MAX) * cube[s, a], 0)
+    return distribution, pd
+
+def make_inputs(seed=0, num_slopes=4, num_azimuths=5, hours=8760):
+    rng = np.random.default_rng(seed)
+    # Each azimuth peaks at a different time of day, so several orientations get picked
+    shift = np.linspace(-3, 3, num_azimuths).reshape(1, -1, 1)
+    hour_of_day = (np.arange(hours) % 24).reshape(1, 1, -1)
+    daylight = np.clip(np.cos((hour_of_day - 12 - shift) / 12 * np.pi), 0, None)
+    scale = rng.uniform(0.5, 1.0, (num_slopes, num_azimuths, 1))
+    cube = (scale * daylight * 800 * rng.uniform(0.3, 1.0, hours)).astype(np.float32)
+    demand = rng.uniform(20000, 60000, hours)
+    return demand, cube
+
+def test_optimize_matches_reference_loop():
+    demand, cube = make_inputs()
+    result = optimize(demand, cube, azimuth_res=45, slope_res=30)
+
+    distribution, pd = reference_greedy(demand, cube)
+    expected = {}
+    for a in range(cube.shape[1]):
+        for s in range(cube.shape[0]):
+            if distribution[s, a]:
+                expected[f"panel{len(expected) + 1}"] = {
+                    "kwp": int(distribution[s, a]), "azimuth": -90 + a * 45, "slope": s * 30
+                }
+
+    assert len(result["panels"]) > 1
+    assert result["panels"] == expected
+    assert result["energy_from_grid"] == round(float(demand.sum()), 2)
+    assert result["ppv_usable"] == round(float(np.sum(demand - pd)), 2)
+
+def test_parallel_scoring_matches_serial():
+    from optimizer import ParallelScorer, score_all
+    demand, cube = make_inputs(num_slopes=7, num_azimuths=9)
+    flat = cube.reshape(-1, cube.shape[2])
+    scorer = ParallelScorer(flat, workers=4, chunk_rows=5)
+    try:
+        np.testing.assert_array_equal(scorer.score(demand.astype(np.float32), np.float32(10)),
+                                      score_all(flat, demand.astype(np.float32), np.float32(10)))
+    finally:
+        scorer.close()
+    for lazy in (False, True):
+        assert optimize(demand, cube, 20, 15, lazy=lazy, workers=3) == optimize(demand, cube, 20, 15)
+
+def test_optimize_rejects_mismatched_hours():
+    demand, cube = make_inputs(hours=48)
+    try:
+        optimize(demand[:24], cube, 45, 30)
+    except ValueError as e:
+        assert "hours" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_run_optimizer_endpoint(tmp_path):
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    cells = np.empty(cube.shape[:2], dtype=object)
+    for s in range(cube.shape[0]):
+        for a in range(cube.shape[1]):
+            cells[s, a] = cube[s, a].reshape(-1, 1)
+    weather_file = tmp_path / "weather.mat"
+    scipy.io.savemat(weather_file, {"all_Ppv_data": cells})
+    demand_file = io.BytesIO()
+    scipy.io.savemat(demand_file, {"Pd": demand.reshape(-1, 1)})
+
+    with patch("requests.get", side_effect=savedata_get(weather_file.read_bytes())):
+        response = client.post(
+            "/runOptimizer",
+            data={"azimuth": 90, "slope": 90, "weatherData": "weather.mat", "year": 2024},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        )
+
+    assert response.status_code == 200
+    output = response.json()["output"]
+    assert output == optimize(demand, cube, 90, 90)
+    assert response.headers["X-Request-ID"]
+
+    metrics = client.get("/metrics").text
+    assert 'optimizer_seconds_count{runner="numpy"}' in metrics
+    assert 'cube_load_seconds_count{source="download"}' in metrics
+    assert 'octave_pool_jobs{state="queued"}' in metrics
+
+def test_concurrent_optimizer_runs_with_same_upload_name(tmp_path, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "_result_cache", ResultCache(0))
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    weather_file = tmp_path / "weather.pvc"
+    mapped = pvcube.create_cube(str(weather_file), 90, 90, 52.0, 5.0, 2024)
+    mapped[:] = cube
+    mapped.flush()
+    demand_file = io.BytesIO()
+    scipy.io.savemat(demand_file, {"Pd": demand.reshape(-1, 1)})
+
+    def post(_):
+        return client.post(
+            "/runOptimizer",
+            data={"azimuth": 90, "slope": 90, "weatherData": "weather.pvc", "year": 2024},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        )
+
+    with patch("requests.get", side_effect=savedata_get(weather_file.read_bytes())):
+        with ThreadPoolExecutor(4) as pool:
+            responses = list(pool.map(post, range(4)))
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert all(r.json()["output"] == optimize(demand, cube, 90, 90) for r in responses)
+
+def test_lazy_optimize_matches_exhaustive():
+    for seed in range(3):
+        demand, cube = make_inputs(seed=seed, num_slopes=6, num_azimuths=7)
+        assert optimize(demand, cube, 30, 15, lazy=True) == optimize(demand, cube, 30, 15)
+
+def test_lazy_optimize_breaks_ties_like_exhaustive():
+    demand, cube = make_inputs(num_slopes=3, num_azimuths=4)
+    cube[:] = cube[1, 2]  # every orientation scores the same
+    assert optimize(demand, cube, 60, 45, lazy=True) == optimize(demand, cube, 60, 45)
+
+def test_sweep_matches_individual_runs():
+    demand, cube = make_inputs(num_slopes=4, num_azimuths=5)
+    scenarios = [
+        {},
+        {"electricity_costs": 0.30 / 1000, "lifetime": 25},
+        {"pv_cost": 800, "max_kwp": 35},
+        {"step_kwp": 2.5, "max_kwp": 12},
+        {"step_kwp": 2.5, "pv_cost": 2000},
+    ]
+    results = sweep(demand, cube, 30, 30, scenarios, lazy=True)
+    for scenario, result in zip(scenarios, results):
+        assert result == optimize(demand, cube, 30, 30, **scenario)
+
+def test_max_kwp_caps_total_installed_power():
+    demand, cube = make_inputs(num_slopes=3, num_azimuths=4)
+    uncapped = optimize(demand, cube, 60, 45)
+    capped = optimize(demand, cube, 60, 45, max_kwp=25)
+    assert sum(p["kwp"] for p in uncapped["panels"].values()) > 25
+    assert sum(p["kwp"] for p in capped["panels"].values()) == 20
+    assert optimize(demand, cube, 60, 45, max_kwp=5)["panels"] == {}
+
+def test_run_sweep_endpoint(tmp_path):
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    weather_file = tmp_path / "weather.pvc"
+    mapped = pvcube.create_cube(str(weather_file), 90, 90, 52.0, 5.0, 2024)
+    mapped[:] = cube
+    mapped.flush()
+    del mapped
+    demand_file = io.BytesIO()
+    scipy.io.savemat(demand_file, {"Pd": demand.reshape(-1, 1)})
+    scenarios = [{"tariff": 0.25, "max_kwp": 40}, {"step_kwp": 5}]
+
+    with patch("requests.get", side_effect=savedata_get(weather_file.read_bytes())):
+        response = client.post(
+            "/runSweep",
+            data={"azimuth": 90, "slope": 90, "weatherData": "weather.pvc", "year": 2024, "scenarios": json.dumps(scenarios)},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        )
+        rejected = client.post(
+            "/runSweep",
+            data={"azimuth": 90, "slope": 90, "weatherData": "weather.pvc", "year": 2024, "scenarios": '[{"rate": 1}]'},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        )
+
+    results = response.json()["results"]
+    assert [r["scenario"] for r in results] == scenarios
+    assert results[0]["output"] == optimize(demand, cube, 90, 90, electricity_costs=0.25 / 1000, max_kwp=40)
+    assert results[1]["output"] == optimize(demand, cube, 90, 90, step_kwp=5)
+    assert rejected.json() == {"error": "Unknown scenario parameters: rate"}
+
+def test_load_cube_maps_pvc_in_place(tmp_path):
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    path = str(tmp_path / "weather.pvc")
+    mapped = pvcube.create_cube(path, 90, 90, 52.0, 5.0, 2024)
+    mapped[:] = cube
+    mapped.flush()
+    del mapped
+
+    loaded = load_cube(path)
+    assert isinstance(loaded, np.memmap)
+    assert optimize(demand, loaded, 90, 90) == optimize(demand, cube, 90, 90)
+
+def test_run_optimizer_picks_year_of_multi_year_cube(tmp_path):
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    weather_file = tmp_path / "weather.pvc"
+    mapped = pvcube.create_cube(str(weather_file), 90, 90, 52.0, 5.0, 2019, hours=2 * 8760, end_year=2020)
+    mapped[:, :, :8760], mapped[:, :, 8760:] = cube, cube * 0.5
+    mapped.flush()
+    del mapped
+    demand_file = io.BytesIO()
+    scipy.io.savemat(demand_file, {"Pd": demand.reshape(-1, 1)})
+
+    outputs = {}
+    with patch("requests.get", side_effect=savedata_get(weather_file.read_bytes())):
+        for weather_year in ("2019", "worst", "average"):
+            outputs[weather_year] = client.post(
+                "/runOptimizer",
+                data={"azimuth": 90, "slope": 90, "weatherData": "weather.pvc", "year": 2019, "weatherYear": weather_year},
+                files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+            ).json()
+        rejected = client.post(
+            "/runOptimizer",
+            data={"azimuth": 90, "slope": 90, "weatherData": "weather.pvc", "year": 2019, "weatherYear": "2031"},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        ).json()
+
+    assert outputs["2019"]["output"] == optimize(demand, cube, 90, 90)
+    assert outputs["worst"]["output"] == optimize(demand, cube * 0.5, 90, 90)
+    assert outputs["average"]["output"] == optimize(demand, cube * 0.75, 90, 90)
+    assert "2019..2020" in rejected["error"]
+
+def test_run_optimizer_reads_shared_file_in_place(tmp_path, monkeypatch):
+    import main
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    shared_file = str(tmp_path / "object.pvc")
+    mapped = pvcube.create_cube(shared_file, 90, 90, 52.0, 5.0, 2024)
+    mapped[:] = cube
+    mapped.flush()
+    del mapped
+    monkeypatch.setattr(main, "SHARED_DATA_DIR", str(tmp_path))
+
+    resolved = MagicMock(status_code=200)
+    resolved.json.return_value = {"path": shared_file, "shared": True}
+    demand_file = io.BytesIO()
+    scipy.io.savemat(demand_file, {"Pd": demand.reshape(-1, 1)})
+
+    with patch("requests.get", return_value=resolved) as mock_get:
+        response = client.post(
+            "/runOptimizer",
+            data={"azimuth": 90, "slope": 90, "weatherData": "weather.pvc", "year": 2024},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        )
+
+    assert response.json()["output"] == optimize(demand, cube, 90, 90)
+    assert mock_get.call_args[0][0].endswith("/resolveFile")
+    assert os.path.exists(shared_file)
+
+def test_download_resumes_with_range_and_checks_checksum(tmp_path):
+    import hashlib, requests
+    content = bytes(range(256)) * 64
+    checksum = {transfer.CHECKSUM_HEADER: hashlib.sha256(content).hexdigest()}
+
+    class DroppedResponse(MockResponse):
+        def iter_content(self, chunk_size=1):
+            yield self.content[:1000]
+            raise requests.exceptions.ChunkedEncodingError("connection dropped")
+
+    responses = [DroppedResponse(content, 200, checksum), MockResponse(content[1000:], 206, checksum)]
+    dest = str(tmp_path / "weather.pvc")
+    with patch("requests.get", side_effect=responses) as mock_get:
+        transfer.download_file("http://savedata/getFile", dest, backoff=0, chunk_size=512)
+    assert mock_get.call_args.kwargs["headers"] == {"Range": "bytes=1000-"}
+    assert open(dest, "rb").read() == content and not os.path.exists(dest + ".part")
+
+    corrupt = {transfer.CHECKSUM_HEADER: "0" * 64}
+    with patch("requests.get", return_value=MockResponse(content, 200, corrupt)):
+        try:
+            transfer.download_file("http://savedata/getFile", str(tmp_path / "other.pvc"), retries=1, backoff=0)
+        except transfer.TransferError:
+            pass
+        else:
+            raise AssertionError("expected TransferError")
+    assert not os.path.exists(tmp_path / "other.pvc")
+
+
+# ------------------------
+# Result cache
+# ------------------------
+def test_repeated_run_is_served_from_result_cache(tmp_path, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "_result_cache", ResultCache(disk_dir=str(tmp_path / "results")))
+    monkeypatch.setattr(main, "_cube_cache", CubeCache())
+    monkeypatch.setattr(main, "CUBE_CACHE_DIR", str(tmp_path / "cubes"))
+    demand, cube = make_inputs(num_slopes=2, num_azimuths=3)
+    weather_file = tmp_path / "weather.pvc"
+    mapped = pvcube.create_cube(str(weather_file), 90, 90, 52.0, 5.0, 2024)
+    mapped[:] = cube
+    mapped.flush()
+    del mapped
+    demand_file = io.BytesIO()
+    scipy.io.savemat(demand_file, {"Pd": demand.reshape(-1, 1)})
+
+    def run(slope=90):
+        return client.post(
+            "/runOptimizer",
+            data={"azimuth": 90, "slope": slope, "weatherData": "weather.pvc", "year": 2024},
+            files={"demandProfile": ("demand.mat", demand_file.getvalue(), "application/octet-stream")},
+        )
+
+    with patch("requests.get", side_effect=savedata_get(weather_file.read_bytes(), "ab" * 32)) as mock_get:
+        first, second = run(), run()
+        assert mock_get.call_count == 3  # the second run only asks savedata for the checksum
+        assert run(slope=45).headers["X-Cache"] == "MISS"
+        assert mock_get.call_count == 4  # a new result, but the cube comes from the cube cache
+    cube_stats = client.get("/cubeCacheStats").json()
+    assert cube_stats["hits"] == 1 and cube_stats["misses"] == 1
+    assert cube_stats["mapped_bytes"] == cube.nbytes and cube_stats["resident_bytes"] == 0
+    assert first.headers["X-Cache"] == "MISS" and second.headers["X-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert client.get("/cacheStats").json()["hits"] == 1
+
+    # A restarted service finds the result in the disk tier
+    monkeypatch.setattr(main, "_result_cache", ResultCache(disk_dir=str(tmp_path / "results")))
+    with patch("requests.get", side_effect=savedata_get(checksum="ab" * 32)):
+        assert run().json() == first.json()
+    assert client.get("/cacheStats").json()["disk_hits"] == 1
+
+def test_result_cache_evicts_least_recently_used_by_size():
+    cache = ResultCache(max_bytes=30)
+    cache.put("a", {"v": 1})  # 7 bytes each
+    cache.put("b", {"v": 2})
+    cache.put("c", {"v": 3})
+    cache.put("d", {"v": 4})
+    assert cache.get("a") == {"v": 1}
+    cache.put("e", {"v": 5})
+    assert cache.get("b") is None and cache.get("a") == {"v": 1}
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] == 28
+
+
+# ------------------------
+# Loaded-cube cache
+# ------------------------
+def test_cube_cache_shares_one_load_and_keeps_budget():
+    import threading, time
+    cache = CubeCache(max_bytes=2 * 4000)
+    loads = []
+    def slow_load():
+        loads.append(1)
+        time.sleep(0.2)
+        return np.zeros(1000, dtype=np.float32)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("a", slow_load))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(loads) == 1 and all(r is results[0] for r in results)
+
+    evicted = []
+    cache.on_evict = evicted.append
+    cache.get("b", lambda: np.ones(1000, dtype=np.float32))
+    cache.get("a", slow_load)  # "a" becomes most recent
+    cache.get("c", lambda: np.full(1000, 2, dtype=np.float32))
+    assert len(evicted) == 1 and evicted[0][0] == 1  # "b" went
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["resident_bytes"] == 8000
+    assert stats["misses"] == 3 and stats["shared_loads"] == 3 and stats["hits"] == 1
@@ -0,0 +1,115 @@
+"""
+Streaming, resumable and checksummed file transfers with savedata.
+
+Uploads are a raw PUT body streamed from disk. The SHA-256 of the whole file
+travels in X-Checksum-Sha256 and identifies the transfer: a HEAD first asks
+savedata how many bytes of that file it already holds (Upload-Offset), and
+the PUT continues from there. savedata appends to a partial file and renames
+it into place only once the checksum matches.
+
+Downloads stream into a ``.part`` file next to the destination, continue
+with an HTTP Range request after a dropped connection, and are renamed into
+place once their SHA-256 matches the one savedata sends.
+
+Memory use is one chunk whatever the file size. This module is kept
+identical in pythoncalls and matlab, because every service image is built
+from its own directory.
+"""
+import hashlib
+import os
+import time
+import requests
+import telemetry
+
+CHUNK_SIZE = 1 << 20
+CHECKSUM_HEADER = "X-Checksum-Sha256"
+RETRYABLE = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+TRANSFER_BYTES = telemetry.histogram(
+    "transfer_bytes", "Bytes moved per completed transfer with savedata", ("direction",), telemetry.BYTE_BUCKETS
+)
+TRANSFER_SECONDS = telemetry.histogram("transfer_seconds", "Duration of completed transfers with savedata", ("direction",))
+
+
+class TransferError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """sha256 object over the file's current contents (empty if it does not exist)."""
+    checksum = hashlib.sha256()
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                checksum.update(chunk)
+    return checksum
+
+
+def upload_file(url, path, params=None, retries=3, backoff=1.0, chunk_size=CHUNK_SIZE):
+    """Stream ``path`` to a savedata upload URL, resuming after interruptions."""
+    digest = hash_file(path, chunk_size).hexdigest()
+    size = os.path.getsize(path)
+    started, sent = time.perf_counter(), 0
+    for attempt in range(retries + 1):
+        try:
+            head = requests.head(url, params=params, headers={CHECKSUM_HEADER: digest, **telemetry.trace_headers()})
+            offset = int(head.headers.get("Upload-Offset", 0))
+            with open(path, "rb") as f:
+                f.seek(offset)
+                headers = {
+                    CHECKSUM_HEADER: digest, "Upload-Offset": str(offset), "Upload-Length": str(size),
+                    **telemetry.trace_headers(),
+                }
+                response = requests.put(url, params=params, headers=headers, data=iter(lambda: f.read(chunk_size), b""))
+            sent += size - offset
+        except RETRYABLE:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code != 409:  # 409: the held offset moved, ask again
+                response.raise_for_status()
+                TRANSFER_BYTES.observe(sent, direction="upload")
+                TRANSFER_SECONDS.observe(time.perf_counter() - started, direction="upload")
+                return response.json()
+        time.sleep(backoff * 2 ** attempt)
+    raise TransferError(f"Upload of '{os.path.basename(path)}' did not complete after {retries + 1} attempts")
+
+
+def download_file(url, dest, params=None, retries=3, backoff=1.0, chunk_size=CHUNK_SIZE):
+    """Stream a savedata file to ``dest`` through ``dest``.part, resuming with Range."""
+    partial = dest + ".part"
+    started, received = time.perf_counter(), 0
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        headers.update(telemetry.trace_headers())
+        try:
+            with requests.get(url, params=params, headers=headers, stream=True) as response:
+                if response.status_code == 416:  # stale partial beyond the end of the file
+                    os.remove(partial)
+                    continue
+                if response.status_code not in (200, 206):
+                    raise TransferError(f"Failed to download file: {response.status_code}", response.status_code)
+                expected = response.headers.get(CHECKSUM_HEADER)
+                resumed = response.status_code == 206
+                checksum = hash_file(partial, chunk_size) if resumed else hashlib.sha256()
+                with open(partial, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_content(chunk_size):
+                        checksum.update(chunk)
+                        f.write(chunk)
+                        received += len(chunk)
+        except RETRYABLE:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+
+        if expected is None or checksum.hexdigest() == expected:
+            os.replace(partial, dest)
+            TRANSFER_BYTES.observe(received, direction="download")
+            TRANSFER_SECONDS.observe(time.perf_counter() - started, direction="download")
+            return dest
+        os.remove(partial)
+    raise TransferError(f"Download of '{os.path.basename(dest)}' failed its checksum after {retries + 1} attempts")
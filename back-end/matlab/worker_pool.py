@@ -0,0 +1,204 @@
+"""
+Pool of long-lived Octave workers for /runMatlab.
+
+Each worker keeps one ``octave`` interpreter running and feeds it jobs over
+stdin, so a run no longer pays interpreter startup. Jobs wait in a bounded
+queue; when it is full, submit() fails at once instead of piling up work.
+A job that runs past its timeout gets its interpreter killed. A worker is
+also recycled after ``max_jobs`` jobs, so leaks in a long-lived session stay
+bounded. Jobs run in worker threads, so the event loop never blocks.
+"""
+import asyncio
+import json
+import os
+import selectors
+import subprocess
+import time
+
+DONE = "__PV_JOB_DONE__"
+FAILED = "__PV_JOB_FAILED__"
+
+
+class PoolFull(Exception):
+    pass
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class WorkerError(Exception):
+    pass
+
+
+def octave_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class OctaveWorker:
+    """One warm interpreter running calculation.m once per job."""
+
+    def __init__(self, script="calculation.m", command=("octave", "--no-gui", "--no-window-system", "--quiet", "--norc")):
+        self.script = os.path.splitext(script)[0]
+        self.process = subprocess.Popen(
+            list(command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, "DISPLAY": ""},
+        )
+        self._buffer = b""
+
+    def job_command(self, demand_path, weather_path, azimuth, slope, max_kwp=None):
+        """Octave statements for one job; calculation.m reads ``args`` when it is set."""
+        values = (demand_path, weather_path, azimuth, slope) + ((max_kwp,) if max_kwp is not None else ())
+        args = ", ".join(octave_string(v) for v in values)
+        return (
+            f"clear -variables; args = {{{args}}}; "
+            f"try, {self.script}; catch err, fprintf('{FAILED} %s\\n', err.message); end; "
+            f"fprintf('{DONE}\\n'); fflush(stdout);\n"
+        )
+
+    def run(self, job, timeout):
+        """Output dict of calculation.m; raises JobTimeout or WorkerError."""
+        self.process.stdin.write(self.job_command(**job).encode("utf-8"))
+        self.process.stdin.flush()
+        lines = self._read_until_done(time.monotonic() + timeout)
+        failed = [line for line in lines if line.startswith(FAILED)]
+        if failed:
+            raise WorkerError(failed[0][len(FAILED):].strip())
+        output = [line for line in lines if line.startswith("{")]
+        if not output:
+            raise WorkerError("\n".join(lines) or "calculation.m printed no result")
+        try:
+            return json.loads(output[-1])
+        except ValueError:
+            raise WorkerError(output[-1]) from None
+
+    def _read_until_done(self, deadline):
+        lines = []
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.process.stdout, selectors.EVENT_READ)
+            while True:
+                while b"\n" in self._buffer:
+                    line, self._buffer = self._buffer.split(b"\n", 1)
+                    line = line.decode("utf-8", "replace").rstrip("\r")
+                    if line == DONE:
+                        return lines
+                    lines.append(line)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    raise JobTimeout("Optimization did not finish within the time limit")
+                chunk = os.read(self.process.stdout.fileno(), 65536)
+                if not chunk:
+                    raise WorkerError("\n".join(lines) or "Octave exited unexpectedly")
+                self._buffer += chunk
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class WorkerPool:
+    """``size`` workers made by ``factory``, fed from a queue of at most ``queue_size`` jobs."""
+
+    def __init__(self, factory=OctaveWorker, size=2, queue_size=16, timeout=300.0, max_jobs=100):
+        self.factory = factory
+        self.size = size
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.busy = 0
+        self.queue = None
+        self._loop = None
+        self._tasks = []
+
+    def start(self):
+        """Start the workers on the running event loop; their interpreters warm up right away."""
+        self._loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [self._loop.create_task(self._serve()) for _ in range(self.size)]
+
+    async def submit(self, job):
+        """Run ``job`` on the next free worker; raises PoolFull when the queue is full."""
+        if self._loop is not asyncio.get_running_loop():
+            self.start()
+        future = self._loop.create_future()
+        try:
+            self.queue.put_nowait((job, future))
+        except asyncio.QueueFull:
+            raise PoolFull(f"Optimizer queue is full ({self.queue_size} jobs waiting)") from None
+        return await future
+
+    async def _spawn(self):
+        try:
+            return await asyncio.to_thread(self.factory)
+        except OSError:
+            return None  # retried when the next job arrives
+
+    async def _retire(self, worker):
+        await asyncio.to_thread(worker.close)
+        self.recycled += 1
+
+    async def _serve(self):
+        worker, jobs_done = await self._spawn(), 0
+        try:
+            while True:
+                job, future = await self.queue.get()
+                if future.cancelled():
+                    continue
+                self.busy += 1
+                try:
+                    if worker is None or not worker.alive():
+                        worker, jobs_done = await asyncio.to_thread(self.factory), 0
+                    result = await asyncio.to_thread(worker.run, job, self.timeout)
+                except (JobTimeout, WorkerError, OSError) as e:
+                    self.failed += 1
+                    self.timeouts += isinstance(e, JobTimeout)
+                    # A timed-out interpreter is still busy with the job; a dead one is gone
+                    if worker is not None and (isinstance(e, JobTimeout) or not worker.alive()):
+                        await self._retire(worker)
+                        worker = None
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    self.completed += 1
+                    jobs_done += 1
+                    if not future.cancelled():
+                        future.set_result(result)
+                    if jobs_done >= self.max_jobs:
+                        await self._retire(worker)
+                        worker = await self._spawn()
+                        jobs_done = 0
+                finally:
+                    self.busy -= 1
+        finally:
+            if worker is not None:
+                worker.close()
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "busy": self.busy,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+        }
@@ -0,0 +1,75 @@
+"""
+Coarse-to-fine orientation search for getData's adaptive mode.
+
+The grid is first sampled every ``coarse`` degrees. The best orientations by
+annual yield mark candidate regions, which are resampled at half the spacing
+around each of them, level after level, down to the requested resolution.
+Only visited orientations are fetched; every other row of the cube stays
+zero, which the optimizer never picks.
+"""
+
+
+def axis_indices(n, step):
+    """Every ``step``-th index of an axis, always including both ends."""
+    indices = list(range(0, n, step))
+    if indices[-1] != n - 1:
+        indices.append(n - 1)
+    return indices
+
+
+def coarse_indices(num_slopes, num_azimuths, slope_step, azimuth_step):
+    return {(s, a) for s in axis_indices(num_slopes, slope_step) for a in axis_indices(num_azimuths, azimuth_step)}
+
+
+def select_regions(yields, top_k, slope_step, azimuth_step):
+    """Best orientations by yield, more than one step apart from each other."""
+    centers = []
+    for (s, a), _ in sorted(yields.items(), key=lambda item: (-item[1], item[0])):
+        if all(abs(s - cs) > slope_step or abs(a - ca) > azimuth_step for cs, ca in centers):
+            centers.append((s, a))
+            if len(centers) == top_k:
+                break
+    return centers
+
+
+def refine_indices(centers, num_slopes, num_azimuths, slope_step, azimuth_step, new_slope_step, new_azimuth_step):
+    """Orientations at the new spacing within one old step around each center."""
+    indices = set()
+    for s, a in centers:
+        for ds in range(-slope_step, slope_step + 1, new_slope_step):
+            for da in range(-azimuth_step, azimuth_step + 1, new_azimuth_step):
+                if 0 <= s + ds < num_slopes and 0 <= a + da < num_azimuths:
+                    indices.add((s + ds, a + da))
+    return indices
+
+
+async def refine(fetch_level, cube, slope_step, azimuth_step, top_k):
+    """
+    Run the coarse-to-fine search; steps are in grid indices, not degrees.
+
+    ``fetch_level(indices)`` fills the given (s, a) rows of ``cube`` and
+    returns (number served from cache, failed orientations). Returns the
+    visited indices with the totals over all levels.
+    """
+    num_slopes, num_azimuths = cube.shape[:2]
+    level = coarse_indices(num_slopes, num_azimuths, slope_step, azimuth_step)
+    fetched, cached, failed = set(), 0, []
+
+    while True:
+        level -= fetched
+        level_cached, level_failed = await fetch_level(sorted(level))
+        cached += level_cached
+        failed += level_failed
+        fetched |= level
+        if slope_step == 1 and azimuth_step == 1:
+            break
+
+        yields = {idx: float(cube[idx].sum()) for idx in fetched}
+        centers = select_regions(yields, top_k, slope_step, azimuth_step)
+        new_slope_step, new_azimuth_step = max(1, slope_step // 2), max(1, azimuth_step // 2)
+        level = refine_indices(
+            centers, num_slopes, num_azimuths, slope_step, azimuth_step, new_slope_step, new_azimuth_step
+        )
+        slope_step, azimuth_step = new_slope_step, new_azimuth_step
+
+    return fetched, cached, failed
@@ -0,0 +1,73 @@
+"""
+Benchmark: size and decode speed of the compressed .pvz cube format.
+
+Encodes a stored .pvc cube (or a synthetic 5x5 degree cube built by the
+local transposition model) at several precisions and compares it with
+plain zlib over the raw float32 bytes.
+
+    python bench_codec.py [--cube data/2019/all_Ppv_data_azires_5_sloperes_5_52.00000_5.00000.pvc]
+"""
+import argparse
+import os
+import tempfile
+import time
+import zlib
+import numpy as np
+import pvcodec
+import pvcube
+import transposition
+
+
+def synthetic_cube(lat=52.0, lon=5.0, azimuth_res=5, slope_res=5, seed=0):
+    """Random cloudiness through the local model, so day/night and orientation structure are realistic."""
+    rng = np.random.default_rng(seed)
+    hours = np.arange(transposition.HOURS)
+    times = np.datetime64("2019-01-01T00:10") + hours.astype("timedelta64[h]")
+    vectors, _ = transposition.sun_position(times, lat, lon)
+    clearness = rng.beta(2, 2, hours.size)
+    up = np.clip(vectors[2], 0, None)
+    components = {
+        "time": times,
+        "Gb": 900 * up * clearness,
+        "Gd": 120 * up * (1.2 - clearness),
+        "T2m": 10 + 8 * np.sin(2 * np.pi * (hours / 8760 - 0.3)),
+        "WS10m": rng.uniform(0, 8, hours.size),
+    }
+    azimuths, slopes = pvcube.grid_axes(azimuth_res, slope_res)
+    out = np.zeros((len(slopes), len(azimuths), hours.size), dtype=np.float32)
+    return transposition.compute_cube(components, lat, lon, slopes, azimuths, out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cube", help=".pvc file to encode instead of a synthetic cube")
+    parser.add_argument("--precisions", nargs="+", type=float, default=[0.01, 0.1, 1.0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cube = np.asarray(pvcube.open_cube(args.cube)[0]) if args.cube else synthetic_cube()
+    raw = cube.astype("<f4").tobytes()
+    started = time.perf_counter()
+    zlib_size = len(zlib.compress(raw, 6))
+    print(f"cube {cube.shape}, raw {len(raw) / 1e6:.1f} MB")
+    print(f"{'zlib float32':>16}: ratio {len(raw) / zlib_size:5.2f}  encode {time.perf_counter() - started:5.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cube" + pvcodec.EXTENSION)
+        for precision in args.precisions:
+            stats = pvcodec.encode(cube, path, precision=precision)
+            decode = pvcodec.decode_throughput(path, args.repeat)
+            reader = pvcodec.PvzReader(path, cache_chunks=0)
+            started = time.perf_counter()
+            reader.orientation(cube.shape[0] // 2, cube.shape[1] // 2)
+            single = time.perf_counter() - started
+            error = float(np.abs(reader.to_dense() - cube).max())
+            print(
+                f"{'pvz ' + str(precision) + ' W':>16}: ratio {stats['ratio']:5.2f}  encode {stats['encode_s']:5.2f} s  "
+                f"decode {decode['decode_mb_per_s']:7.1f} MB/s  one orientation {single * 1e3:5.1f} ms  "
+                f"max error {error:.3f} W"
+            )
+
+
+if __name__ == "__main__":
+    main()
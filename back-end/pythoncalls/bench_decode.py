@@ -0,0 +1,69 @@
+"""
+Micro-benchmark: decoding one seriescalc response into the hourly P column.
+
+Compares the dict-based path (json.loads + decode_hourly) with the
+byte-level column extraction used by PvgisClient.fetch_hourly.
+
+    python bench_decode.py [--repeat 200]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+from pvgis_client import decode_hourly, decode_hourly_content
+
+
+def sample_payload(hours=8760, seed=0):
+    """Bytes shaped like a PVGIS seriescalc JSON response, meta block included."""
+    rng = np.random.default_rng(seed)
+    power = np.round(rng.uniform(0, 900, hours) * (np.arange(hours) % 24 > 6), 2)
+    hourly = [
+        {"time": f"2019{1 + i // 744:02d}{1 + i // 24 % 31:02d}:{i % 24:02d}10", "P": float(p),
+         "G(i)": round(float(p) * 1.2, 2), "H_sun": 12.3, "T2m": 8.51, "WS10m": 3.1, "Int": 0.0}
+        for i, p in enumerate(power)
+    ]
+    data = {
+        "inputs": {"location": {"latitude": 52.0, "longitude": 5.0}},
+        "outputs": {"hourly": hourly},
+        "meta": {"outputs": {"hourly": {"variables": {"P": {"description": "PV system power", "units": "W"}}}}},
+    }
+    return json.dumps(data).encode()
+
+
+def measure(decode, content, repeat):
+    decode(content)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode(content)
+    per_call = (time.perf_counter() - started) / repeat
+
+    tracemalloc.start()
+    decode(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_call, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    content = sample_payload()
+    paths = {
+        "json + dicts": lambda c: decode_hourly(json.loads(c)),
+        "column extract": decode_hourly_content,
+    }
+    np.testing.assert_array_equal(paths["json + dicts"](content), paths["column extract"](content))
+
+    print(f"payload {len(content) / 1e6:.2f} MB, {args.repeat} repeats")
+    baseline = None
+    for name, decode in paths.items():
+        per_call, peak = measure(decode, content, args.repeat)
+        baseline = baseline or per_call
+        print(f"{name:>15}: {per_call * 1e3:7.2f} ms/call  peak {peak / 1e6:6.2f} MB  speedup {baseline / per_call:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
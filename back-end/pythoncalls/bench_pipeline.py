@@ -0,0 +1,150 @@
+"""
+Benchmark stages of the cube pipeline: PVGIS fetch, serialization and savedata transfers.
+
+    python bench_pipeline.py fetch --pvgis-url http://localhost:8600/api/v5_2/ [--resolution 15]
+    python bench_pipeline.py serialize [--resolution 5]
+    python bench_pipeline.py transfer --savedata-url http://localhost:8505 [--resolution 5]
+
+``fetch`` runs the getData fetch loop (PvgisClient + fetch_grid) over one
+grid against a PVGIS server, normally benchmarks/fake_pvgis.py. ``serialize``
+times the formats a built cube is written in: the .mat export of save_pv,
+the .pvc memmap and the .pvz codec. ``transfer`` uploads and downloads a
+cube through savedata's streaming endpoints.
+
+With --json the metrics are printed for benchmarks/run_benchmarks.py as
+one JSON object (name -> value, unit, better). ``better`` is "higher",
+"lower" or null for metrics that are reported but never compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import pvcodec
+import pvcube
+import transfer
+from pvgis_client import PvgisClient, fetch_grid
+
+
+def metric(value, unit, better):
+    return {"value": round(float(value), 4), "unit": unit, "better": better}
+
+
+def synthetic_cube(resolution, seed=0):
+    rng = np.random.default_rng(seed)
+    azimuths, slopes = pvcube.grid_axes(resolution, resolution)
+    hours = np.arange(pvcube.HOURS)
+    daylight = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None)
+    scale = rng.uniform(0.5, 1.0, (len(slopes), len(azimuths), 1))
+    return (900 * scale * daylight * rng.uniform(0.3, 1.0, hours.size)).astype(np.float32)
+
+
+def bench_fetch(args):
+    azimuths, slopes = pvcube.grid_axes(args.resolution, args.resolution)
+    tasks = [(s, a, sl, az) for s, sl in enumerate(slopes) for a, az in enumerate(azimuths)]
+    received = []
+
+    async def run():
+        async with PvgisClient(base_url=args.pvgis_url, concurrency=args.concurrency, max_concurrency=args.max_concurrency) as client:
+            failed = await fetch_grid(client, 52.0, 5.0, args.year, tasks, lambda s, a, hourly: received.append(hourly.size))
+            return failed, client.stats.summary(client.limiter)
+
+    started = time.perf_counter()
+    failed, stats = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    return {
+        "fetch.orientations_per_s": metric(len(received) / elapsed, "1/s", "higher"),
+        "fetch.latency_p95_s": metric(stats["latency_p95_s"], "s", "lower"),
+        # Retries follow the injected error rate; reported, not compared
+        "fetch.retries": metric(stats["retries"], "count", None),
+        "fetch.failed": metric(len(failed), "count", "lower"),
+    }
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best or np.inf, time.perf_counter() - started)
+    return best
+
+
+def bench_serialize(args):
+    cube = synthetic_cube(args.resolution)
+    raw_mb = cube.nbytes / 1e6
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        def write_pvc():
+            mapped = pvcube.create_cube(os.path.join(tmp, "cube.pvc"), args.resolution, args.resolution, 52.0, 5.0, 2019)
+            mapped[:] = cube
+            mapped.flush()
+
+        writers = {
+            "mat": lambda: pvcube.export_mat(cube, os.path.join(tmp, "cube.mat")),
+            "pvc": write_pvc,
+            "pvz": lambda: pvcodec.encode(cube, os.path.join(tmp, "cube.pvz")),
+        }
+        for name, write in writers.items():
+            seconds = timed(write, args.repeat)
+            size = os.path.getsize(os.path.join(tmp, f"cube.{name}"))
+            results[f"serialize.{name}_s"] = metric(seconds, "s", "lower")
+            results[f"serialize.{name}_mb_per_s"] = metric(raw_mb / seconds, "MB/s", "higher")
+            results[f"serialize.{name}_size_mb"] = metric(size / 1e6, "MB", "lower")
+    return results
+
+
+def bench_transfer(args):
+    cube = synthetic_cube(args.resolution)
+    name = f"bench_azires_{args.resolution}_{os.getpid()}.pvc"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, name)
+        mapped = pvcube.create_cube(path, args.resolution, args.resolution, 52.0, 5.0, args.year)
+        mapped[:] = cube
+        mapped.flush()
+        del mapped
+        size_mb = os.path.getsize(path) / 1e6
+
+        started = time.perf_counter()
+        transfer.upload_file(f"{args.savedata_url}/uploads/{args.year}/{name}", path)
+        upload = time.perf_counter() - started
+
+        started = time.perf_counter()
+        transfer.download_file(f"{args.savedata_url}/getFile", os.path.join(tmp, "download.pvc"),
+                               params={"filename": name, "year": args.year})
+        download = time.perf_counter() - started
+    return {
+        "transfer.upload_mb_per_s": metric(size_mb / upload, "MB/s", "higher"),
+        "transfer.download_mb_per_s": metric(size_mb / download, "MB/s", "higher"),
+    }
+
+
+STAGES = {"fetch": bench_fetch, "serialize": bench_serialize, "transfer": bench_transfer}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("stage", choices=sorted(STAGES))
+    parser.add_argument("--resolution", type=int, help="grid resolution in degrees (default 15 for fetch, 5 otherwise)")
+    parser.add_argument("--pvgis-url", default="http://localhost:8600/api/v5_2/")
+    parser.add_argument("--savedata-url", default="http://localhost:8505")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--max-concurrency", type=int, default=30)
+    parser.add_argument("--year", type=int, default=2019)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print the metrics as JSON")
+    args = parser.parse_args()
+    args.resolution = args.resolution or (15 if args.stage == "fetch" else 5)
+
+    results = STAGES[args.stage](args)
+    if args.json:
+        print(json.dumps(results))
+        return
+    for name, entry in results.items():
+        print(f"{name:>32}: {entry['value']:>12} {entry['unit']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Background getData jobs: submit, poll status, fetch the result.
+
+Jobs live in SQLite so their state survives a restart; queued and running
+jobs of a previous process are picked up again by resume() and continue
+from the profile cache. At most one job per key is queued or running at a
+time (enforced by a partial unique index), so identical requests share it.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "data/jobs.sqlite")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobStore:
+    def __init__(self, path=None):
+        path = path or JOBS_DB_PATH
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, key TEXT NOT NULL, params TEXT NOT NULL,
+                state TEXT NOT NULL, done INTEGER DEFAULT 0, total INTEGER DEFAULT 0,
+                result TEXT, error TEXT, status_code INTEGER,
+                created REAL NOT NULL, updated REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS active_key ON jobs(key) WHERE state IN ('queued', 'running')"
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def submit(self, key, params):
+        """Return (job_id, created); an active job with the same key is reused."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE key=? AND state IN ('queued', 'running')", (key,)
+            ).fetchone()
+            if row:
+                return row["id"], False
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO jobs (id, key, params, state, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, key, json.dumps(params), now, now),
+            )
+            self._conn.commit()
+            return job_id, True
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name}=?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id=?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def start(self, job_id):
+        self._update(job_id, state="running")
+
+    def progress(self, job_id, done, total):
+        self._update(job_id, done=done, total=total)
+
+    def finish(self, job_id, result):
+        self._update(job_id, state="done", result=json.dumps(result))
+
+    def fail(self, job_id, error, status_code=500):
+        self._update(job_id, state="failed", error=json.dumps(error), status_code=status_code)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["error"] = json.loads(job["error"]) if job["error"] else None
+        return job
+
+    def active(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, params FROM jobs WHERE state IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+        return [(row["id"], json.loads(row["params"])) for row in rows]
+
+    def counts(self):
+        """Number of queued and running jobs, keyed by state."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS n FROM jobs WHERE state IN ('queued', 'running') GROUP BY state"
+            ).fetchall()
+        return {state: 0 for state in ACTIVE_STATES} | {row["state"]: row["n"] for row in rows}
+
+
+class JobManager:
+    """
+    Runs ``run(**params, progress=callback)`` for each job on a thread pool.
+
+    Progress is written at most every ``progress_interval`` seconds.
+    """
+
+    def __init__(self, store, run, workers=JOB_WORKERS, progress_interval=1.0):
+        self.store = store
+        self.run = run
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, key, params):
+        job_id, created = self.store.submit(key, params)
+        if created:
+            # The job thread keeps the submitting request's trace ID
+            self._executor.submit(contextvars.copy_context().run, self._execute, job_id, params)
+        return job_id, created
+
+    def resume(self):
+        """Requeue the jobs a previous process left queued or running."""
+        active = self.store.active()
+        for job_id, params in active:
+            self._executor.submit(self._execute, job_id, params)
+        return len(active)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _execute(self, job_id, params):
+        self.store.start(job_id)
+        last_write = 0.0
+
+        def progress(done, total):
+            nonlocal last_write
+            now = time.monotonic()
+            if done >= total or now - last_write >= self.progress_interval:
+                self.store.progress(job_id, done, total)
+                last_write = now
+
+        try:
+            result = self.run(**params, progress=progress)
+        except HTTPException as e:
+            self.store.fail(job_id, e.detail, e.status_code)
+        except Exception as e:
+            self.store.fail(job_id, f"{type(e).__name__}: {e}")
+        else:
+            self.store.finish(job_id, result)
+
+
+def status(job):
+    """Public view of a job row."""
+    total = job["total"]
+    return {
+        "job_id": job["id"],
+        "state": job["state"],
+        "progress": {
+            "done": job["done"],
+            "total": total,
+            "fraction": round(job["done"] / total, 4) if total else 0.0,
+        },
+        "created": job["created"],
+        "updated": job["updated"],
+        "error": job["error"],
+    }
@@ -1,14 +1,49 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 import numpy as np
 import scipy.io
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
+import asyncio
+import pvcube
+import pvcodec
+import shared_store
+import transfer
+from pvgis_client import PvgisClient, PvgisError, fetch_grid
+from profile_cache import ProfileCache
+import adaptive_grid
+import transposition
+import jobs
+import telemetry
 
 PYTHON = int(os.getenv("PYTHON", 8503))
-app = FastAPI()
+PVGIS_CONCURRENCY = int(os.getenv("PVGIS_CONCURRENCY", 10))
+PVGIS_MAX_CONCURRENCY = int(os.getenv("PVGIS_MAX_CONCURRENCY", 30))
+NEAREST_TOLERANCE_KM = float(os.getenv("NEAREST_TOLERANCE_KM", 0))
+PVZ_PRECISION = float(os.getenv("PVZ_PRECISION", 0.1))
+
+_job_manager = None
+
+def get_jobs():
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = jobs.JobManager(jobs.JobStore(), run=lambda **params: build_cube(**params))
+    return _job_manager
+
+@asynccontextmanager
+async def lifespan(app):
+    # Jobs interrupted by a restart continue from the profile cache
+    get_jobs().resume()
+    yield
+    get_jobs().shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
+telemetry.install(app, "python")
+telemetry.gauge(
+    "jobs_active", "getData jobs queued or running", ("state",),
+    fn=lambda: {(state,): n for state, n in get_jobs().store.counts().items()},
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,62 +56,175 @@ app.add_middleware(
 # ------------------------
 # Helper: Save PV as .mat in float32
 # ------------------------
-def save_pv(all_Ppv_data, azimuth, slope, lat, long, year):
+def save_pv(all_Ppv_data, azimuth, slope, lat, long, year, variant=None):
+    """Export a (slopes, azimuths, hours) cube as the .mat calculation.m loads."""
     save_dir = f"data/{year}"
     os.makedirs(save_dir, exist_ok=True)
 
-    num_slopes = len(all_Ppv_data)
-    num_azimuths = len(all_Ppv_data[0])
-    all_Ppv_cell = np.empty((num_slopes, num_azimuths), dtype=object)
+    mat_file_ppv = os.path.join(save_dir, cube_basename(azimuth, slope, lat, long, variant) + ".mat")
 
-    for s in range(num_slopes):
-        for a in range(num_azimuths):
-            hourly = all_Ppv_data[s][a]
+    return pvcube.export_mat(all_Ppv_data, mat_file_ppv)
 
-            if isinstance(hourly, np.ndarray):
-                hourly_array = hourly.astype(np.float32)
+# ------------------------
+# Helper: Post file to saveDataFile endpoint
+# ------------------------
+def post_file_to_saveData(file_path: str, azimuth_res=1, slope_res=1, year=2019):
+    """Stream a file to savedata; checksummed, resumable and renamed into place there."""
+    endpoint = f"http://savedata:8505/uploads/{year}/{os.path.basename(file_path)}"
+    return transfer.upload_file(endpoint, file_path)
 
-            elif isinstance(hourly, list):
-                hourly_array = np.array(hourly, dtype=np.float32).reshape(-1, 1)
+# ------------------------
+# Helper: Hand a file to savedata through the shared volume
+# ------------------------
+def publish_shared_file(file_path: str, filename: str, year=2019):
+    """Commit a file to the shared object store and register its name in savedata."""
+    digest = shared_store.commit_object(file_path)
+    endpoint = "http://savedata:8505/registerDataFile"
+    payload = {"filename": filename, "year": year, "digest": digest}
+    response = requests.post(endpoint, params=payload, headers=telemetry.trace_headers())
+    response.raise_for_status()
+    return response.json()
 
-            else:
-                hourly_array = np.zeros((8760, 1), dtype=np.float32)
+# ------------------------
+# Helper: Cube file names
+# ------------------------
+def cube_basename(azimuth, slope, lat, long, variant=None, years=None):
+    """
+    File name stem; ``variant`` ("adaptive", "local") keeps differently built
+    cubes apart, and multi-year cubes end in their range of ``years``.
+    """
+    prefix = f"all_Ppv_data_{variant}" if variant else "all_Ppv_data"
+    suffix = f"_years_{years[0]}-{years[-1]}" if years and len(years) > 1 else ""
+    return f"{prefix}_azires_{azimuth}_sloperes_{slope}_{lat:.5f}_{long:.5f}{suffix}"
 
-            all_Ppv_cell[s, a] = hourly_array
+def cube_variant(adaptive, engine):
+    return "local" if engine == "local" else ("adaptive" if adaptive else None)
 
-    mat_file_ppv = os.path.join(
-        save_dir,
-        f"all_Ppv_data_azires_{azimuth}_sloperes_{slope}_{lat:.5f}_{long:.5f}.mat"
-    )
+def validate_cube_request(fileFormat, engine, year=None, endYear=None):
+    if fileFormat not in ("mat", "pvc", "pvz"):
+        raise HTTPException(status_code=400, detail=f"Unknown fileFormat '{fileFormat}'")
+    if engine not in ("pvgis", "local"):
+        raise HTTPException(status_code=400, detail=f"Unknown engine '{engine}'")
+    if endYear is not None and endYear < year:
+        raise HTTPException(status_code=400, detail="endYear must not be before year")
+    if endYear is not None and endYear > year:
+        # Octave loads one year of hours; the transposition engine models one year of components
+        if fileFormat == "mat":
+            raise HTTPException(status_code=400, detail="Multi-year cubes are stored as pvc or pvz")
+        if engine == "local":
+            raise HTTPException(status_code=400, detail="engine 'local' builds single-year cubes")
 
-    scipy.io.savemat(mat_file_ppv, {"all_Ppv_data": all_Ppv_cell}, do_compression=False)
-    return mat_file_ppv
-
-# ------------------------
-# Helper: Post file to saveDataFile endpoint
-# ------------------------
-def post_file_to_saveData(file_path: str, azimuth_res=1, slope_res=1, year=2019):
-    endpoint = "http://savedata:8505/saveDataFile"
-    with open(file_path, "rb") as f:
-        files = {"file": (os.path.basename(file_path), f, "application/octet-stream")}
-        params = {"azimuth_res": azimuth_res, "slope_res": slope_res, "year": year}
-        response = requests.post(endpoint, files=files, params=params)
-        response.raise_for_status()
-        return response.json()
+def cube_year_range(year, endYear):
+    """Years a build covers: ``year`` alone unless ``endYear`` comes after it."""
+    return list(range(year, max(year, endYear or year) + 1))
 
 # ------------------------
 # FastAPI Route: Compute PV Data via PVGIS API
 # ------------------------
 @app.get("/getData")
-def getData(azimuth: int, slope: int, latit: float, longit: float, year: int):
-    combined_file = f"data/{year}/all_Ppv_data_azires_{azimuth}_sloperes_{slope}_{latit:.5f}_{longit:.5f}.mat"
-    returnName = f"all_Ppv_data_azires_{azimuth}_sloperes_{slope}_{latit:.5f}_{longit:.5f}.mat"
+def getData(
+    azimuth: int,
+    slope: int,
+    latit: float,
+    longit: float,
+    year: int,
+    fileFormat: str = "mat",
+    adaptive: bool = False,
+    coarseRes: int = 10,
+    topK: int = 4,
+    engine: str = "pvgis",
+    toleranceKm: float = NEAREST_TOLERANCE_KM,
+    blend: bool = False,
+    endYear: int = None,
+):
+    """Blocking cube build; long runs should go through POST /jobs instead."""
+    return build_cube(
+        azimuth=azimuth, slope=slope, latit=latit, longit=longit, year=year,
+        fileFormat=fileFormat, adaptive=adaptive, coarseRes=coarseRes, topK=topK, engine=engine,
+        toleranceKm=toleranceKm, blend=blend, endYear=endYear,
+    )
+
+def build_cube(**params):
+    """Synchronous build_cube_async with its own PVGIS client."""
+    return asyncio.run(build_cube_async(**params))
+
+def savedata_has_file(filename):
+    response = requests.get("http://savedata:8505/checkFile", params={"filename": filename}, headers=telemetry.trace_headers())
+    return response.json()["exists"]
+
+def find_nearby_cube(latit, longit, year, azimuth, slope, fileFormat, variant, toleranceKm, blend=False):
+    """A stored cube of a site within ``toleranceKm`` (or an IDW blend of several), or None."""
+    params = {
+        "lat": latit, "lon": longit, "year": year, "azimuth_res": azimuth, "slope_res": slope,
+        "fileFormat": fileFormat, "tolerance_km": toleranceKm,
+    }
+    if blend and not variant:
+        response = requests.post("http://savedata:8505/blendFile", params=params, headers=telemetry.trace_headers())
+    else:
+        response = requests.get(
+            "http://savedata:8505/nearestFile", params={**params, "variant": variant or ""}, headers=telemetry.trace_headers()
+        )
+    return response.json() if response.status_code == 200 else None
+
+async def build_cube_async(
+    azimuth,
+    slope,
+    latit,
+    longit,
+    year,
+    fileFormat="mat",
+    adaptive=False,
+    coarseRes=10,
+    topK=4,
+    engine="pvgis",
+    toleranceKm=0.0,
+    blend=False,
+    endYear=None,
+    progress=None,
+    client=None,
+    cache=None,
+):
+    """
+    Build the PV cube of a site, fetching from PVGIS only what is not cached.
+
+    With ``adaptive`` the grid is searched coarse-to-fine from ``coarseRes``
+    degrees around the ``topK`` best regions, and the cube only covers the
+    visited orientations (coverage "sparse" in its header).
+
+    With ``engine="local"`` PVGIS is asked once for the horizontal irradiance
+    components and every orientation is computed by the transposition module
+    (see /validateTransposition for how closely it tracks PVGIS).
+
+    With ``toleranceKm`` > 0 a cube stored for a site at most that far away
+    is served instead (``blend`` asks savedata for an inverse-distance blend
+    of the neighbouring sites); the response then lists the sources used.
+
+    With ``endYear`` after ``year`` every orientation is fetched in one
+    request over the whole range, and the cube holds the years one after
+    another along its hour axis ("end_year" in its header). Each year is
+    also cached on its own, so single-year builds reuse it and vice versa.
+
+    ``progress(done, total)`` is called as orientations land in the cube.
+    Bulk runs pass a shared ``client`` and ``cache`` so that many sites draw
+    on one PVGIS concurrency budget; blocking steps run in worker threads.
+    """
+    validate_cube_request(fileFormat, engine, year, endYear)
+    years = cube_year_range(year, endYear)
+    end_year = years[-1] if len(years) > 1 else None
+    variant = cube_variant(adaptive, engine)
+    basename = cube_basename(azimuth, slope, latit, longit, variant, years)
+    combined_file = f"data/{year}/{basename}.{fileFormat}"
+    returnName = f"{basename}.{fileFormat}"
 
     # Check if file already exists in savedata
-    params = {"filename": combined_file}
-    response = requests.get("http://savedata:8505/checkFile", params=params)
-    if response.json()["exists"]:
-            return {"filename": returnName}
+    if await asyncio.to_thread(savedata_has_file, combined_file):
+        return {"filename": returnName}
+    if toleranceKm > 0 and not end_year:
+        nearby = await asyncio.to_thread(
+            find_nearby_cube, latit, longit, year, azimuth, slope, fileFormat, variant, toleranceKm, blend
+        )
+        if nearby:
+            return {"filename": nearby["filename"], "source": {"mode": nearby["mode"], "sites": nearby["sources"]}}
 
     # ------------------------
     # Simulation Parameters
@@ -87,69 +235,240 @@ def getData(azimuth: int, slope: int, latit: float, longit: float, year: int):
     num_azimuths = len(azimuth_array)
     num_slopes = len(slope_array)
 
-    all_Ppv_data = [[None for _ in azimuth_array] for _ in slope_array]
+    # Orientations are written straight into a preallocated memory-mapped cube,
+    # on the shared volume when there is one so publishing it is only a rename
+    cube_name = basename + pvcube.EXTENSION
+    if shared_store.enabled():
+        cube_file = shared_store.tmp_path(cube_name)
+    else:
+        os.makedirs(f"data/{year}", exist_ok=True)
+        cube_file = f"data/{year}/{cube_name}"
+    partial_file = cube_file + ".part"
+    all_Ppv_data = pvcube.create_cube(
+        partial_file, azimuth, slope, latit, longit, year, hours=pvcube.HOURS * len(years), engine=engine,
+        **({"end_year": end_year} if end_year else {}),
+    )
 
     # ------------------------
-    # PVGIS API function
+    # Fill rows from the cache (any resolution or an interrupted run), then
+    # fetch the missing ones through one pooled async PVGIS client
     # ------------------------
-    def PV_get_pvgis_data(lat, lon, startyear, endyear, slope_val, azimuth_val, power_wp=1000):
-        base_url = "https://re.jrc.ec.europa.eu/api/v5_2/seriescalc?"
-        query = (
-            f"lat={lat:.6f}&lon={lon:.6f}&startyear={startyear}&endyear={endyear}"
-            f"&angle={slope_val:.1f}&aspect={azimuth_val:.1f}&pvtechchoice=crystSi"
-            f"&peakpower={power_wp/1000:.3f}&pvcalculation=1&loss=14&outputformat=json"
+    own_cache = cache is None
+    cache = cache or ProfileCache()
+    counts = {"done": 0, "total": 0}
+
+    def report(done=1):
+        counts["done"] += done
+        if progress:
+            progress(counts["done"], counts["total"])
+
+    def store(s, a, hourly):
+        # Each orientation owns its own (s, a) row of the cube
+        all_Ppv_data[s, a] = np.ravel(hourly)
+        report()
+
+    def store_and_journal(s, a, hourly):
+        store(s, a, hourly)
+        for y, profile in zip(years, np.reshape(hourly, (len(years), -1))):
+            cache.put(latit, longit, y, slope_array[s], azimuth_array[a], profile)
+
+    def fill_from_cache(wanted):
+        # Cached years land in their slice of the row; a row counts as cached once every year is
+        cached = None
+        for i, y in enumerate(years):
+            def put_year(target, hourly, hours=slice(i * pvcube.HOURS, (i + 1) * pvcube.HOURS)):
+                all_Ppv_data[(*target, hours)] = hourly
+
+            hits = cache.fill(latit, longit, y, wanted, put_year)
+            cached = hits if cached is None else cached & hits
+        report(len(cached))
+        return cached
+
+    async def fetch_orientations(client, indices):
+        counts["total"] += len(indices)
+        wanted = {(slope_array[s], azimuth_array[a]): (s, a) for s, a in indices}
+        cached = fill_from_cache(wanted)
+        tasks = [(s, a, sl, az) for (sl, az), (s, a) in wanted.items() if (sl, az) not in cached]
+        failed = await fetch_grid(client, latit, longit, year, tasks, store_and_journal, end_year)
+        return len(cached), failed
+
+    async def compute_local(client):
+        try:
+            data = await client.fetch_components(latit, longit, year, year)
+        except PvgisError as e:
+            return [], 0, [{"error": str(e)}]
+        components = transposition.decode_components(data)
+        counts["total"] = num_slopes * num_azimuths
+        await asyncio.to_thread(
+            transposition.compute_cube, components, latit, longit, slope_array, azimuth_array, all_Ppv_data,
+            on_row=lambda s: report(num_azimuths),
         )
-        response = requests.get(base_url + query)
-        data = response.json()
-        if isinstance(data, list):
-            data = data[0]
-        return data
+        return [(s, a) for s in range(num_slopes) for a in range(num_azimuths)], 0, []
 
-    # ------------------------
-    # Worker function for parallel requests
-    # ------------------------
-    lock = threading.Lock()
-    def worker(s, a, slope_val, azimuth_val):
-        data = PV_get_pvgis_data(latit, longit, year, year, slope_val, azimuth_val)
-        hourly = data.get("outputs", {}).get("hourly", None)
-        if not isinstance(hourly, list):
-            hourly = [[0]] * 8760  # fallback empty array
-
-        if "P" in hourly[0]:
-            P_array = np.array([h["P"] for h in hourly], dtype=np.float32).reshape(-1, 1)
-        elif "P_ac" in hourly[0]:
-            P_array = np.array([h["P_ac"] for h in hourly], dtype=np.float32).reshape(-1, 1)
+    async def fetch_with(client):
+        if engine == "local":
+            fetched, cached, failed = await compute_local(client)
+        elif adaptive:
+            fetched, cached, failed = await adaptive_grid.refine(
+                lambda indices: fetch_orientations(client, indices),
+                all_Ppv_data,
+                slope_step=max(1, coarseRes // slope),
+                azimuth_step=max(1, coarseRes // azimuth),
+                top_k=topK,
+            )
         else:
-            P_array = np.zeros((8760, 1), dtype=np.float32)
+            fetched = [(s, a) for s in range(num_slopes) for a in range(num_azimuths)]
+            cached, failed = await fetch_orientations(client, fetched)
+        stats = client.stats.summary(client.limiter)
+        stats.update(cached=cached, orientations=len(fetched), grid_size=num_slopes * num_azimuths)
+        return failed, stats
 
-        if P_array.shape[0] < 8760:
-            P_array = np.pad(P_array, ((0, 8760 - P_array.shape[0]), (0, 0)), mode="constant")
-        elif P_array.shape[0] > 8760:
-            P_array = P_array[:8760, :]
+    try:
+        if client is None:
+            async with PvgisClient(concurrency=PVGIS_CONCURRENCY, max_concurrency=PVGIS_MAX_CONCURRENCY) as client:
+                failed, stats = await fetch_with(client)
+        else:
+            failed, stats = await fetch_with(client)
+    except BaseException:
+        del all_Ppv_data
+        os.remove(partial_file)
+        raise
+    finally:
+        if own_cache:
+            cache.close()
 
-        with lock:
-            all_Ppv_data[s][a] = P_array
+    if failed:
+        del all_Ppv_data
+        os.remove(partial_file)
+        raise HTTPException(
+            status_code=502,
+            detail={"message": f"{len(failed)} orientations failed after retries", "failed": failed[:20], "stats": stats},
+        )
 
     # ------------------------
-    # Run parallel PVGIS requests
+    # Commit the cube; export .mat (float32) for Octave or compressed .pvz when requested
     # ------------------------
-    tasks = [(s, a, slope_array[s], azimuth_array[a]) for s in range(num_slopes) for a in range(num_azimuths)]
-    max_workers = 10
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(worker, s, a, slope_val, azimuth_val) for (s, a, slope_val, azimuth_val) in tasks]
-        for future in as_completed(futures):
-            future.result()
+    def commit():
+        all_Ppv_data.flush()
+        if variant == "adaptive":
+            pvcube.update_header(partial_file, coverage="sparse", orientations=stats["orientations"])
+        os.replace(partial_file, cube_file)
 
-    # ------------------------
-    # Save results as .mat (float32)
-    # ------------------------
-    mat_file = save_pv(all_Ppv_data, azimuth, slope, latit, longit, year)
-    post_file_to_saveData(mat_file, azimuth_res=azimuth, slope_res=slope, year=year)
+        if fileFormat == "mat" and shared_store.enabled():
+            upload_file = pvcube.export_mat(all_Ppv_data, shared_store.tmp_path(returnName))
+        elif fileFormat == "mat":
+            upload_file = save_pv(all_Ppv_data, azimuth, slope, latit, longit, year, variant=variant)
+        elif fileFormat == "pvz":
+            upload_file = shared_store.tmp_path(returnName) if shared_store.enabled() else combined_file
+            grid = {k: v for k, v in pvcube.read_header(cube_file).items() if k not in ("version", "dtype", "shape")}
+            stats["codec"] = pvcodec.encode(all_Ppv_data, upload_file, precision=PVZ_PRECISION, **grid)
+        else:
+            upload_file = cube_file
+
+        if shared_store.enabled():
+            publish_shared_file(upload_file, returnName, year=year)
+        else:
+            post_file_to_saveData(upload_file, azimuth_res=azimuth, slope_res=slope, year=year)
+
+    await asyncio.to_thread(commit)
+    del all_Ppv_data
+
+    for local_file in (combined_file, cube_file):
+        if os.path.exists(local_file):
+            os.remove(local_file)
+
+    return {"filename": returnName, "stats": stats}
+
+# ------------------------
+# FastAPI Routes: getData as a background job
+# ------------------------
+@app.post("/jobs", status_code=202)
+def submitJob(
+    azimuth: int,
+    slope: int,
+    latit: float,
+    longit: float,
+    year: int,
+    fileFormat: str = "mat",
+    adaptive: bool = False,
+    coarseRes: int = 10,
+    topK: int = 4,
+    engine: str = "pvgis",
+    toleranceKm: float = NEAREST_TOLERANCE_KM,
+    blend: bool = False,
+    endYear: int = None,
+):
+    """Queue a getData run; identical requests in flight share one job."""
+    validate_cube_request(fileFormat, engine, year, endYear)
+    params = {
+        "azimuth": azimuth, "slope": slope, "latit": latit, "longit": longit, "year": year,
+        "fileFormat": fileFormat, "adaptive": adaptive, "coarseRes": coarseRes, "topK": topK, "engine": engine,
+        "toleranceKm": toleranceKm, "blend": blend, "endYear": endYear,
+    }
+    years = cube_year_range(year, endYear)
+    basename = cube_basename(azimuth, slope, latit, longit, cube_variant(adaptive, engine), years)
+    job_id, created = get_jobs().submit(f"{year}/{basename}.{fileFormat}", params)
+    return {**jobs.status(get_jobs().store.get(job_id)), "deduplicated": not created}
+
+def _get_job(job_id):
+    job = get_jobs().store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job
+
+@app.get("/jobs/{job_id}")
+def jobStatus(job_id: str):
+    return jobs.status(_get_job(job_id))
+
+@app.get("/jobs/{job_id}/result")
+def jobResult(job_id: str):
+    """The getData response of a finished job; 409 while it is still running."""
+    job = _get_job(job_id)
+    if job["state"] == "failed":
+        raise HTTPException(status_code=job["status_code"] or 500, detail=job["error"])
+    if job["state"] != "done":
+        raise HTTPException(status_code=409, detail=jobs.status(job))
+    return job["result"]
+
+# ------------------------
+# FastAPI Route: Compare the local engine with PVGIS
+# ------------------------
+@app.get("/validateTransposition")
+def validateTransposition(
+    latit: float,
+    longit: float,
+    year: int,
+    orientations: str = "0:0,35:0,35:-90,35:90,90:0",
+):
+    """
+    Validation report of the local engine against PVGIS P values.
+
+    ``orientations`` is a comma-separated list of slope:azimuth pairs.
+    """
+    try:
+        pairs = [tuple(float(v) for v in item.split(":")) for item in orientations.split(",") if item]
+        if not pairs or any(len(p) != 2 for p in pairs):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(status_code=400, detail="orientations must look like '35:0,90:-90'")
+
+    async def fetch_reference():
+        async with PvgisClient(concurrency=PVGIS_CONCURRENCY, max_concurrency=PVGIS_MAX_CONCURRENCY) as client:
+            data, *profiles = await asyncio.gather(
+                client.fetch_components(latit, longit, year, year),
+                *(client.fetch_hourly(latit, longit, year, year, sl, az) for sl, az in pairs),
+            )
+            return data, dict(zip(pairs, profiles)), client.stats.summary(client.limiter)
 
-    if os.path.exists(combined_file):
-        os.remove(combined_file)
+    try:
+        data, reference, stats = asyncio.run(fetch_reference())
+    except PvgisError as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
-    return {"filename": returnName}
+    components = transposition.decode_components(data)
+    report = transposition.validation_report(components, latit, longit, reference)
+    report["stats"] = stats
+    return report
 
 # ------------------------
 # Main
@@ -0,0 +1,246 @@
+"""
+Bulk precompute of PV cubes for many sites, years and resolutions.
+
+All cubes are built in one process through a single PVGIS client, so the
+whole run shares one adaptive concurrency budget (--concurrency up to
+--max-concurrency requests in flight) instead of one site at a time.
+Finished cubes are appended to a checkpoint file and skipped on a rerun;
+a site interrupted halfway resumes from the profile cache.
+
+    python precompute.py --grid grids/netherlands.csv --years 2023
+    python precompute.py --bbox 50.7 3.3 53.6 7.3 --spacing 0.25 --years 2022 2023 --resolutions 5x5 1x1
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+from fastapi import HTTPException
+from main import PVGIS_CONCURRENCY, PVGIS_MAX_CONCURRENCY, build_cube_async
+from profile_cache import ProfileCache
+from pvgis_client import PvgisClient
+
+CHECKPOINT_PATH = os.getenv("PRECOMPUTE_CHECKPOINT", "data/precompute_checkpoint.jsonl")
+
+
+# ------------------------
+# Work plan
+# ------------------------
+def load_grid(path):
+    """(lat, lon) pairs from a CSV file; a header row and # comments are skipped."""
+    sites = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].lstrip().startswith("#"):
+                continue
+            try:
+                sites.append((float(row[0]), float(row[1])))
+            except ValueError:
+                continue  # header
+    return sites
+
+
+def bbox_grid(lat_min, lon_min, lat_max, lon_max, spacing):
+    """Regular grid over a bounding box, both edges included."""
+    lats = np.round(np.arange(lat_min, lat_max + spacing / 2, spacing), 5)
+    lons = np.round(np.arange(lon_min, lon_max + spacing / 2, spacing), 5)
+    return [(float(lat), float(lon)) for lat in lats for lon in lons]
+
+
+def parse_resolution(text):
+    """'5x2' -> (azimuth_res 5, slope_res 2); a single number sets both."""
+    azimuth, _, slope = text.partition("x")
+    return int(azimuth), int(slope or azimuth)
+
+
+def task_key(task):
+    return "{year}/{latit:.5f}_{longit:.5f}/azires_{azimuth}_sloperes_{slope}/{fileFormat}/{engine}".format(**task)
+
+
+def grid_size(task):
+    return len(range(-90, 91, task["azimuth"])) * len(range(0, 91, task["slope"]))
+
+
+def plan(sites, years, resolutions, fileFormat="mat", engine="pvgis"):
+    """Coarse resolutions first, so their orientations are cached for the finer ones."""
+    tasks = []
+    for azimuth, slope in sorted(resolutions, key=lambda r: (-r[0], -r[1])):
+        for year in years:
+            for lat, lon in sites:
+                tasks.append({
+                    "azimuth": azimuth, "slope": slope, "latit": lat, "longit": lon, "year": year,
+                    "fileFormat": fileFormat, "engine": engine,
+                })
+    return tasks
+
+
+# ------------------------
+# Checkpoint
+# ------------------------
+class Checkpoint:
+    """Append-only JSON lines log of finished tasks."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)["key"])
+                    except (ValueError, KeyError):
+                        continue  # torn last line of an interrupted run
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def mark(self, key, result):
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"key": key, "filename": result.get("filename"), "at": time.time()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.add(key)
+
+
+# ------------------------
+# Progress and ETA
+# ------------------------
+class Progress:
+    def __init__(self, tasks):
+        self.started = time.monotonic()
+        self.total_tasks = len(tasks)
+        self.total_orientations = sum(grid_size(t) for t in tasks)
+        self.finished_orientations = 0
+        self.in_flight = {}
+        self.done = 0
+        self.failed = 0
+
+    def update(self, key, done):
+        self.in_flight[key] = done
+
+    def finish(self, key, task, ok):
+        self.in_flight.pop(key, None)
+        self.finished_orientations += grid_size(task)
+        self.done += ok
+        self.failed += not ok
+
+    def summary(self, client=None):
+        elapsed = time.monotonic() - self.started
+        orientations = self.finished_orientations + sum(self.in_flight.values())
+        rate = orientations / elapsed if elapsed else 0.0
+        remaining = self.total_orientations - orientations
+        summary = {
+            "tasks_done": self.done,
+            "tasks_failed": self.failed,
+            "tasks_total": self.total_tasks,
+            "orientations_per_s": round(rate, 1),
+            "elapsed_s": round(elapsed, 1),
+            "eta_s": round(remaining / rate, 1) if rate else None,
+        }
+        if client:
+            summary["requests_per_s"] = round(client.stats.requests / elapsed, 2) if elapsed else 0.0
+            summary["concurrency"] = round(client.limiter.limit, 2)
+        return summary
+
+
+def format_summary(summary):
+    eta = f"{summary['eta_s'] / 60:.1f} min" if summary["eta_s"] is not None else "?"
+    line = (
+        f"{summary['tasks_done'] + summary['tasks_failed']}/{summary['tasks_total']} cubes "
+        f"({summary['tasks_failed']} failed), {summary['orientations_per_s']} orientations/s"
+    )
+    if "requests_per_s" in summary:
+        line += f", {summary['requests_per_s']} requests/s at concurrency {summary['concurrency']}"
+    return line + f", ETA {eta}"
+
+
+# ------------------------
+# Runner
+# ------------------------
+async def run(
+    tasks,
+    checkpoint,
+    concurrency=PVGIS_CONCURRENCY,
+    max_concurrency=PVGIS_MAX_CONCURRENCY,
+    sites_in_flight=4,
+    report_interval=30.0,
+    log=print,
+    client_factory=PvgisClient,
+):
+    """Build every task not yet in ``checkpoint``; returns the final summary."""
+    todo = [t for t in tasks if task_key(t) not in checkpoint.done]
+    log(f"{len(tasks) - len(todo)} of {len(tasks)} cubes already done")
+    progress = Progress(todo)
+    slots = asyncio.Semaphore(sites_in_flight)
+    cache = ProfileCache()
+    failures = []
+
+    async with client_factory(concurrency=concurrency, max_concurrency=max_concurrency) as client:
+        async def build(task):
+            key = task_key(task)
+            async with slots:
+                try:
+                    result = await build_cube_async(
+                        **task, client=client, cache=cache, progress=lambda done, total: progress.update(key, done)
+                    )
+                except (HTTPException, OSError) as e:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    failures.append({"key": key, "error": detail})
+                    progress.finish(key, task, ok=False)
+                    log(f"✗ {key}: {detail.get('message') if isinstance(detail, dict) else detail}")
+                    return
+                checkpoint.mark(key, result)
+                progress.finish(key, task, ok=True)
+                log(f"✓ {key}")
+
+        async def report():
+            while True:
+                await asyncio.sleep(report_interval)
+                log(format_summary(progress.summary(client)))
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(*(build(t) for t in todo))
+        finally:
+            reporter.cancel()
+            cache.close()
+        summary = progress.summary(client)
+
+    log(format_summary(summary))
+    summary["failures"] = failures
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute PV cubes for a grid of sites.")
+    sites = parser.add_mutually_exclusive_group(required=True)
+    sites.add_argument("--grid", help="CSV file with lat,lon rows")
+    sites.add_argument("--bbox", nargs=4, type=float, metavar=("LAT_MIN", "LON_MIN", "LAT_MAX", "LON_MAX"))
+    parser.add_argument("--spacing", type=float, default=0.25, help="grid spacing in degrees for --bbox")
+    parser.add_argument("--years", nargs="+", type=int, required=True)
+    parser.add_argument("--resolutions", nargs="+", default=["1x1"], help="AZIMUTHxSLOPE resolutions in degrees")
+    parser.add_argument("--format", dest="fileFormat", choices=("mat", "pvc", "pvz"), default="mat")
+    parser.add_argument("--engine", choices=("pvgis", "local"), default="pvgis")
+    parser.add_argument("--concurrency", type=int, default=PVGIS_CONCURRENCY, help="initial PVGIS requests in flight")
+    parser.add_argument("--max-concurrency", type=int, default=PVGIS_MAX_CONCURRENCY, help="PVGIS budget for the whole run")
+    parser.add_argument("--sites-in-flight", type=int, default=4, help="cubes being built at the same time")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--report-interval", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    coordinates = load_grid(args.grid) if args.grid else bbox_grid(*args.bbox, args.spacing)
+    tasks = plan(coordinates, args.years, [parse_resolution(r) for r in args.resolutions], args.fileFormat, args.engine)
+    summary = asyncio.run(run(
+        tasks,
+        Checkpoint(args.checkpoint),
+        concurrency=args.concurrency,
+        max_concurrency=args.max_concurrency,
+        sites_in_flight=args.sites_in_flight,
+        report_interval=args.report_interval,
+    ))
+    return 1 if summary["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
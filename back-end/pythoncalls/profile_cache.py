@@ -0,0 +1,95 @@
+"""
+Durable cache of hourly PVGIS profiles keyed by (lat, lon, year, slope, azimuth).
+
+Each orientation is committed as soon as it arrives, so the cache doubles as
+the resume journal of an interrupted getData run. A grid at any resolution
+is assembled from whatever orientations earlier runs already fetched.
+"""
+import os
+import sqlite3
+import threading
+import zlib
+import numpy as np
+
+PROFILE_CACHE_PATH = os.getenv("PROFILE_CACHE_PATH", "data/profiles.sqlite")
+
+
+def _key(lat, lon, year, slope_val, azimuth_val):
+    # Integer keys (1e-5 degree for the site, 0.1 degree for the orientation)
+    # make lookups exact regardless of how the floats were produced
+    return (
+        int(round(lat * 1e5)),
+        int(round(lon * 1e5)),
+        int(year),
+        int(round(float(slope_val) * 10)),
+        int(round(float(azimuth_val) * 10)),
+    )
+
+
+class ProfileCache:
+    def __init__(self, path=None):
+        path = path or PROFILE_CACHE_PATH
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS profiles (
+                lat INTEGER, lon INTEGER, year INTEGER, slope INTEGER, azimuth INTEGER,
+                hours INTEGER NOT NULL, data BLOB NOT NULL,
+                PRIMARY KEY (lat, lon, year, slope, azimuth)
+            ) WITHOUT ROWID"""
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def put(self, lat, lon, year, slope_val, azimuth_val, hourly):
+        """Store one orientation and commit it immediately."""
+        hourly = np.ascontiguousarray(hourly, dtype=np.float32)
+        blob = zlib.compress(hourly.tobytes(), 1)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*_key(lat, lon, year, slope_val, azimuth_val), hourly.size, blob),
+            )
+            self._conn.commit()
+
+    def get(self, lat, lon, year, slope_val, azimuth_val):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM profiles WHERE lat=? AND lon=? AND year=? AND slope=? AND azimuth=?",
+                _key(lat, lon, year, slope_val, azimuth_val),
+            ).fetchone()
+        return np.frombuffer(zlib.decompress(row[0]), dtype=np.float32) if row else None
+
+    def fill(self, lat, lon, year, wanted, on_hit):
+        """
+        Stream the cached profiles of one site and year.
+
+        ``wanted`` maps (slope, azimuth) to an opaque target; ``on_hit(target,
+        hourly)`` is called for each cached orientation in it. Returns the set
+        of (slope, azimuth) pairs that were served from the cache.
+        """
+        by_key = {_key(lat, lon, year, sl, az)[3:]: (sl, az) for sl, az in wanted}
+        site = _key(lat, lon, year, 0, 0)[:3]
+        hits = set()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT slope, azimuth, data FROM profiles WHERE lat=? AND lon=? AND year=?", site
+            )
+            for slope_key, azimuth_key, blob in rows:
+                orientation = by_key.get((slope_key, azimuth_key))
+                if orientation is None:
+                    continue
+                on_hit(wanted[orientation], np.frombuffer(zlib.decompress(blob), dtype=np.float32))
+                hits.add(orientation)
+        return hits
+
+    def count(self, lat, lon, year):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM profiles WHERE lat=? AND lon=? AND year=?", _key(lat, lon, year, 0, 0)[:3]
+            ).fetchone()[0]
@@ -0,0 +1,217 @@
+"""
+Compressed PV cube format (.pvz).
+
+Layout:
+
+    header block   HEADER_SIZE bytes: MAGIC, little-endian uint32 length, JSON
+    daylight mask  np.packbits of the hours where any orientation produces power
+    chunks         zlib streams, one per (orientation block, daylight-hour block)
+    chunk index    little-endian uint64 (offset, length) pairs, row-major over
+                   (orientation block, hour block)
+
+Night hours are zero for every orientation of a site, so only daylight hours
+are stored. Power is quantized to ``precision`` watts. Inside a chunk each
+orientation is stored as its difference to the previous one (neighbouring
+orientations are highly correlated), then the bytes are shuffled so that
+equal-significance bytes sit together before zlib. Every chunk decodes on
+its own, so one orientation or one time block never needs the whole file.
+
+This module is kept identical in pythoncalls, savedata and matlab, because
+every service image is built from its own directory.
+"""
+import json
+import struct
+import time
+import zlib
+from functools import lru_cache
+import numpy as np
+
+MAGIC = b"PVZCUBE1"
+HEADER_SIZE = 4096
+EXTENSION = ".pvz"
+
+
+def _write_header(f, header):
+    payload = json.dumps(header).encode("utf-8")
+    if len(MAGIC) + 4 + len(payload) > HEADER_SIZE:
+        raise ValueError("Cube header does not fit in the reserved header block")
+    f.seek(0)
+    f.write(MAGIC + struct.pack("<I", len(payload)) + payload)
+    f.write(b"\0" * (HEADER_SIZE - f.tell()))
+
+
+def is_pvz(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not a compressed PV cube file")
+        (length,) = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+# ------------------------
+# Chunk transforms
+# ------------------------
+def _pack_chunk(block, level):
+    """(orientations, hours) quantized block -> compressed bytes."""
+    delta = block.copy()
+    delta[1:] -= block[:-1]  # wraps around for unsigned types; undone by cumsum in the same dtype
+    shuffled = delta.view(np.uint8).reshape(-1, block.itemsize).T
+    return zlib.compress(np.ascontiguousarray(shuffled).tobytes(), level)
+
+
+def _unpack_chunk(payload, dtype, shape):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    delta = np.ascontiguousarray(raw.T).view(dtype).reshape(shape)
+    return np.cumsum(delta, axis=0, dtype=dtype)
+
+
+# ------------------------
+# Encoder
+# ------------------------
+def encode(cube, path, precision=0.1, chunk_orientations=64, chunk_hours=1024, level=6, **extra):
+    """
+    Write a (slopes, azimuths, hours) cube as .pvz; returns compression stats.
+
+    Extra keyword arguments (grid, site, year) are stored in the header as-is.
+    """
+    started = time.perf_counter()
+    num_slopes, num_azimuths, hours = cube.shape
+    num_orientations = num_slopes * num_azimuths
+    flat = cube.reshape(num_orientations, hours)
+
+    # Daylight mask and value range, one orientation block at a time
+    daylight = np.zeros(hours, dtype=bool)
+    low, high = 0.0, 0.0
+    for o in range(0, num_orientations, chunk_orientations):
+        block = np.asarray(flat[o:o + chunk_orientations], dtype=np.float32)
+        daylight |= (block != 0).any(axis=0)
+        low, high = min(low, float(block.min())), max(high, float(block.max()))
+    daylight_hours = np.flatnonzero(daylight)
+
+    q_low, q_high = int(np.floor(low / precision)), int(np.ceil(high / precision))
+    dtype = "<u2" if q_low >= 0 and q_high <= np.iinfo(np.uint16).max else "<i4"
+
+    header = {
+        "version": 1,
+        "shape": [num_slopes, num_azimuths, hours],
+        "dtype": dtype,
+        "precision": precision,
+        "chunk_orientations": chunk_orientations,
+        "chunk_hours": chunk_hours,
+        "daylight_hours": int(daylight_hours.size),
+        **extra,
+    }
+    index = []
+    with open(path, "wb") as f:
+        _write_header(f, header)
+        f.write(np.packbits(daylight).tobytes())
+        for o in range(0, num_orientations, chunk_orientations):
+            block = np.asarray(flat[o:o + chunk_orientations], dtype=np.float32)[:, daylight_hours]
+            quantized = np.round(block / precision).astype(dtype)
+            for h in range(0, max(daylight_hours.size, 1), chunk_hours):
+                payload = _pack_chunk(np.ascontiguousarray(quantized[:, h:h + chunk_hours]), level)
+                index.append((f.tell(), len(payload)))
+                f.write(payload)
+        header["index_offset"] = f.tell()
+        f.write(np.asarray(index, dtype="<u8").tobytes())
+        compressed_bytes = f.tell()
+        _write_header(f, header)
+
+    raw_bytes = num_orientations * hours * 4
+    return {
+        "raw_bytes": raw_bytes,
+        "compressed_bytes": compressed_bytes,
+        "ratio": round(raw_bytes / compressed_bytes, 2),
+        "daylight_fraction": round(daylight_hours.size / hours, 4),
+        "max_abs_error": precision / 2,
+        "encode_s": round(time.perf_counter() - started, 3),
+    }
+
+
+# ------------------------
+# Random-access reader
+# ------------------------
+class PvzReader:
+    """Decode any orientation range and hour range of a .pvz file on demand."""
+
+    def __init__(self, path, cache_chunks=64):
+        self.path = path
+        self.header = read_header(path)
+        self.shape = tuple(self.header["shape"])
+        self.dtype = np.dtype(self.header["dtype"])
+        self.precision = self.header["precision"]
+        self.chunk_orientations = self.header["chunk_orientations"]
+        self.chunk_hours = self.header["chunk_hours"]
+        num_slopes, num_azimuths, hours = self.shape
+        self.num_orientations = num_slopes * num_azimuths
+
+        with open(path, "rb") as f:
+            f.seek(HEADER_SIZE)
+            mask = np.frombuffer(f.read((hours + 7) // 8), dtype=np.uint8)
+            self.daylight_hours = np.flatnonzero(np.unpackbits(mask)[:hours])
+            f.seek(self.header["index_offset"])
+            self.index = np.frombuffer(f.read(), dtype="<u8").reshape(-1, 2)
+        self.hour_blocks = max(1, -(-self.daylight_hours.size // self.chunk_hours))
+        self._chunk = lru_cache(maxsize=cache_chunks)(self._read_chunk)
+
+    def _read_chunk(self, orientation_block, hour_block):
+        offset, length = self.index[orientation_block * self.hour_blocks + hour_block]
+        with open(self.path, "rb") as f:
+            f.seek(int(offset))
+            payload = f.read(int(length))
+        rows = min(self.chunk_orientations, self.num_orientations - orientation_block * self.chunk_orientations)
+        cols = min(self.chunk_hours, self.daylight_hours.size - hour_block * self.chunk_hours)
+        return _unpack_chunk(payload, self.dtype, (rows, max(cols, 0)))
+
+    def read_flat(self, orientations=slice(None), hours=slice(None)):
+        """float32 (orientations, hours) for flat orientation index s * azimuths + a."""
+        o0, o1, _ = orientations.indices(self.num_orientations)
+        h0, h1, _ = hours.indices(self.shape[2])
+        out = np.zeros((max(o1 - o0, 0), max(h1 - h0, 0)), dtype=np.float32)
+        # Daylight columns inside the hour window
+        d0, d1 = np.searchsorted(self.daylight_hours, [h0, h1])
+        if o1 <= o0 or d1 <= d0:
+            return out
+        for ob in range(o0 // self.chunk_orientations, (o1 - 1) // self.chunk_orientations + 1):
+            base = ob * self.chunk_orientations
+            r0, r1 = max(o0, base) - base, min(o1, base + self.chunk_orientations) - base
+            for hb in range(d0 // self.chunk_hours, (d1 - 1) // self.chunk_hours + 1):
+                col = hb * self.chunk_hours
+                c0, c1 = max(d0, col) - col, min(d1, col + self.chunk_hours) - col
+                values = self._chunk(ob, hb)[r0:r1, c0:c1]
+                out[base + r0 - o0:base + r1 - o0, self.daylight_hours[col + c0:col + c1] - h0] = values * self.precision
+        return out
+
+    def read(self, slopes=slice(None), azimuths=slice(None), hours=slice(None)):
+        """float32 (slopes, azimuths, hours) for slices of the grid."""
+        num_slopes, num_azimuths, _ = self.shape
+        s0, s1, _ = slopes.indices(num_slopes)
+        a0, a1, _ = azimuths.indices(num_azimuths)
+        rows = self.read_flat(slice(s0 * num_azimuths, s1 * num_azimuths), hours)
+        return rows.reshape(s1 - s0, num_azimuths, -1)[:, a0:a1]
+
+    def __getitem__(self, key):
+        """``reader[slopes, azimuths, hours]`` with plain slices, like a dense cube."""
+        return self.read(*key)
+
+    def orientation(self, s, a):
+        o = s * self.shape[1] + a
+        return self.read_flat(slice(o, o + 1))[0]
+
+    def to_dense(self):
+        return self.read()
+
+
+def decode_throughput(path, repeat=1):
+    """Full-decode speed of a .pvz file in MB of float32 output per second."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        cube = PvzReader(path, cache_chunks=0).to_dense()
+    elapsed = time.perf_counter() - started
+    return {"decode_s": round(elapsed / repeat, 3), "decode_mb_per_s": round(cube.nbytes * repeat / elapsed / 1e6, 1)}
@@ -0,0 +1,349 @@
+"""
+Async PVGIS client used by getData.
+
+One httpx.AsyncClient keeps connections alive across all orientation
+requests of a run. 429/5xx responses and transport errors are retried with
+exponential backoff and jitter, and the number of requests in flight
+follows an AIMD limit driven by observed latency and errors. Every run
+reports its statistics through RunStats.summary(); the same requests are
+counted process-wide in the pvgis_* metrics on /metrics.
+"""
+import asyncio
+import calendar
+import json
+import os
+import random
+import re
+import time
+import httpx
+import numpy as np
+import telemetry
+import transposition
+
+PVGIS_BASE_URL = os.getenv("PVGIS_BASE_URL", "https://re.jrc.ec.europa.eu/api/v5_2/")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+HOURS = 8760
+
+PVGIS_REQUESTS = telemetry.counter("pvgis_requests_total", "PVGIS requests, by HTTP status or transport_error", ("status",))
+PVGIS_LATENCY = telemetry.histogram("pvgis_request_seconds", "PVGIS response time of answered requests")
+PVGIS_RETRIES = telemetry.counter("pvgis_retries_total", "PVGIS requests retried after throttling or errors")
+PVGIS_FAILURES = telemetry.counter(
+    "pvgis_failures_total", "PVGIS requests given up on, by kind (http, retries_exhausted, bad_payload)", ("kind",)
+)
+
+
+class PvgisError(Exception):
+    pass
+
+
+# ------------------------
+# Adaptive concurrency limit
+# ------------------------
+class AdaptiveLimiter:
+    """
+    Additive-increase / multiplicative-decrease limit on requests in flight.
+
+    The limit grows by roughly one per round trip while latency stays within
+    ``latency_tolerance`` times the fastest latency seen, shrinks by 10% when
+    latency climbs above it and halves on throttling or errors.
+    """
+
+    def __init__(self, initial=10, minimum=1, maximum=64, latency_tolerance=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self.best_latency = None
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record_success(self, latency):
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+        if latency > self.best_latency * self.latency_tolerance:
+            self.limit = max(self.minimum, self.limit * 0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.peak_limit = max(self.peak_limit, self.limit)
+
+    def record_failure(self):
+        # Failures of requests that were already in flight together count once
+        now = time.monotonic()
+        if now - self._last_decrease >= (self.best_latency or 0.0):
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+
+# ------------------------
+# Per-run statistics
+# ------------------------
+class RunStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.status_counts = {}
+        self.latencies = []
+
+    def record(self, status, latency):
+        self.requests += 1
+        self.status_counts[str(status)] = self.status_counts.get(str(status), 0) + 1
+        PVGIS_REQUESTS.inc(status=status)
+        if latency is not None:
+            self.latencies.append(latency)
+            PVGIS_LATENCY.observe(latency)
+
+    def fail(self, kind):
+        self.failures += 1
+        PVGIS_FAILURES.inc(kind=kind)
+
+    def summary(self, limiter=None):
+        elapsed = time.monotonic() - self.started
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        summary = {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "status_counts": self.status_counts,
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(self.requests / elapsed, 2) if elapsed else 0.0,
+            "latency_p50_s": round(float(np.percentile(latencies, 50)), 4),
+            "latency_p95_s": round(float(np.percentile(latencies, 95)), 4),
+            "latency_max_s": round(float(latencies.max()), 4),
+        }
+        if limiter:
+            summary["concurrency_final"] = round(limiter.limit, 2)
+            summary["concurrency_peak"] = round(limiter.peak_limit, 2)
+        return summary
+
+
+# ------------------------
+# Response decoding
+# ------------------------
+def fit_hours(values, hours=HOURS):
+    """Pad with zeros or truncate an hourly profile to exactly ``hours``."""
+    values = np.asarray(values, dtype=np.float32).ravel()
+    if values.size < hours:
+        return np.pad(values, (0, hours - values.size), mode="constant")
+    return values[:hours]
+
+
+def split_years(values, startyear, endyear, hours=HOURS):
+    """
+    Cut a multi-year hourly series into a (years, ``hours``) array.
+
+    Each year takes its own length (8784 hours in leap years) from the series
+    and is fitted to ``hours`` like a single-year response.
+    """
+    values = np.asarray(values, dtype=np.float32).ravel()
+    rows, start = [], 0
+    for year in range(startyear, endyear + 1):
+        length = 8784 if calendar.isleap(year) else 8760
+        rows.append(fit_hours(values[start:start + length], hours))
+        start += length
+    return np.stack(rows)
+
+
+def decode_hourly(data, years=None):
+    """
+    Extract the hourly PV power column from a seriescalc JSON payload.
+
+    With ``years`` (startyear, endyear) the series is split per year.
+    """
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    hourly = data.get("outputs", {}).get("hourly") if isinstance(data, dict) else None
+    if not isinstance(hourly, list) or not hourly:
+        message = data.get("message") if isinstance(data, dict) else None
+        raise PvgisError(message or "Response has no hourly outputs")
+
+    for column in ("P", "P_ac"):
+        if column in hourly[0]:
+            values = [h[column] for h in hourly]
+            return split_years(values, *years) if years else fit_hours(values)
+    raise PvgisError("Response has no P or P_ac column")
+
+
+_HOURLY_START = re.compile(rb'"hourly"\s*:\s*\[')
+
+
+def extract_column(content, column, start=0):
+    """
+    Values of one numeric hourly column as float32, read from raw JSON bytes.
+
+    Only the matched number literals are materialized; no per-hour dicts.
+    """
+    pattern = re.compile(rb'"' + re.escape(column.encode()) + rb'"\s*:\s*(-?[0-9][0-9.eE+-]*)')
+    values = pattern.findall(content, start)
+    return np.fromstring(b" ".join(values), dtype=np.float32, sep=" ") if values else np.empty(0, np.float32)
+
+
+def decode_hourly_content(content, years=None):
+    """Same result as decode_hourly(json.loads(content), years), without building the hourly dicts."""
+    start = _HOURLY_START.search(content)
+    if start:
+        for column in ("P", "P_ac"):
+            values = extract_column(content, column, start.end())
+            if values.size:
+                return split_years(values, *years) if years else fit_hours(values)
+    # Error payloads and unexpected layouts go through the full decoder for its messages
+    try:
+        data = json.loads(content)
+    except ValueError:
+        raise PvgisError("Response is not valid JSON")
+    return decode_hourly(data, years)
+
+
+# ------------------------
+# Client
+# ------------------------
+class PvgisClient:
+    def __init__(
+        self,
+        base_url=PVGIS_BASE_URL,
+        concurrency=10,
+        max_concurrency=64,
+        max_retries=5,
+        timeout=60.0,
+        backoff=0.5,
+        max_backoff=30.0,
+        transport=None,
+    ):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.transport = transport
+        self.limiter = AdaptiveLimiter(initial=concurrency, maximum=max_concurrency)
+        self.stats = RunStats()
+        self._client = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url, timeout=self.timeout, limits=limits, transport=self.transport
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff, float(retry_after))
+        # Full jitter keeps retries from many requests from lining up again
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def get_json(self, path, params):
+        """GET with retries; returns the decoded JSON body."""
+        return (await self.get(path, params)).json()
+
+    async def get(self, path, params):
+        """GET with retries; returns the successful response."""
+        for attempt in range(self.max_retries + 1):
+            response = None
+            async with self.limiter:
+                started = time.monotonic()
+                try:
+                    response = await self._client.get(path, params=params)
+                except httpx.TransportError as e:
+                    error = f"{type(e).__name__}: {e}"
+                    self.stats.record("transport_error", None)
+                else:
+                    latency = time.monotonic() - started
+                    self.stats.record(response.status_code, latency)
+                    if response.status_code < 400:
+                        self.limiter.record_success(latency)
+                        return response
+                    error = f"HTTP {response.status_code}: {response.text[:200]}"
+                    if response.status_code not in RETRY_STATUSES:
+                        self.stats.fail("http")
+                        raise PvgisError(error)
+
+                self.limiter.record_failure()
+
+            if attempt < self.max_retries:
+                self.stats.retries += 1
+                PVGIS_RETRIES.inc()
+                await asyncio.sleep(self._retry_delay(attempt, response))
+
+        self.stats.fail("retries_exhausted")
+        raise PvgisError(f"Giving up after {self.max_retries + 1} attempts: {error}")
+
+    async def fetch_hourly(self, lat, lon, startyear, endyear, slope_val, azimuth_val, power_wp=1000):
+        """
+        Hourly PV output (W) of one orientation as a float32 array; one
+        request covers the whole year range, returned as (years, HOURS).
+        """
+        params = {
+            "lat": f"{lat:.6f}",
+            "lon": f"{lon:.6f}",
+            "startyear": startyear,
+            "endyear": endyear,
+            "angle": f"{slope_val:.1f}",
+            "aspect": f"{azimuth_val:.1f}",
+            "pvtechchoice": "crystSi",
+            "peakpower": f"{power_wp / 1000:.3f}",
+            "pvcalculation": 1,
+            "loss": 14,
+            "outputformat": "json",
+        }
+        response = await self.get("seriescalc", params)
+        try:
+            years = (startyear, endyear) if endyear != startyear else None
+            return decode_hourly_content(response.content, years)
+        except PvgisError:
+            self.stats.fail("bad_payload")
+            raise
+
+    async def fetch_components(self, lat, lon, startyear, endyear):
+        """Raw seriescalc payload with horizontal irradiance components and weather."""
+        params = transposition.component_params(lat, lon, startyear, endyear)
+        data = await self.get_json("seriescalc", params)
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        hourly = data.get("outputs", {}).get("hourly") if isinstance(data, dict) else None
+        if not hourly or "Gb(i)" not in hourly[0]:
+            self.stats.fail("bad_payload")
+            message = data.get("message") if isinstance(data, dict) else None
+            raise PvgisError(message or "Response has no irradiance components")
+        return data
+
+
+async def fetch_grid(client, lat, lon, year, tasks, on_result, end_year=None):
+    """
+    Fetch every (s, a, slope, azimuth) task through ``client``, each over
+    ``year``..``end_year`` when an end year is given.
+
+    ``on_result(s, a, hourly)`` is called as each orientation arrives.
+    Returns the orientations that still failed after retries.
+    """
+    async def fetch_one(s, a, slope_val, azimuth_val):
+        hourly = await client.fetch_hourly(lat, lon, year, end_year or year, slope_val, azimuth_val)
+        on_result(s, a, hourly)
+
+    results = await asyncio.gather(*(fetch_one(*task) for task in tasks), return_exceptions=True)
+    failed = []
+    for task, result in zip(tasks, results):
+        if isinstance(result, PvgisError):
+            failed.append({"slope": float(task[2]), "azimuth": float(task[3]), "error": str(result)})
+        elif isinstance(result, BaseException):
+            raise result
+    return failed
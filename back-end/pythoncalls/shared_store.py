@@ -0,0 +1,51 @@
+"""
+Content-addressed store on the data volume shared by pythoncalls, savedata
+and matlab.
+
+Finished cubes are written under SHARED_DATA_DIR/tmp, hashed, and renamed
+atomically to SHARED_DATA_DIR/objects/<aa>/<sha256><ext>. Services then pass
+only the digest around; nobody copies the bytes again. The mode is off when
+SHARED_DATA_DIR is not set.
+"""
+import hashlib
+import os
+import uuid
+
+SHARED_DATA_DIR = os.getenv("SHARED_DATA_DIR", "")
+HASH_CHUNK = 8 * 1024 * 1024
+
+
+def enabled():
+    return bool(SHARED_DATA_DIR)
+
+
+def tmp_path(filename):
+    """Unique scratch path on the shared volume, so the commit is a rename."""
+    tmp_dir = os.path.join(SHARED_DATA_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f"{uuid.uuid4().hex}_{filename}")
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def object_path(digest, extension):
+    return os.path.join(SHARED_DATA_DIR, "objects", digest[:2], digest + extension)
+
+
+def commit_object(path):
+    """Move a finished file into the object store; returns its sha256 digest."""
+    digest = file_digest(path)
+    target = object_path(digest, os.path.splitext(path)[1])
+    if os.path.exists(target):
+        # Identical content is already stored; keep the existing object
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    return digest
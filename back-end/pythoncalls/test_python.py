@@ -1,10 +1,22 @@
+import os
+import asyncio
+import threading
+import time
 import pytest
 import json
 import numpy as np
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 
+from functools import partial
+import httpx
+
 from main import app  # adjust if your file is named differently
+import pvcube
+import pvcodec
+import transfer
+import telemetry
+from pvgis_client import PvgisClient, PvgisError, AdaptiveLimiter, decode_hourly, decode_hourly_content
 
 client = TestClient(app)
 
@@ -16,6 +28,34 @@ def fake_pvgis_data(*args, **kwargs):
     hourly = [{"P": i % 100} for i in range(8760)]
     return {"outputs": {"hourly": hourly}}
 
+@pytest.fixture(autouse=True)
+def isolated_profile_cache(tmp_path, monkeypatch):
+    """Every test starts with an empty per-orientation cache."""
+    import profile_cache
+    monkeypatch.setattr(profile_cache, "PROFILE_CACHE_PATH", str(tmp_path / "profiles.sqlite"))
+
+@pytest.fixture(autouse=True)
+def isolated_jobs(tmp_path, monkeypatch):
+    """Every test gets its own job database and worker pool."""
+    import main, jobs
+    monkeypatch.setattr(jobs, "JOBS_DB_PATH", str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(main, "_job_manager", None)
+    yield
+    if main._job_manager is not None:
+        main._job_manager.shutdown()
+
+@pytest.fixture
+def fake_pvgis():
+    """Serve fake_pvgis_data through the async PVGIS client; yields the request log."""
+    seen = []
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json=fake_pvgis_data())
+
+    transport = httpx.MockTransport(handler)
+    with patch("main.PvgisClient", partial(PvgisClient, transport=transport)):
+        yield seen
+
 # ------------------------
 # Fake HTTP responses
 # ------------------------
@@ -35,9 +75,9 @@ class FakeResponse:
 # Test /getData endpoint
 # ------------------------
 @patch("main.post_file_to_saveData")  # Avoid real file POST
-@patch("main.requests.get")           # Mock PVGIS API & savedata GET
+@patch("main.requests.get")           # Mock savedata GET
 @patch("main.save_pv")                # Mock save_pv (no real .mat file)
-def test_getData(mock_save_pv, mock_requests_get, mock_post_file):
+def test_getData(mock_save_pv, mock_requests_get, mock_post_file, fake_pvgis):
     """
     Test /getData endpoint:
     - mocks PVGIS API
@@ -46,15 +86,9 @@ def test_getData(mock_save_pv, mock_requests_get, mock_post_file):
     """
 
     # ------------------------
-    # Mock savedata checkFile and PVGIS
+    # Mock savedata checkFile
     # ------------------------
-    def get_side_effect(url, params=None):
-        if "checkFile" in url:
-            return FakeResponse({"exists": False})  # pretend file does not exist
-        else:
-            return FakeResponse(fake_pvgis_data())  # PVGIS API
-
-    mock_requests_get.side_effect = get_side_effect
+    mock_requests_get.return_value = FakeResponse({"exists": False})  # pretend file does not exist
 
     # ------------------------
     # Mock save_pv to just return a fake file path
@@ -91,11 +125,590 @@ def test_getData(mock_save_pv, mock_requests_get, mock_post_file):
     assert "filename" in json_data
     assert json_data["filename"].startswith("all_Ppv_data_azires")
 
-    # PVGIS API should have been called multiple times
-    assert mock_requests_get.call_count > 1
+    # PVGIS API should have been called once per orientation
+    assert len(fake_pvgis) == 5 * 19  # 0..80 step 20 slopes, -90..90 step 10 azimuths
+    assert json_data["stats"]["requests"] == 5 * 19
 
     # save_pv should be called once
     mock_save_pv.assert_called_once()
 
     # post_file_to_saveData should be called once
     mock_post_file.assert_called_once()
+
+# ------------------------
+# Dense .pvc cube format
+# ------------------------
+
+def test_pvcube_roundtrip(tmp_path):
+    path = str(tmp_path / "cube.pvc")
+    cube = pvcube.create_cube(path, 45, 30, 52.0, 5.0, 2019)
+    assert cube.shape == (4, 5, 8760)
+    cube[2, 3] = np.arange(8760, dtype=np.float32)
+    cube.flush()
+    del cube
+
+    loaded, header = pvcube.open_cube(path)
+    assert isinstance(loaded, np.memmap)
+    assert header["lat"] == 52.0 and header["year"] == 2019
+    assert header["azimuth_res"] == 45 and header["slope_res"] == 30
+    np.testing.assert_array_equal(loaded[2, 3], np.arange(8760, dtype=np.float32))
+    assert not loaded[0].any()
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_pvc_format(mock_requests_get, mock_post_file, fake_pvgis):
+    uploaded = {}
+    def capture_upload(file_path, **kwargs):
+        cube, header = pvcube.open_cube(file_path)
+        uploaded["cube"] = np.array(cube)
+        uploaded["header"] = header
+
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    mock_post_file.side_effect = capture_upload
+
+    params = {"azimuth": 45, "slope": 45, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc"}
+    response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    assert response.json()["filename"].endswith(".pvc")
+    assert uploaded["cube"].shape == (3, 5, 8760)
+    assert uploaded["header"]["lon"] == 5.0
+    np.testing.assert_array_equal(uploaded["cube"][1, 4], np.arange(8760) % 100)
+
+# ------------------------
+# Compressed .pvz cube format
+# ------------------------
+
+def test_pvcodec_roundtrip_and_random_access(tmp_path):
+    rng = np.random.default_rng(0)
+    hours = np.arange(8760)
+    daylight = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None)
+    cube = (daylight * (600 + 40 * rng.random((7, 13, 1)))).astype(np.float32)
+    path = str(tmp_path / "cube.pvz")
+
+    stats = pvcodec.encode(cube, path, precision=0.1, chunk_orientations=16, chunk_hours=500, lat=52.0)
+    assert stats["ratio"] > 3 and stats["daylight_fraction"] < 0.6
+    reader = pvcodec.PvzReader(path, cache_chunks=4)
+    assert reader.shape == (7, 13, 8760) and reader.header["lat"] == 52.0
+    np.testing.assert_allclose(reader.to_dense(), cube, atol=0.05 + 1e-4)
+    np.testing.assert_allclose(reader[2:5, 3:9, 4000:5000], cube[2:5, 3:9, 4000:5000], atol=0.05 + 1e-4)
+    np.testing.assert_allclose(reader.orientation(6, 12), cube[6, 12], atol=0.05 + 1e-4)
+    assert not reader[:, :, 0:5].any()  # night hours are not stored
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_pvz_format(mock_requests_get, mock_post_file, fake_pvgis):
+    uploaded = {}
+    def capture_upload(file_path, **kwargs):
+        reader = pvcodec.PvzReader(file_path)
+        uploaded["cube"], uploaded["header"] = reader.to_dense(), reader.header
+
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    mock_post_file.side_effect = capture_upload
+
+    params = {"azimuth": 45, "slope": 45, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvz"}
+    response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    assert response.json()["filename"].endswith(".pvz")
+    assert response.json()["stats"]["codec"]["ratio"] > 1
+    assert uploaded["header"]["azimuth_res"] == 45 and uploaded["header"]["lon"] == 5.0
+    np.testing.assert_allclose(uploaded["cube"][1, 4], np.arange(8760) % 100, atol=0.05 + 1e-4)
+
+# ------------------------
+# Streaming upload to savedata
+# ------------------------
+
+def test_upload_resumes_from_offset_held_by_savedata(tmp_path):
+    path = tmp_path / "cube.pvc"
+    path.write_bytes(b"0123456789" * 100)
+    head = MagicMock(headers={"Upload-Offset": "400"})
+    sent = {}
+    def fake_put(url, params=None, headers=None, data=None):
+        sent.update(headers=headers, body=b"".join(data))
+        return MagicMock(status_code=200, json=lambda: {"status": "ok"})
+
+    with patch("transfer.requests.head", return_value=head), patch("transfer.requests.put", side_effect=fake_put):
+        assert transfer.upload_file("http://savedata:8505/uploads/2019/cube.pvc", str(path), chunk_size=64) == {"status": "ok"}
+    assert sent["headers"]["Upload-Offset"] == "400" and sent["headers"]["Upload-Length"] == "1000"
+    assert sent["body"] == path.read_bytes()[400:]
+    assert sent["headers"][transfer.CHECKSUM_HEADER] == transfer.hash_file(str(path)).hexdigest()
+
+# ------------------------
+# Shared volume object store
+# ------------------------
+def test_commit_object_is_content_addressed(tmp_path, monkeypatch):
+    import shared_store
+    monkeypatch.setattr(shared_store, "SHARED_DATA_DIR", str(tmp_path))
+
+    first = shared_store.tmp_path("cube.pvc")
+    second = shared_store.tmp_path("cube.pvc")
+    for path in (first, second):
+        with open(path, "wb") as f:
+            f.write(b"same bytes")
+
+    digest = shared_store.commit_object(first)
+    assert shared_store.commit_object(second) == digest
+    assert not os.path.exists(first) and not os.path.exists(second)
+    with open(shared_store.object_path(digest, ".pvc"), "rb") as f:
+        assert f.read() == b"same bytes"
+
+@patch("main.requests.post")
+@patch("main.requests.get")
+def test_getData_shared_volume_registers_digest(mock_requests_get, mock_requests_post, tmp_path, monkeypatch, fake_pvgis):
+    import shared_store
+    monkeypatch.setattr(shared_store, "SHARED_DATA_DIR", str(tmp_path))
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    mock_requests_post.return_value = FakeResponse({"status": "ok"})
+
+    params = {"azimuth": 90, "slope": 90, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc"}
+    response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    url = mock_requests_post.call_args[0][0]
+    sent = mock_requests_post.call_args[1]["params"]
+    assert url.endswith("/registerDataFile")
+    assert sent["filename"] == response.json()["filename"]
+    cube, header = pvcube.open_cube(shared_store.object_path(sent["digest"], ".pvc"))
+    assert cube.shape == (2, 3, 8760) and header["year"] == 2019
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+# ------------------------
+# Async PVGIS client
+# ------------------------
+def run_client(handler, **kwargs):
+    async def fetch():
+        client = PvgisClient(base_url="http://pvgis.local/api/", transport=httpx.MockTransport(handler), backoff=0, **kwargs)
+        async with client:
+            try:
+                return await client.fetch_hourly(52.0, 5.0, 2019, 2019, 35, 0), client
+            except PvgisError as e:
+                return e, client
+    return asyncio.run(fetch())
+
+def test_pvgis_client_retries_throttling_and_server_errors():
+    responses = iter([
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(503),
+        httpx.Response(200, json=fake_pvgis_data()),
+    ])
+    seen = []
+    def handler(request):
+        seen.append(request)
+        return next(responses)
+
+    hourly, client = run_client(handler)
+
+    assert hourly.dtype == np.float32 and hourly.shape == (8760,)
+    assert str(seen[0].url).startswith("http://pvgis.local/api/seriescalc?")
+    assert client.stats.retries == 2
+    assert client.stats.summary()["status_counts"] == {"429": 1, "503": 1, "200": 1}
+    metrics = telemetry.render()
+    assert 'pvgis_requests_total{status="429"}' in metrics and "pvgis_request_seconds_count" in metrics
+
+def test_pvgis_client_gives_up_on_client_errors():
+    error, client = run_client(lambda request: httpx.Response(400, json={"message": "bad aspect"}))
+    assert isinstance(error, PvgisError)
+    assert client.stats.requests == 1 and client.stats.failures == 1
+
+def test_pvgis_client_stops_after_max_retries():
+    error, client = run_client(lambda request: httpx.Response(500), max_retries=2)
+    assert isinstance(error, PvgisError)
+    assert client.stats.requests == 3
+
+def test_decode_hourly_handles_list_payloads_and_padding():
+    hourly = decode_hourly([{"outputs": {"hourly": [{"P_ac": 5.0}] * 100}}])
+    assert hourly.shape == (8760,) and hourly[99] == 5.0 and hourly[100] == 0
+    with pytest.raises(PvgisError):
+        decode_hourly([])
+
+def test_decode_hourly_content_matches_dict_decoding():
+    payloads = [
+        {"outputs": {"hourly": [{"time": "20190101:0010", "P": -1.5e-2, "G(i)": 3.0}, {"P": 812.25}] * 4400},
+         "meta": {"outputs": {"hourly": {"variables": {"P": {"units": "W"}}}}}},
+        [{"outputs": {"hourly": [{"P_ac": 5.0}] * 100}}],
+    ]
+    for data in payloads:
+        for separators in ((", ", ": "), (",", ":")):
+            content = json.dumps(data, separators=separators).encode()
+            np.testing.assert_array_equal(decode_hourly_content(content), decode_hourly(data))
+    with pytest.raises(PvgisError, match="bad aspect"):
+        decode_hourly_content(b'{"message": "bad aspect", "status": 400}')
+    with pytest.raises(PvgisError):
+        decode_hourly_content(b"<html>")
+
+def test_adaptive_limiter_backs_off_and_recovers():
+    limiter = AdaptiveLimiter(initial=8, maximum=10)
+    limiter.record_success(0.1)
+    limiter.record_failure()
+    assert limiter.limit < 8
+    low = limiter.limit
+    for _ in range(50):
+        limiter.record_success(0.1)
+    assert low < limiter.limit <= 10
+    limiter.record_success(1.0)  # far slower than the best latency seen
+    assert limiter.limit < 10
+
+
+# ------------------------
+# Per-orientation profile cache
+# ------------------------
+def test_profile_cache_roundtrip(tmp_path):
+    from profile_cache import ProfileCache
+    cache = ProfileCache(str(tmp_path / "cache.sqlite"))
+    cache.put(52.000001, 5.0, 2019, 30, -45, np.arange(8760, dtype=np.float32))
+
+    np.testing.assert_array_equal(cache.get(52.0, 5.0, 2019, 30.0, -45.0), np.arange(8760))
+    assert cache.get(52.0, 5.0, 2020, 30, -45) is None
+
+    hits = {}
+    served = cache.fill(52.0, 5.0, 2019, {(30, -45): "a", (30, 45): "b"}, lambda target, hourly: hits.setdefault(target, hourly))
+    assert served == {(30, -45)} and list(hits) == ["a"]
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_reuses_cached_orientations_across_resolutions(mock_requests_get, mock_post_file, fake_pvgis):
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    params = {"azimuth": 45, "slope": 45, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc"}
+
+    first = client.get("/getData", params=params).json()
+    assert first["stats"]["requests"] == 15 and first["stats"]["cached"] == 0
+
+    # Every 90 degree orientation is part of the 45 degree grid
+    second = client.get("/getData", params={**params, "azimuth": 90, "slope": 90}).json()
+    assert second["stats"]["requests"] == 0 and second["stats"]["cached"] == 6
+    assert len(fake_pvgis) == 15
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_multi_year_fetches_each_orientation_once(mock_requests_get, mock_post_file):
+    seen = []
+    def handler(request):
+        seen.append(request)
+        # 2020 is a leap year: 8784 hours, cut back to 8760 like a single-year response
+        hourly = [{"P": 1.0} for _ in range(8760)] + [{"P": 2.0} for _ in range(8784)]
+        return httpx.Response(200, json={"outputs": {"hourly": hourly}})
+
+    uploaded = {}
+    def capture_upload(file_path, **kwargs):
+        cube, header = pvcube.open_cube(file_path)
+        uploaded["cube"], uploaded["header"] = np.array(cube), header
+
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    mock_post_file.side_effect = capture_upload
+    params = {"azimuth": 45, "slope": 45, "latit": 52.0, "longit": 5.0, "year": 2019, "endYear": 2020, "fileFormat": "pvc"}
+    pvgis = patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler)))
+    with pvgis:
+        response = client.get("/getData", params=params)
+
+    assert response.json()["filename"].endswith("_years_2019-2020.pvc")
+    assert len(seen) == 15 and {r.url.params["endyear"] for r in seen} == {"2020"}
+    assert uploaded["header"]["end_year"] == 2020 and uploaded["cube"].shape == (3, 5, 2 * 8760)
+    np.testing.assert_array_equal(pvcube.select_year(uploaded["cube"], uploaded["header"], 2020), 2.0)
+    np.testing.assert_array_equal(pvcube.select_year(uploaded["cube"], uploaded["header"], "average"), 1.5)
+    np.testing.assert_array_equal(pvcube.select_year(uploaded["cube"], uploaded["header"], "worst"), 1.0)
+
+    # Each year of the multi-year fetch was cached on its own
+    with pvgis:
+        single = client.get("/getData", params={**params, "year": 2020, "endYear": 2020}).json()
+    assert single["stats"]["requests"] == 0 and single["stats"]["cached"] == 15
+    assert client.get("/getData", params={**params, "fileFormat": "mat"}).status_code == 400
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_resumes_after_failed_orientations(mock_requests_get, mock_post_file):
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    broken = {"on": True}
+    def handler(request):
+        if broken["on"] and request.url.params["aspect"] == "90.0":
+            return httpx.Response(400, json={"message": "bad aspect"})
+        return httpx.Response(200, json=fake_pvgis_data())
+
+    params = {"azimuth": 90, "slope": 90, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc"}
+    with patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler))):
+        response = client.get("/getData", params=params)
+        assert response.status_code == 502
+        mock_post_file.assert_not_called()
+
+        broken["on"] = False
+        response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    stats = response.json()["stats"]
+    assert stats["requests"] == 2 and stats["cached"] == 4
+    mock_post_file.assert_called_once()
+
+# ------------------------
+# Adaptive coarse-to-fine mode
+# ------------------------
+def test_adaptive_refine_finds_peak_with_few_fetches():
+    import adaptive_grid
+    num_slopes, num_azimuths = 91, 181
+    slopes, azimuths = np.meshgrid(np.arange(num_slopes), np.arange(num_azimuths) - 90, indexing="ij")
+    truth = 1000 - (slopes - 37) ** 2 - 0.5 * (azimuths - 12) ** 2
+    cube = np.zeros((num_slopes, num_azimuths, 1), dtype=np.float32)
+
+    async def fetch_level(indices):
+        for s, a in indices:
+            cube[s, a, 0] = truth[s, a]
+        return 0, []
+
+    fetched, cached, failed = asyncio.run(adaptive_grid.refine(fetch_level, cube, 10, 10, top_k=4))
+
+    assert (37, 102) in fetched  # the true optimum at 1 degree
+    assert len(fetched) < num_slopes * num_azimuths / 20
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_adaptive_writes_sparse_cube(mock_requests_get, mock_post_file):
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    def handler(request):
+        slope_val, azimuth_val = float(request.url.params["angle"]), float(request.url.params["aspect"])
+        peak = max(0.0, 500 - (slope_val - 35) ** 2 - (azimuth_val - 10) ** 2 / 4)
+        return httpx.Response(200, json={"outputs": {"hourly": [{"P": peak}] * 8760}})
+
+    uploaded = {}
+    mock_post_file.side_effect = lambda file_path, **kwargs: uploaded.update(zip(("cube", "header"), pvcube.open_cube(file_path)))
+
+    params = {"azimuth": 5, "slope": 5, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc", "adaptive": True}
+    with patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler))):
+        response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    assert response.json()["filename"].startswith("all_Ppv_data_adaptive_azires_5")
+    stats = response.json()["stats"]
+    assert stats["requests"] == stats["orientations"] < stats["grid_size"]
+    assert uploaded["header"]["coverage"] == "sparse"
+    assert uploaded["cube"][7, 20, 0] > 0  # slope 35, azimuth 10 was visited
+
+# ------------------------
+# Local transposition engine
+# ------------------------
+def fake_components(lat=52.0, lon=5.0):
+    """Clear-sky-like horizontal components in PVGIS components=1 layout."""
+    import transposition
+    times = np.datetime64("2019-01-01T00:10") + np.arange(8760) * np.timedelta64(60, "m")
+    sun, _ = transposition.sun_position(times, lat, lon)
+    sin_h = np.clip(sun[2], 0, None)
+    hourly = [
+        {"time": t.astype(object).strftime("%Y%m%d:%H%M"),
+         "Gb(i)": float(900 * s ** 1.3), "Gd(i)": float(120 * s ** 0.8), "T2m": 10.0, "WS10m": 3.0}
+        for t, s in zip(times, sin_h)
+    ]
+    return {"outputs": {"hourly": hourly}}
+
+def test_local_engine_geometry():
+    import transposition
+    data = fake_components()
+    assert data["outputs"]["hourly"][13]["time"] == "20190101:1310"
+    comp = transposition.decode_components(data)
+    profile = lambda sl, az: transposition.orientation_profile(comp, 52.0, 5.0, sl, az)
+
+    horizontal, south, north = profile(0, 0), profile(35, 0), profile(35, 180)
+    assert not horizontal[comp["Gb"] + comp["Gd"] == 0].any()  # nothing at night
+    assert south.sum() > horizontal.sum() > north.sum()
+    np.testing.assert_allclose(profile(35, -90).sum(), profile(35, 90).sum(), rtol=0.01)
+    # Horizontal output stays below the 14 % loss bound of global irradiance
+    assert 0.7 < horizontal.sum() / (comp["Gb"] + comp["Gd"]).sum() < 0.86
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_getData_local_engine_fetches_once(mock_requests_get, mock_post_file):
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    seen = []
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json=fake_components())
+
+    uploaded = {}
+    mock_post_file.side_effect = lambda file_path, **kwargs: uploaded.update(zip(("cube", "header"), pvcube.open_cube(file_path)))
+
+    params = {"azimuth": 45, "slope": 45, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc", "engine": "local"}
+    with patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler))):
+        response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    assert response.json()["filename"].startswith("all_Ppv_data_local_azires_45")
+    assert len(seen) == 1 and seen[0].url.params["components"] == "1"
+    assert uploaded["header"]["engine"] == "local"
+    assert uploaded["cube"].shape == (3, 5, 8760) and uploaded["cube"][1, 2].sum() > uploaded["cube"][0, 2].sum()
+
+def test_validateTransposition_reports_bias():
+    import transposition
+    comp = transposition.decode_components(fake_components())
+    def handler(request):
+        if request.url.params["pvcalculation"] == "0":
+            return httpx.Response(200, json=fake_components())
+        slope_val, azimuth_val = float(request.url.params["angle"]), float(request.url.params["aspect"])
+        # PVGIS stand-in 5 % above the local engine
+        p = 1.05 * transposition.orientation_profile(comp, 52.0, 5.0, slope_val, azimuth_val)
+        return httpx.Response(200, json={"outputs": {"hourly": [{"P": float(v)} for v in p]}})
+
+    params = {"latit": 52.0, "longit": 5.0, "year": 2019, "orientations": "35:0,90:-90"}
+    with patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler))):
+        response = client.get("/validateTransposition", params=params)
+
+    assert response.status_code == 200
+    report = response.json()
+    assert [(o["slope"], o["azimuth"]) for o in report["orientations"]] == [(35.0, 0.0), (90.0, -90.0)]
+    assert report["mean_abs_annual_bias_pct"] == pytest.approx(4.76, abs=0.02)
+    assert all(o["correlation"] > 0.999 for o in report["orientations"])
+    assert client.get("/validateTransposition", params={**params, "orientations": "35"}).status_code == 400
+
+# ------------------------
+# Background jobs
+# ------------------------
+def wait_for_job(job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").json()
+        if status["state"] in ("done", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_job_store_single_flight_and_resume(tmp_path):
+    import jobs
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite"))
+    first, created = store.submit("2019/a.pvc", {"year": 2019})
+    assert created and store.submit("2019/a.pvc", {"year": 2019}) == (first, False)
+    other, created = store.submit("2019/b.pvc", {"year": 2019})
+    assert created and other != first
+    store.start(first)
+    store.close()
+
+    # A new process picks both unfinished jobs up again and reports progress
+    ran = []
+    def run(progress, **params):
+        progress(3, 3)
+        ran.append(params)
+        return {"filename": "a.pvc"}
+
+    manager = jobs.JobManager(jobs.JobStore(str(tmp_path / "jobs.sqlite")), run)
+    assert manager.resume() == 2
+    manager.shutdown()
+    assert ran == [{"year": 2019}] * 2
+    job = manager.store.get(first)
+    assert jobs.status(job)["progress"] == {"done": 3, "total": 3, "fraction": 1.0}
+    assert job["result"] == {"filename": "a.pvc"}
+    assert manager.store.submit("2019/a.pvc", {})[1]  # finished jobs no longer absorb new ones
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_jobs_endpoints_share_identical_requests(mock_requests_get, mock_post_file):
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    release = threading.Event()
+    def handler(request):
+        release.wait(10)
+        return httpx.Response(200, json=fake_pvgis_data())
+
+    params = {"azimuth": 45, "slope": 45, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc"}
+    with patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler))):
+        first = client.post("/jobs", params=params, headers={"X-Request-ID": "trace-job"})
+        second = client.post("/jobs", params=params)
+        assert first.status_code == second.status_code == 202
+        assert second.json()["job_id"] == first.json()["job_id"] and second.json()["deduplicated"]
+        assert client.get(f"/jobs/{first.json()['job_id']}/result").status_code == 409
+        assert 'jobs_active{state="running"}' in client.get("/metrics").text
+
+        release.set()
+        status = wait_for_job(first.json()["job_id"])
+
+    assert status["state"] == "done"
+    assert status["progress"]["done"] == status["progress"]["total"] == 15
+    result = client.get(f"/jobs/{first.json()['job_id']}/result").json()
+    assert result["filename"].endswith(".pvc") and result["stats"]["requests"] == 15
+    mock_post_file.assert_called_once()
+    # The job thread carries the trace of the request that submitted it
+    assert mock_requests_get.call_args.kwargs["headers"] == {"X-Request-ID": "trace-job"}
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.post("/jobs", params={**params, "engine": "other"}).status_code == 400
+
+@patch("main.requests.get")
+def test_failed_job_reports_error(mock_requests_get):
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    handler = lambda request: httpx.Response(400, json={"message": "bad location"})
+    params = {"azimuth": 90, "slope": 90, "latit": 52.0, "longit": 5.0, "year": 2019, "fileFormat": "pvc"}
+    with patch("main.PvgisClient", partial(PvgisClient, transport=httpx.MockTransport(handler))):
+        job_id = client.post("/jobs", params=params).json()["job_id"]
+        status = wait_for_job(job_id)
+
+    assert status["state"] == "failed"
+    response = client.get(f"/jobs/{job_id}/result")
+    assert response.status_code == 502 and response.json()["detail"]["failed"][0]["error"].startswith("HTTP 400")
+
+# ------------------------
+# Bulk precompute
+# ------------------------
+def test_precompute_plan_and_grids(tmp_path):
+    import precompute
+    grid = tmp_path / "grid.csv"
+    grid.write_text("# comment\nlat,lon\n52.0,5.0\n52.5,5.5\n")
+    assert precompute.load_grid(grid) == [(52.0, 5.0), (52.5, 5.5)]
+    assert len(precompute.load_grid("grids/netherlands.csv")) == 53
+    assert precompute.bbox_grid(52.0, 5.0, 52.5, 5.5, 0.25)[-1] == (52.5, 5.5)
+    assert precompute.parse_resolution("5x2") == (5, 2) and precompute.parse_resolution("3") == (3, 3)
+
+    tasks = precompute.plan([(52.0, 5.0)], [2019], [(1, 1), (5, 5)])
+    assert [(t["azimuth"], t["slope"]) for t in tasks] == [(5, 5), (1, 1)]  # coarse first
+
+@patch("main.post_file_to_saveData")
+@patch("main.requests.get")
+def test_precompute_shares_client_and_skips_checkpointed(mock_requests_get, mock_post_file, tmp_path):
+    import precompute
+    mock_requests_get.return_value = FakeResponse({"exists": False})
+    seen = []
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json=fake_pvgis_data())
+
+    clients = []
+    def client_factory(**kwargs):
+        clients.append(PvgisClient(transport=httpx.MockTransport(handler), **kwargs))
+        return clients[-1]
+
+    tasks = precompute.plan([(52.0, 5.0), (52.5, 5.5)], [2019, 2020], [(45, 45)], fileFormat="pvc")
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    logs = []
+    summary = asyncio.run(precompute.run(
+        tasks, precompute.Checkpoint(checkpoint_path), sites_in_flight=4, log=logs.append, client_factory=client_factory
+    ))
+
+    assert len(clients) == 1 and len(seen) == 4 * 15
+    assert summary["tasks_done"] == 4 and not summary["failures"]
+    assert summary["orientations_per_s"] > 0 and summary["eta_s"] == 0
+    assert mock_post_file.call_count == 4
+
+    # A rerun only builds what is missing from the checkpoint
+    with open(checkpoint_path) as f:
+        kept = f.readlines()[:3]
+    with open(checkpoint_path, "w") as f:
+        f.writelines(kept + ['{"key": "torn'])
+    summary = asyncio.run(precompute.run(
+        tasks, precompute.Checkpoint(checkpoint_path), log=logs.append, client_factory=client_factory
+    ))
+    assert summary["tasks_total"] == summary["tasks_done"] == 1
+    assert len(seen) == 4 * 15  # its orientations came from the profile cache
+    assert "3 of 4 cubes already done" in logs
+
+# ------------------------
+# Nearby stored sites
+# ------------------------
+@patch("main.requests.get")
+def test_getData_serves_nearby_cube(mock_requests_get, fake_pvgis):
+    nearby = {"filename": "all_Ppv_data_azires_1_sloperes_1_51.56048_3.51420.mat", "mode": "nearest",
+              "sources": [{"filename": "x", "lat": 51.56048, "lon": 3.5142, "distance_km": 0.002, "weight": 1.0}]}
+    def fake_get(url, params=None, headers=None):
+        if url.endswith("/checkFile"):
+            return FakeResponse({"exists": False})
+        assert url.endswith("/nearestFile") and params["tolerance_km"] == 5.0
+        return FakeResponse(nearby)
+    mock_requests_get.side_effect = fake_get
+
+    params = {"azimuth": 1, "slope": 1, "latit": 51.5605, "longit": 3.5142, "year": 2019, "toleranceKm": 5}
+    response = client.get("/getData", params=params)
+
+    assert response.status_code == 200
+    assert response.json() == {"filename": nearby["filename"], "source": {"mode": "nearest", "sites": nearby["sources"]}}
+    assert fake_pvgis == []  # nothing fetched
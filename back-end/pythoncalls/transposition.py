@@ -0,0 +1,243 @@
+"""
+Local plane-of-array engine: one PVGIS irradiance fetch per site and year,
+hourly PV output for every orientation computed in-process.
+
+PVGIS is asked once for the horizontal beam/diffuse irradiance, air
+temperature and wind speed (seriescalc with components=1). For every
+(slope, azimuth) this module then applies the same chain PVGIS uses for
+pvtechchoice=crystSi, loss=14:
+
+- sun position from the hourly UTC timestamps
+- Muneer sky-diffuse model and isotropic ground reflection (albedo 0.2)
+- Martin & Ruiz angular reflection losses (ar = 0.16)
+- Faiman module temperature (U0 = 26.9, U1 = 6.2)
+- Huld et al. crystalline-Si efficiency model
+- 14 % system loss
+
+Spectral correction is not modelled; validation_report() quantifies the
+remaining difference against PVGIS P values.
+"""
+import numpy as np
+
+HOURS = 8760
+SOLAR_CONSTANT = 1367.0
+ALBEDO = 0.2
+SYSTEM_LOSS = 0.14
+AR = 0.16                                   # angular loss coefficient, c-Si
+C1, C2 = 4 / (3 * np.pi), -0.074            # Martin & Ruiz diffuse/ground fit
+U0, U1 = 26.9, 6.2                          # Faiman coefficients, free-standing c-Si
+HULD_CSI = (-0.017237, -0.040465, -0.004702, 0.000149, 0.000170, 0.000005)
+
+
+# ------------------------
+# PVGIS input
+# ------------------------
+def component_params(lat, lon, startyear, endyear):
+    """seriescalc query for horizontal irradiance components and weather."""
+    return {
+        "lat": f"{lat:.6f}",
+        "lon": f"{lon:.6f}",
+        "startyear": startyear,
+        "endyear": endyear,
+        "angle": "0.0",
+        "aspect": "0.0",
+        "pvcalculation": 0,
+        "components": 1,
+        "outputformat": "json",
+    }
+
+
+def decode_components(data, hours=HOURS):
+    """Columns of a components=1 response, cut or zero-padded to ``hours``."""
+    hourly = data["outputs"]["hourly"][:hours]
+    times = np.array(
+        [f"{h['time'][:4]}-{h['time'][4:6]}-{h['time'][6:8]}T{h['time'][9:11]}:{h['time'][11:13]}" for h in hourly],
+        dtype="datetime64[m]",
+    )
+    columns = {
+        "Gb": np.array([h["Gb(i)"] for h in hourly], dtype=np.float64),
+        "Gd": np.array([h["Gd(i)"] for h in hourly], dtype=np.float64),
+        "T2m": np.array([h["T2m"] for h in hourly], dtype=np.float64),
+        "WS10m": np.array([h["WS10m"] for h in hourly], dtype=np.float64),
+    }
+    if times.size < hours:
+        # Keep the clock running through the padded hours; irradiance there is zero
+        times = np.concatenate([times, times[-1] + np.arange(1, hours - times.size + 1) * np.timedelta64(60, "m")])
+        columns = {k: np.pad(v, (0, hours - v.size)) for k, v in columns.items()}
+    columns["time"] = times
+    return columns
+
+
+# ------------------------
+# Sun geometry
+# ------------------------
+def sun_position(times, lat, lon):
+    """
+    Sun unit vector (east, north, up) and day of year for UTC ``times``.
+
+    Uses the NOAA / Spencer series for declination and equation of time.
+    """
+    day = times.astype("datetime64[D]")
+    doy = (day - times.astype("datetime64[Y]")).astype(np.int64) + 1
+    minutes = (times - day).astype(np.int64).astype(np.float64)
+
+    gamma = 2 * np.pi / 365 * (doy - 1 + (minutes / 60 - 12) / 24)
+    eq_time = 229.18 * (
+        0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+        - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma)
+    )
+    decl = (
+        0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+        - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+        - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma)
+    )
+    true_solar_minutes = minutes + eq_time + 4 * lon
+    hour_angle = np.radians(true_solar_minutes / 4 - 180)
+
+    phi = np.radians(lat)
+    east = -np.cos(decl) * np.sin(hour_angle)
+    north = np.cos(phi) * np.sin(decl) - np.sin(phi) * np.cos(decl) * np.cos(hour_angle)
+    up = np.sin(phi) * np.sin(decl) + np.cos(phi) * np.cos(decl) * np.cos(hour_angle)
+    return np.stack([east, north, up]), doy
+
+
+def surface_normals(slope_deg, azimuths_deg):
+    """Unit normals (3, azimuths); aspect 0 faces south, +90 west, -90 east."""
+    beta = np.radians(slope_deg)
+    aspect = np.radians(np.asarray(azimuths_deg, dtype=np.float64))
+    return np.stack([
+        -np.sin(beta) * np.sin(aspect),
+        -np.sin(beta) * np.cos(aspect),
+        np.full(aspect.shape, np.cos(beta)),
+    ])
+
+
+# ------------------------
+# Irradiance and power models
+# ------------------------
+def _reflection_transmittance(x):
+    return 1 - np.exp(-(C1 * x + C2 * x ** 2) / AR)
+
+
+def plane_of_array(comp, sun, doy, slope_deg, azimuths_deg):
+    """
+    Irradiance reaching the cells (W/m2) for one slope and many azimuths.
+
+    Returns (effective, in_plane) arrays of shape (azimuths, hours): after
+    and before angular reflection losses.
+    """
+    beta = np.radians(slope_deg)
+    sin_h = sun[2]
+    above = sin_h > 0.0
+    safe_sin_h = np.where(above, sin_h, 1.0)
+
+    gb, gd = np.where(above, comp["Gb"], 0.0), comp["Gd"]
+    dni = np.minimum(gb / safe_sin_h, SOLAR_CONSTANT)
+    extraterrestrial = SOLAR_CONSTANT * (1 + 0.033 * np.cos(2 * np.pi * doy / 365)) * safe_sin_h
+    kb = np.where(above, np.clip(gb / extraterrestrial, 0, 1), 0.0)
+
+    normals = surface_normals(slope_deg, azimuths_deg)
+    cos_aoi = normals.T @ sun                                  # (azimuths, hours)
+    sunlit = (cos_aoi > 0) & above
+    cos_aoi = np.clip(cos_aoi, 0, 1)
+
+    beam = np.where(sunlit, dni * cos_aoi, 0.0)
+
+    # Muneer: sky radiance index N differs for sunlit and shaded surfaces
+    tilt_term = np.sin(beta) - beta * np.cos(beta) - np.pi * np.sin(beta / 2) ** 2
+    f_shaded = np.cos(beta / 2) ** 2 + 0.00263 * tilt_term
+    f_sunlit = np.cos(beta / 2) ** 2 + (0.00263 - 0.712 * kb - 0.6883 * kb ** 2) * tilt_term
+    h = np.arcsin(np.clip(sin_h, -1, 1))
+    low_sun = h < 0.1
+    horizontal_sun = np.sqrt(np.maximum(1 - sin_h ** 2, 1e-12))
+    cos_psi = (normals[:2].T @ sun[:2]) / (np.sin(beta) * horizontal_sun + 1e-12) if slope_deg else 0.0
+    anisotropic = np.where(
+        low_sun,
+        kb * np.sin(beta) * cos_psi / (0.1 - 0.008 * h),
+        kb * cos_aoi / safe_sin_h,
+    )
+    diffuse = np.where(sunlit, gd * (f_sunlit * (1 - kb) + np.maximum(anisotropic, 0)), gd * f_shaded)
+
+    ground = ALBEDO * (gb + gd) * (1 - np.cos(beta)) / 2
+
+    # Martin & Ruiz angular losses relative to normal incidence
+    beam_t = 1 - (np.exp(-cos_aoi / AR) - np.exp(-1 / AR)) / (1 - np.exp(-1 / AR))
+    x_sky = np.sin(beta) + (np.pi - beta - np.sin(beta)) / (1 + np.cos(beta))
+    x_ground = np.sin(beta) + (beta - np.sin(beta)) / (1 - np.cos(beta)) if slope_deg else 0.0
+    effective = beam * beam_t + diffuse * _reflection_transmittance(x_sky)
+    if slope_deg:
+        effective = effective + ground * _reflection_transmittance(x_ground)
+
+    return effective, beam + diffuse + ground
+
+
+def pv_power(effective, in_plane, t_air, wind, peak_kw=1.0):
+    """Huld crystalline-Si model with Faiman module temperature; W per peak_kw."""
+    k1, k2, k3, k4, k5, k6 = HULD_CSI
+    t_module = t_air + in_plane / (U0 + U1 * wind)
+    g = effective / 1000
+    lit = g > 0
+    log_g = np.log(np.where(lit, g, 1.0))
+    dt = t_module - 25
+    efficiency = 1 + k1 * log_g + k2 * log_g ** 2 + dt * (k3 + k4 * log_g + k5 * log_g ** 2) + k6 * dt ** 2
+    power = np.where(lit, 1000 * peak_kw * g * efficiency, 0.0)
+    return np.maximum(power, 0) * (1 - SYSTEM_LOSS)
+
+
+def compute_cube(comp, lat, lon, slopes, azimuths, out, on_row=None):
+    """
+    Fill ``out`` (slopes, azimuths, hours) with hourly PV output, one slope at a time.
+
+    ``on_row(s)`` is called after each slope row is written.
+    """
+    sun, doy = sun_position(comp["time"], lat, lon)
+    for s, slope_val in enumerate(slopes):
+        effective, in_plane = plane_of_array(comp, sun, doy, float(slope_val), azimuths)
+        out[s] = pv_power(effective, in_plane, comp["T2m"], comp["WS10m"])
+        if on_row:
+            on_row(s)
+    return out
+
+
+def orientation_profile(comp, lat, lon, slope_val, azimuth_val):
+    """Hourly PV output of a single orientation."""
+    out = np.empty((1, 1, comp["Gb"].size), dtype=np.float32)
+    return compute_cube(comp, lat, lon, [slope_val], [azimuth_val], out)[0, 0]
+
+
+# ------------------------
+# Validation against PVGIS
+# ------------------------
+def validation_report(comp, lat, lon, reference):
+    """
+    Compare local output with PVGIS P values.
+
+    ``reference`` maps (slope, azimuth) to PVGIS hourly P (W, 1 kWp).
+    """
+    orientations = []
+    for (slope_val, azimuth_val), pvgis in sorted(reference.items()):
+        pvgis = np.asarray(pvgis, dtype=np.float64)[: comp["Gb"].size]
+        local = orientation_profile(comp, lat, lon, slope_val, azimuth_val)[: pvgis.size].astype(np.float64)
+        annual_pvgis, annual_local = pvgis.sum() / 1000, local.sum() / 1000
+        daylight = pvgis > 0
+        orientations.append({
+            "slope": slope_val,
+            "azimuth": azimuth_val,
+            "annual_kwh_pvgis": round(annual_pvgis, 2),
+            "annual_kwh_local": round(annual_local, 2),
+            "annual_bias_pct": round(100 * (annual_local - annual_pvgis) / annual_pvgis, 2) if annual_pvgis else None,
+            "hourly_rmse_w": round(float(np.sqrt(np.mean((local - pvgis) ** 2))), 2),
+            "hourly_nrmse_pct": round(
+                100 * float(np.sqrt(np.mean((local - pvgis)[daylight] ** 2)) / pvgis[daylight].mean()), 2
+            ) if daylight.any() else None,
+            "correlation": round(float(np.corrcoef(local, pvgis)[0, 1]), 4) if pvgis.std() and local.std() else None,
+        })
+
+    biases = [abs(o["annual_bias_pct"]) for o in orientations if o["annual_bias_pct"] is not None]
+    return {
+        "lat": lat,
+        "lon": lon,
+        "orientations": orientations,
+        "mean_abs_annual_bias_pct": round(float(np.mean(biases)), 2) if biases else None,
+        "max_abs_annual_bias_pct": round(float(np.max(biases)), 2) if biases else None,
+    }
@@ -1,16 +1,29 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from strategies import MatlabStrategy, PythonStrategy
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from contextlib import asynccontextmanager
+from starlette.requests import ClientDisconnect
+from strategies import MatlabStrategy, OptimizerStrategy, PythonStrategy
 import os
+import telemetry
+import upstream
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await upstream.close()
+
+app = FastAPI(lifespan=lifespan)
+telemetry.install(app, "routerstrategy")
+app.add_exception_handler(ClientDisconnect, upstream.caller_gone)
 
 strategies = {
     "matlab": MatlabStrategy(),
+    "optimizer": OptimizerStrategy(),
     "python": PythonStrategy(),
 }
 
 @app.post("/run")
 async def run_flow(
+    request: Request,
     flow: str = Form(...),
     azimuth: int = Form(...),
     slope: int = Form(...),
@@ -19,6 +32,10 @@ async def run_flow(
     year: int = Form(...),
     profileDemand: UploadFile = File(None),
     weatherFile: str = Form(""), 
+    fileFormat: str = Form("mat"),
+    maxPower: float = Form(None),
+    endYear: int = Form(None),
+    weatherYear: str = Form(None),
 ):
     if not flow:
         raise HTTPException(status_code=400, detail="Missing 'flow' parameter")
@@ -35,7 +52,12 @@ async def run_flow(
         "longitude": longitude,
         "year": year,
         "profileDemand": profileDemand,
-        "weatherFile": weatherFile
+        "weatherFile": weatherFile,
+        "fileFormat": fileFormat,
+        "maxPower": maxPower,
+        "endYear": endYear,
+        "weatherYear": weatherYear,
     }
 
-    return await  strategy.execute(payload)
\ No newline at end of file
+    # A gateway that hangs up cancels the strategy and its own upstream calls
+    return await upstream.unless_disconnected(request, strategy.execute(payload))
\ No newline at end of file
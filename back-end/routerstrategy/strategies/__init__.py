@@ -1,2 +1,3 @@
 from .matlab_strategy import MatlabStrategy
+from .optimizer_strategy import OptimizerStrategy
 from .python_strategy import PythonStrategy
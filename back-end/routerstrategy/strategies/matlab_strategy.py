@@ -1,17 +1,20 @@
 import os
-import requests
+import telemetry
+import upstream
 from .base_strategy import FlowStrategy
 
 class MatlabStrategy(FlowStrategy):
+    endpoint = "runMatlab"
+
     async def execute(self, payload: dict):
         matlab_port = os.getenv("MATLAB", "8504")
-        url = f"http://matlab:{matlab_port}/runMatlab"
+        url = f"http://matlab:{matlab_port}/{self.endpoint}"
 
         demand_profile_file = payload.get("profileDemand")
         files = {}
         if demand_profile_file:
-            file_bytes = await demand_profile_file.read()
-            files = {"demandProfile": (demand_profile_file.filename, file_bytes)}
+            # Streamed from the spooled upload in chunks
+            files = {"demandProfile": (demand_profile_file.filename, demand_profile_file.file)}
 
         data = {
             "azimuth": payload["azimuth"],
@@ -19,8 +22,13 @@ class MatlabStrategy(FlowStrategy):
             "weatherData": payload["weatherFile"],
             "year": payload["year"]
         }
+        # Cap on the total installed kWp from the front-end
+        if payload.get("maxPower") is not None:
+            data["maxKwp"] = payload["maxPower"]
+        if payload.get("weatherYear"):
+            data["weatherYear"] = payload["weatherYear"]
 
 
-        resp = requests.post(url, data=data, files=files)
+        resp = await upstream.get_client().post(url, data=data, files=files, headers=telemetry.trace_headers())
         resp.raise_for_status()
         return resp.json()
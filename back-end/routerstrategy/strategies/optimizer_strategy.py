@@ -0,0 +1,5 @@
+from .matlab_strategy import MatlabStrategy
+
+class OptimizerStrategy(MatlabStrategy):
+    """Same request as the matlab flow, served by the NumPy optimizer."""
+    endpoint = "runOptimizer"
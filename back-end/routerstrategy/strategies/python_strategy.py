@@ -1,11 +1,15 @@
+import asyncio
 import os
-import requests
+import telemetry
+import upstream
 from .base_strategy import FlowStrategy
 
 class PythonStrategy(FlowStrategy):
+    poll_interval = float(os.getenv("JOB_POLL_INTERVAL", 2))
+
     async def execute(self, payload: dict):
         python_port = os.getenv("PYTHON", "8503")
-        url = f"http://python:{python_port}/getData"
+        base_url = f"http://python:{python_port}"
 
         params = {
             "azimuth": 1,
@@ -13,8 +17,25 @@ class PythonStrategy(FlowStrategy):
             "latit": payload["latitude"],
             "longit": payload["longitude"],
             "year": payload["year"],
+            "fileFormat": payload.get("fileFormat", "mat"),
         }
+        if payload.get("endYear"):
+            params["endYear"] = payload["endYear"]
+
+        # getData can run for hours: submit it as a job and poll its status
+        # instead of holding one request open
+        client = upstream.get_client()
+        headers = telemetry.trace_headers()
+        resp = await client.post(f"{base_url}/jobs", params=params, headers=headers)
+        resp.raise_for_status()
+        job = resp.json()
+
+        while job["state"] not in ("done", "failed"):
+            await asyncio.sleep(self.poll_interval)
+            resp = await client.get(f"{base_url}/jobs/{job['job_id']}", headers=headers)
+            resp.raise_for_status()
+            job = resp.json()
 
-        resp = requests.get(url, params=params)
+        resp = await client.get(f"{base_url}/jobs/{job['job_id']}/result", headers=headers)
 
         return resp.json()
@@ -0,0 +1,231 @@
+"""
+Request tracing and metrics shared by the back-end services.
+
+Every request carries an X-Request-ID. The service that receives a request
+without one (the API gateway, for a user's Calculate) creates it; every
+service keeps it in a context variable for the duration of the request and
+sends it on with its own calls to other services (trace_headers()), so the
+per-request log lines of all five services can be joined on it.
+
+Metrics are kept in process and served in the Prometheus text format on
+GET /metrics: request counts and latency per route from the middleware,
+plus whatever counters, gauges and histograms the service defines.
+
+This module is kept identical in all five services, because every service
+image is built from its own directory.
+"""
+import contextvars
+import threading
+import time
+import uuid
+from fastapi.responses import PlainTextResponse
+
+TRACE_HEADER = "X-Request-ID"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+BYTE_BUCKETS = tuple(1 << shift for shift in range(10, 36, 2))  # 1 KiB .. 32 GiB
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+# ------------------------
+# Trace IDs
+# ------------------------
+def current_trace_id():
+    return _trace_id.get()
+
+
+def trace_headers():
+    """Headers that carry the current trace to another service."""
+    trace_id = _trace_id.get()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+# ------------------------
+# Metrics
+# ------------------------
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {value:g}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that is set, or read from ``fn`` (a number, or label tuple -> number) at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.fn is None:
+            return super().samples()
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, key, (), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                samples.append((self.name + "_bucket", key, (("le", bound),), count))
+            samples.append((self.name + "_sum", key, (), total))
+            samples.append((self.name + "_count", key, (), counts[-1]))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        if exc_type is None:  # failures are counted elsewhere, not timed
+            self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = cls(name, *args, **kwargs)
+        return _registry[name]
+
+
+def counter(name, help, labels=()):
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=(), fn=None):
+    return _register(Gauge, name, help, labels, fn=fn)
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# ------------------------
+# Middleware and /metrics
+# ------------------------
+_requests = counter("http_requests_total", "Requests handled, by route, method and status", ("route", "method", "status"))
+_latency = histogram("http_request_seconds", "Request handling time, by route", ("route",))
+
+
+class TraceMiddleware:
+    """Adopt or create the request's trace ID, echo it back, log and time the request."""
+
+    def __init__(self, app, service):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        trace_id = headers.get(TRACE_HEADER.lower().encode(), b"").decode("latin-1") or uuid.uuid4().hex
+        token = _trace_id.set(trace_id)
+        status = {"code": 500}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = [*message.get("headers", []), (TRACE_HEADER.lower().encode(), trace_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            _requests.inc(route=route, method=scope["method"], status=status["code"])
+            _latency.observe(elapsed, route=route)
+            if route != "/metrics":
+                print(f"[{self.service}] trace={trace_id} {scope['method']} {scope['path']} {status['code']} {elapsed:.3f}s")
+            _trace_id.reset(token)
+
+
+def install(app, service):
+    """Trace every request of ``app`` and serve its metrics on GET /metrics."""
+    app.add_middleware(TraceMiddleware, service=service)
+
+    def metrics():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
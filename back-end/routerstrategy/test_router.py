@@ -1,7 +1,11 @@
+import asyncio
 import pytest
+import httpx
+from urllib.parse import parse_qs
 from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
 from main import app  # main.py is the module
+import upstream
 
 client = TestClient(app)
 
@@ -84,3 +88,123 @@ def test_run_flow_unknown_flow():
 
     assert response.status_code == 400
     assert response.json() == {"detail": "Unknown flow 'unknown'"}
+
+# ------------------------
+# Test valid flow with OptimizerStrategy
+# ------------------------
+@patch("strategies.OptimizerStrategy.execute", new_callable=AsyncMock)
+def test_run_flow_optimizer(mock_execute):
+    mock_execute.return_value = {"output": {"panels": {}}}
+
+    data = {
+        "flow": "optimizer",
+        "azimuth": 1,
+        "slope": 1,
+        "latitude": 52.0,
+        "longitude": 5.0,
+        "year": 2024,
+        "weatherFile": "weather.mat"
+    }
+
+    response = client.post("/run", data=data)
+
+    assert response.status_code == 200
+    assert response.json() == {"output": {"panels": {}}}
+    mock_execute.assert_awaited_once()
+
+def upstream_client(handler):
+    """Stand-in for the shared upstream client, answering every call with ``handler``."""
+    return patch.object(upstream, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+def test_optimizer_strategy_posts_to_run_optimizer():
+    from strategies import OptimizerStrategy
+
+    seen = []
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"output": {}})
+
+    with upstream_client(handler):
+        asyncio.run(OptimizerStrategy().execute(
+            {"azimuth": 1, "slope": 1, "weatherFile": "w.mat", "year": 2024, "maxPower": 25.0, "weatherYear": "worst"}
+        ))
+
+    form = parse_qs(seen[0].content.decode())
+    assert seen[0].url.path == "/runOptimizer"
+    assert form["maxKwp"] == ["25.0"]
+    assert form["weatherYear"] == ["worst"]
+    assert "X-Request-ID" not in seen[0].headers  # no trace outside a request
+
+def test_run_flow_streams_demand_profile_to_optimizer():
+    demand = b"0123456789" * 100_000
+    seen = []
+    def handler(request):
+        seen.append((request, request.read()))
+        return httpx.Response(200, json={"output": {"panels": {}}})
+
+    data = {"flow": "optimizer", "azimuth": 1, "slope": 1, "latitude": 52.0, "longitude": 5.0, "year": 2024,
+            "weatherFile": "w.pvc"}
+    with upstream_client(handler):
+        response = client.post(
+            "/run", data=data, files={"profileDemand": ("demand.mat", demand)}, headers={"X-Request-ID": "trace-2"}
+        )
+
+    assert response.json() == {"output": {"panels": {}}}
+    request, body = seen[0]
+    assert request.headers["X-Request-ID"] == "trace-2"
+    assert b'name="demandProfile"; filename="demand.mat"' in body and demand in body
+
+@patch("strategies.MatlabStrategy.execute", new_callable=AsyncMock)
+def test_run_flow_keeps_callers_trace(mock_execute):
+    import telemetry
+    mock_execute.side_effect = lambda payload: {"trace": telemetry.current_trace_id()}
+
+    data = {"flow": "matlab", "azimuth": 1, "slope": 1, "latitude": 52.0, "longitude": 5.0, "year": 2024}
+    response = client.post("/run", data=data, headers={"X-Request-ID": "trace-9"})
+
+    assert response.json() == {"trace": "trace-9"}
+    assert response.headers["X-Request-ID"] == "trace-9"
+    assert 'http_requests_total{route="/run",method="POST",status="200"}' in client.get("/metrics").text
+
+def test_python_strategy_submits_job_and_polls():
+    from strategies import PythonStrategy
+
+    states = iter([{"job_id": "j1", "state": "running"}, {"job_id": "j1", "state": "done"}])
+    seen = []
+    def handler(request):
+        seen.append(request)
+        if request.method == "POST":
+            return httpx.Response(202, json={"job_id": "j1", "state": "queued"})
+        return httpx.Response(200, json=next(states, {"filename": "cube.mat"}))
+
+    with upstream_client(handler), patch.object(PythonStrategy, "poll_interval", 0):
+        result = asyncio.run(PythonStrategy().execute({"latitude": 52.0, "longitude": 5.0, "year": 2015, "endYear": 2024}))
+
+    assert result == {"filename": "cube.mat"}
+    assert seen[0].method == "POST" and seen[0].url.path == "/jobs"
+    assert seen[0].url.params["endYear"] == "2024"
+    assert [r.url.path for r in seen[1:]] == ["/jobs/j1", "/jobs/j1", "/jobs/j1/result"]
+
+def test_caller_hanging_up_cancels_upstream_call():
+    from starlette.requests import ClientDisconnect
+
+    class HungUp:
+        async def is_disconnected(self):
+            return True
+
+    cancelled = []
+    async def slow_call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        with patch.object(upstream, "DISCONNECT_POLL_INTERVAL", 0.01):
+            with pytest.raises(ClientDisconnect):
+                await upstream.unless_disconnected(HungUp(), slow_call())
+        await asyncio.sleep(0)  # let the cancelled call unwind
+
+    asyncio.run(run())
+    assert cancelled == [True]
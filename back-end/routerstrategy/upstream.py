@@ -0,0 +1,70 @@
+"""
+Shared async HTTP client for calls from this service to the next one.
+
+One httpx.AsyncClient per process keeps a pool of connections to the
+services behind it, so concurrent requests neither block the event loop
+nor open a new TCP connection per hop. Uploaded files are passed on as
+their spooled file objects and streamed in chunks.
+
+A caller that hangs up cancels the work done on its behalf: the call is
+wrapped in unless_disconnected(), which cancels it (closing its upstream
+connection, which the next service sees as a disconnect in turn) and
+answers 499.
+
+This module is kept identical in api-gateway and routerstrategy, because
+every service image is built from its own directory.
+"""
+import asyncio
+import os
+import httpx
+from fastapi.responses import Response
+from starlette.requests import ClientDisconnect
+
+# getData can build a cube for hours before the gateway's call returns
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 21600))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 10))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+DISCONNECT_POLL_INTERVAL = 1.0
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def unless_disconnected(request, awaitable):
+    """Await ``awaitable``; cancel it and raise ClientDisconnect if ``request``'s client hangs up."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnect()
+    finally:
+        task.cancel()
+
+
+async def caller_gone(request, exc):
+    """Exception handler for ClientDisconnect: nobody is listening for the answer."""
+    return Response(status_code=499)
+
+
+def form_data(fields):
+    """Form fields without the unset ones, which the next service fills with its defaults."""
+    return {name: value for name, value in fields.items() if value is not None}
@@ -0,0 +1,249 @@
+"""
+SQLite catalog of stored files.
+
+Every file savedata writes or registers is recorded with its size,
+checksum, grid and site, so listings, existence checks and searches are
+index lookups instead of directory scans and filename parsing.
+
+Files can still appear or disappear behind savedata's back (copied in by
+hand, shared volume links); sync() reconciles a directory with the catalog
+whenever its mtime differs from the one seen last time.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import pvcodec
+import pvcube
+import spatial_index
+
+COLUMNS = (
+    "dir", "filename", "year", "end_year", "size", "checksum", "variant", "azimuth_res", "slope_res",
+    "lat", "lon", "ext", "shape", "created", "accessed",
+)
+
+
+def describe(path, filename):
+    """Grid, site, year range and shape of a stored cube, as far as its name and header tell."""
+    entry = spatial_index.parse_cube_name(filename) or {}
+    shape = None
+    if entry:
+        azimuths, slopes = pvcube.grid_axes(entry["azimuth_res"], entry["slope_res"])
+        years = entry["end_year"] - entry["start_year"] + 1 if entry["end_year"] else 1
+        shape = [len(slopes), len(azimuths), pvcube.HOURS * years]
+    for module in (pvcube, pvcodec):
+        if filename.endswith(module.EXTENSION):
+            try:
+                shape = module.read_header(path)["shape"]
+            except (OSError, ValueError):
+                pass
+    return {
+        "end_year": entry.get("end_year"),
+        "variant": entry.get("variant"),
+        "azimuth_res": entry.get("azimuth_res"),
+        "slope_res": entry.get("slope_res"),
+        "lat": entry.get("lat"),
+        "lon": entry.get("lon"),
+        "ext": os.path.splitext(filename)[1],
+        "shape": json.dumps(shape) if shape else None,
+    }
+
+
+class Catalog:
+    def __init__(self, data_dir, path=None, extensions=(".mat", ".pvc", ".pvz")):
+        self.data_dir = data_dir
+        self.extensions = extensions
+        path = path or os.path.join(data_dir, "catalog.sqlite")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL, filename TEXT NOT NULL, year INTEGER, end_year INTEGER,
+                size INTEGER, checksum TEXT, variant TEXT, azimuth_res INTEGER, slope_res INTEGER,
+                lat REAL, lon REAL, ext TEXT, shape TEXT, created REAL, accessed REAL,
+                PRIMARY KEY (dir, filename)
+            );
+            CREATE INDEX IF NOT EXISTS files_grid ON files (year, azimuth_res, slope_res);
+            CREATE INDEX IF NOT EXISTS files_site ON files (year, lat, lon);
+            CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime_ns INTEGER);
+            """
+        )
+        # Catalogs written before multi-year cubes existed only hold single-year files
+        if "end_year" not in {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}:
+            self._conn.execute("ALTER TABLE files ADD COLUMN end_year INTEGER")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _dir_path(self, dir_name):
+        return os.path.join(self.data_dir, dir_name) if dir_name else self.data_dir
+
+    # ------------------------
+    # Writes
+    # ------------------------
+    def _row(self, dir_name, filename, checksum, stat, now):
+        return {
+            "dir": dir_name,
+            "filename": filename,
+            "year": int(dir_name) if dir_name.isdigit() else None,
+            "size": stat.st_size,
+            "checksum": checksum,
+            **describe(os.path.join(self._dir_path(dir_name), filename), filename),
+            "created": stat.st_mtime,
+            "accessed": now,
+        }
+
+    def _insert(self, rows):
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [tuple(row[c] for c in COLUMNS) for row in rows],
+        )
+
+    def _mark_synced(self, dir_name):
+        path = self._dir_path(dir_name)
+        mtime = os.stat(path).st_mtime_ns if os.path.isdir(path) else None
+        self._conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (dir_name, mtime))
+
+    def record(self, dir_name, filename, checksum=None):
+        """
+        Catalog a file savedata has just written.
+
+        Call sync() on the directory before writing, so that this write's
+        mtime change is not mistaken for outside changes needing a rescan.
+        """
+        dir_name = str(dir_name)
+        path = os.path.join(self._dir_path(dir_name), filename)
+        with self._lock:
+            self._insert([self._row(dir_name, filename, checksum, os.stat(path), time.time())])
+            self._mark_synced(dir_name)
+            self._conn.commit()
+
+    def touch(self, dir_name, filename):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET accessed=? WHERE dir=? AND filename=?", (time.time(), str(dir_name), filename)
+            )
+            self._conn.commit()
+
+    def checksum(self, dir_name, filename):
+        """SHA-256 of a catalogued file, computed once and remembered."""
+        dir_name = str(dir_name)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT checksum FROM files WHERE dir=? AND filename=?", (dir_name, filename)
+            ).fetchone()
+        if row is not None and row["checksum"]:
+            return row["checksum"]
+        digest = hashlib.sha256()
+        with open(os.path.join(self._dir_path(dir_name), filename), "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET checksum=? WHERE dir=? AND filename=?", (digest.hexdigest(), dir_name, filename)
+            )
+            self._conn.commit()
+        return digest.hexdigest()
+
+    # ------------------------
+    # Reconciliation with the filesystem
+    # ------------------------
+    def sync(self, dir_name=""):
+        """Rescan a directory only if it changed since the catalog last saw it."""
+        with self._lock:
+            if self._sync(str(dir_name)):
+                self._conn.commit()
+
+    def sync_all(self):
+        """Sync the data directory and every year directory in it."""
+        self.sync("")
+        if os.path.isdir(self.data_dir):
+            for entry in os.scandir(self.data_dir):
+                if entry.name.isdigit() and entry.is_dir():
+                    self.sync(entry.name)
+
+    def _sync(self, dir_name):
+        path = self._dir_path(dir_name)
+        mtime = os.stat(path).st_mtime_ns if os.path.isdir(path) else None
+        row = self._conn.execute("SELECT mtime_ns FROM dirs WHERE dir=?", (dir_name,)).fetchone()
+        if row is not None and row["mtime_ns"] == mtime:
+            return False
+
+        on_disk = set()
+        if mtime is not None:
+            on_disk = {e.name for e in os.scandir(path) if e.name.endswith(self.extensions) and e.is_file()}
+        known = {r["filename"] for r in self._conn.execute("SELECT filename FROM files WHERE dir=?", (dir_name,))}
+        now = time.time()
+        self._insert([self._row(dir_name, f, None, os.stat(os.path.join(path, f)), now) for f in on_disk - known])
+        self._conn.executemany("DELETE FROM files WHERE dir=? AND filename=?", [(dir_name, f) for f in known - on_disk])
+        self._conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (dir_name, mtime))
+        return True
+
+    # ------------------------
+    # Reads
+    # ------------------------
+    def exists(self, dir_name, filename):
+        self.sync(dir_name)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM files WHERE dir=? AND filename=?", (str(dir_name), filename)
+            ).fetchone() is not None
+
+    def query(
+        self,
+        dir_name=None,
+        year=None,
+        bbox=None,
+        azimuth_res=None,
+        slope_res=None,
+        ext=None,
+        variant=None,
+        limit=None,
+        offset=0,
+    ):
+        """
+        Catalogued files matching every given filter, ordered by name.
+
+        ``bbox`` is (lat_min, lon_min, lat_max, lon_max). Returns (rows, total).
+        """
+        if dir_name is not None:
+            self.sync(dir_name)
+        elif year is not None:
+            self.sync(str(year))
+        else:
+            self.sync_all()
+
+        clauses, params = [], []
+        for column, value in (
+            ("dir", dir_name), ("year", year), ("azimuth_res", azimuth_res), ("slope_res", slope_res), ("ext", ext),
+        ):
+            if value is not None:
+                clauses.append(f"{column}=?")
+                params.append(value)
+        if variant is not None:
+            clauses.append("variant IS ?")
+            params.append(variant or None)
+        if bbox is not None:
+            clauses.append("lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?")
+            params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM files {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM files {where} ORDER BY dir, filename LIMIT ? OFFSET ?",
+                (*params, -1 if limit is None else limit, offset),
+            ).fetchall()
+        items = []
+        for row in rows:
+            item = dict(row)
+            item["shape"] = json.loads(item["shape"]) if item["shape"] else None
+            items.append(item)
+        return items, total
@@ -0,0 +1,82 @@
+"""
+Orientation and time-window slices of stored cubes.
+
+Slices are cut from the memory-mapped cube (or only the chunks of a .pvz
+cube they touch are decoded), so only the requested rows and hours are read
+from disk, then optionally summed per day or per month.
+"""
+import numpy as np
+import pvcodec
+import pvcube
+import spatial_index
+
+HOURS_PER_MONTH = 24 * np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+MONTH_STARTS = np.concatenate([[0], np.cumsum(HOURS_PER_MONTH)[:-1]])
+
+
+def open_stored_cube(path, filename):
+    """(cube, azimuth_start, azimuth_res, slope_start, slope_res) of a stored .pvc, .pvz or .mat file."""
+    if pvcube.is_cube(path):
+        cube, header = pvcube.open_cube(path)
+        return cube, header["azimuth_start"], header["azimuth_res"], header["slope_start"], header["slope_res"]
+    if pvcodec.is_pvz(path):
+        cube = pvcodec.PvzReader(path)
+        header = cube.header
+        return cube, header["azimuth_start"], header["azimuth_res"], header["slope_start"], header["slope_res"]
+    entry = spatial_index.parse_cube_name(filename)
+    if entry is None:
+        raise ValueError(f"Cannot tell the grid of '{filename}'")
+    return spatial_index.load_cube(path), -90, entry["azimuth_res"], 0, entry["slope_res"]
+
+
+def axis_slice(start, res, size, low, high):
+    """Index slice of the grid values within [low, high] degrees (None = open)."""
+    values = start + res * np.arange(size)
+    lo = 0 if low is None else int(np.searchsorted(values, low - 1e-9, side="left"))
+    hi = size if high is None else int(np.searchsorted(values, high + 1e-9, side="right"))
+    if lo >= hi:
+        raise ValueError(f"No grid values between {low} and {high}")
+    return slice(lo, hi), values[lo:hi]
+
+
+def aggregate(data, hour_start, aggregation):
+    """
+    Sum the last axis of ``data`` (hours from ``hour_start``) per day or month.
+
+    Returns (data, labels): day or month numbers (1-based) of each bin,
+    counted on from the first year through the years of a multi-year cube.
+    """
+    hours = data.shape[-1]
+    absolute = hour_start + np.arange(hours)
+    if aggregation == "daily":
+        bins = absolute // 24
+    elif aggregation == "monthly":
+        year, hour_of_year = np.divmod(absolute, pvcube.HOURS)
+        bins = 12 * year + np.searchsorted(MONTH_STARTS, hour_of_year, side="right") - 1
+    else:
+        raise ValueError(f"Unknown aggregation '{aggregation}'")
+    # Sums per run of equal bin numbers, accumulated in float64
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    summed = np.add.reduceat(data.astype(np.float64), starts, axis=-1)
+    return summed.astype(np.float32), (bins[starts] + 1).tolist()
+
+
+def cut(path, filename, slope_min=None, slope_max=None, azimuth_min=None, azimuth_max=None,
+        hour_start=0, hour_end=None, aggregation=None):
+    """The requested slice as float32 (slopes, azimuths, time) plus its axes."""
+    cube, az_start, az_res, sl_start, sl_res = open_stored_cube(path, filename)
+    num_slopes, num_azimuths, hours = cube.shape
+    hour_end = hours if hour_end is None else hour_end
+    if not 0 <= hour_start < hour_end <= hours:
+        raise ValueError(f"Hour range must lie within 0..{hours}")
+
+    slopes, slope_values = axis_slice(sl_start, sl_res, num_slopes, slope_min, slope_max)
+    azimuths, azimuth_values = axis_slice(az_start, az_res, num_azimuths, azimuth_min, azimuth_max)
+    data = np.ascontiguousarray(cube[slopes, azimuths, hour_start:hour_end], dtype=np.float32)
+
+    if aggregation:
+        data, labels = aggregate(data, hour_start, aggregation)
+        time_axis = {"days" if aggregation == "daily" else "months": labels}
+    else:
+        time_axis = {"hour_start": hour_start, "hour_end": hour_end}
+    return data, {"slopes": slope_values.tolist(), "azimuths": azimuth_values.tolist(), **time_axis}
@@ -1,14 +1,40 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Request
+from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import numpy as np
 import scipy.io
 import pickle
 import os
+import re
+import hashlib
+import json
 import shutil
+import uuid
+import pvcube
+import pvcodec
+import spatial_index
+import cube_slice
+import telemetry
+from starlette.requests import ClientDisconnect
+from catalog import Catalog
 
 SAVE_DATA = int(os.getenv("SAVE_DATA", 1000))
+CUBE_EXTENSIONS = (".mat", ".pvc", ".pvz")
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+SHARED_DATA_DIR = os.getenv("SHARED_DATA_DIR", "")
+NEAREST_TOLERANCE_KM = float(os.getenv("NEAREST_TOLERANCE_KM", 5.0))
+CATALOG_PATH = os.getenv("CATALOG_PATH", "")
+SLICE_MAX_VALUES = int(os.getenv("SLICE_MAX_VALUES", 20_000_000))
+CHECKSUM_HEADER = "X-Checksum-Sha256"
 app = FastAPI()
+telemetry.install(app, "savedata")
+
+BYTES_RECEIVED = telemetry.histogram(
+    "savedata_bytes_received", "Bytes written per upload request", ("endpoint",), telemetry.BYTE_BUCKETS
+)
+BYTES_SERVED = telemetry.histogram(
+    "savedata_bytes_served", "Bytes sent per file or slice request", ("endpoint",), telemetry.BYTE_BUCKETS
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,48 +44,382 @@ app.add_middleware(
 )
 
 
+_catalogs = {}
+
+def get_catalog():
+    """Catalog of DATA_DIR (one per data directory, so tests can swap it)."""
+    if DATA_DIR not in _catalogs:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        _catalogs[DATA_DIR] = Catalog(DATA_DIR, CATALOG_PATH or None, extensions=CUBE_EXTENSIONS)
+    return _catalogs[DATA_DIR]
+
+
 @app.post("/saveDataFile")
-async def saveDataFile(file: UploadFile = File(...), azimuth_res: int = 1, slope_res: int = 1,year =2019):
-    os.makedirs(f"data/{year}", exist_ok=True)
-    with open(f"/app/data/{year}/{file.filename}", "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    print("it worked i guess")
+async def saveDataFile(request: Request, file: UploadFile = File(...), azimuth_res: int = 1, slope_res: int = 1,year =2019):
+    """
+    Multipart upload in one go. The file is written under a temporary name and
+    renamed into place, so it is never visible half-written; a checksum sent
+    in X-Checksum-Sha256 is verified first. Large cubes use /uploads instead.
+    """
+    save_dir = f"{DATA_DIR}/{year}"
+    os.makedirs(save_dir, exist_ok=True)
+    filename = os.path.basename(file.filename)
+    partial = os.path.join(save_dir, f".{filename}.{uuid.uuid4().hex}.part")
+    checksum = hashlib.sha256()
+    with open(partial, "wb") as buffer:
+        while chunk := await file.read(1 << 20):
+            checksum.update(chunk)
+            buffer.write(chunk)
+        BYTES_RECEIVED.observe(buffer.tell(), endpoint="saveDataFile")
+
+    expected = request.headers.get(CHECKSUM_HEADER)
+    if expected and expected.lower() != checksum.hexdigest():
+        os.remove(partial)
+        return JSONResponse(status_code=422, content={"status": "error", "message": "Checksum mismatch"})
+    get_catalog().sync(year)
+    os.replace(partial, os.path.join(save_dir, filename))
+    get_catalog().record(year, filename, checksum.hexdigest())
+    return {"status": "ok", "filename": filename, "checksum": checksum.hexdigest()}
+
+
+# ------------------------
+# Resumable streaming uploads
+# ------------------------
+_uploads_in_progress = set()
+
+def _upload_partial(year, filename, digest):
+    """Partial file of one upload; the digest keeps different contents apart."""
+    return os.path.join(f"{DATA_DIR}/{year}", f".{filename}.{digest[:16]}.part")
+
+def _upload_digest(request):
+    digest = request.headers.get(CHECKSUM_HEADER, "").lower()
+    return digest if re.fullmatch(r"[0-9a-f]{64}", digest) else None
+
+@app.head("/uploads/{year}/{filename}")
+def uploadOffset(year: int, filename: str, request: Request):
+    """Bytes already received of the upload identified by X-Checksum-Sha256, in Upload-Offset."""
+    digest = _upload_digest(request)
+    if digest is None:
+        return Response(status_code=400)
+    partial = _upload_partial(year, os.path.basename(filename), digest)
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    return Response(headers={"Upload-Offset": str(offset)})
+
+@app.put("/uploads/{year}/{filename}")
+async def uploadDataFile(year: int, filename: str, request: Request):
+    """
+    Append a streamed body at Upload-Offset to the partial upload; once all
+    Upload-Length bytes are in and their SHA-256 matches X-Checksum-Sha256
+    the file is renamed into place. A mismatching offset gets 409 with the
+    offset held, a dropped connection keeps what arrived for the next try.
+    """
+    digest = _upload_digest(request)
+    if digest is None:
+        return JSONResponse(status_code=400, content={"status": "error", "message": f"Missing or invalid {CHECKSUM_HEADER}"})
+    try:
+        offset, length = int(request.headers["Upload-Offset"]), int(request.headers["Upload-Length"])
+    except (KeyError, ValueError):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Upload-Offset and Upload-Length are required"})
+
+    filename = os.path.basename(filename)
+    save_dir = f"{DATA_DIR}/{year}"
+    os.makedirs(save_dir, exist_ok=True)
+    partial = _upload_partial(year, filename, digest)
+    held = os.path.getsize(partial) if os.path.exists(partial) else 0
+    if partial in _uploads_in_progress or offset != held:
+        return JSONResponse(
+            status_code=409, headers={"Upload-Offset": str(held)},
+            content={"status": "error", "message": f"Upload is at offset {held}"},
+        )
+
+    _uploads_in_progress.add(partial)
+    try:
+        checksum = hashlib.sha256()
+        if held:
+            with open(partial, "rb") as f:
+                while chunk := f.read(1 << 20):
+                    checksum.update(chunk)
+        with open(partial, "ab") as f:
+            async for chunk in request.stream():
+                checksum.update(chunk)
+                f.write(chunk)
+    except ClientDisconnect:
+        return Response(status_code=400)  # nobody is listening; the partial stays for a resume
+    finally:
+        _uploads_in_progress.discard(partial)
+        if os.path.exists(partial):
+            BYTES_RECEIVED.observe(os.path.getsize(partial) - held, endpoint="uploads")
+
+    received = os.path.getsize(partial)
+    if received < length:
+        return JSONResponse(
+            status_code=409, headers={"Upload-Offset": str(received)},
+            content={"status": "error", "message": f"Upload is at offset {received}"},
+        )
+    if received > length or checksum.hexdigest() != digest:
+        os.remove(partial)
+        return JSONResponse(status_code=422, content={"status": "error", "message": "Checksum mismatch"})
+
+    get_catalog().sync(year)
+    os.replace(partial, os.path.join(save_dir, filename))
+    get_catalog().record(year, filename, digest)
+    return {"status": "ok", "filename": filename, "size": received, "checksum": digest}
 
 
 @app.get("/getFile")
-async def getFile(filename: str, year: int):
+async def getFile(filename: str, year: int, request: Request):
     if not filename or filename.strip() == "":
         return JSONResponse(status_code=400, content={"status": "error", "message": "Filename cannot be empty"})
     
-    save_dir = f"/app/data/{year}"
+    save_dir = f"{DATA_DIR}/{year}"
     file_path = os.path.join(save_dir, filename)
     if not os.path.exists(file_path):
         return JSONResponse(status_code=404, content={"status": "error", "message": f"File '{filename}' not found"})
 
-    return FileResponse(file_path, media_type='application/octet-stream', filename=filename)
+    # Range requests are answered by FileResponse, so interrupted downloads resume
+    get_catalog().touch(year, filename)
+    headers = {CHECKSUM_HEADER: get_catalog().checksum(year, filename)}
+    resume = re.match(r"bytes=(\d+)-", request.headers.get("Range", ""))
+    BYTES_SERVED.observe(max(os.path.getsize(file_path) - (int(resume.group(1)) if resume else 0), 0), endpoint="getFile")
+    return FileResponse(file_path, media_type='application/octet-stream', filename=filename, headers=headers)
+
+@app.get("/getSlice")
+def getSlice(
+    filename: str,
+    year: int,
+    slope_min: float = None,
+    slope_max: float = None,
+    azimuth_min: float = None,
+    azimuth_max: float = None,
+    hour_start: int = 0,
+    hour_end: int = None,
+    aggregation: str = None,
+    format: str = "json",
+):
+    """
+    Part of a stored cube: slope/azimuth ranges in degrees (inclusive), an
+    hour window [hour_start, hour_end) and optional daily or monthly sums.
+
+    ``format=binary`` returns little-endian float32 (slopes, azimuths, time)
+    in C order, with the shape in X-Shape and the axes as JSON in X-Axes.
+    """
+    if format not in ("json", "binary"):
+        return JSONResponse(status_code=400, content={"status": "error", "message": f"Unknown format '{format}'"})
+    file_path = os.path.join(f"{DATA_DIR}/{year}", os.path.basename(filename))
+    if not os.path.exists(file_path):
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"File '{filename}' not found"})
+
+    try:
+        data, axes = cube_slice.cut(
+            file_path, os.path.basename(filename), slope_min, slope_max, azimuth_min, azimuth_max,
+            hour_start, hour_end, aggregation,
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    if data.size > SLICE_MAX_VALUES:
+        return JSONResponse(status_code=413, content={"status": "error", "message": f"Slice has {data.size} values, limit is {SLICE_MAX_VALUES}"})
+
+    get_catalog().touch(year, os.path.basename(filename))
+    if format == "binary":
+        BYTES_SERVED.observe(data.size * 4, endpoint="getSlice")
+        headers = {"X-Shape": ",".join(map(str, data.shape)), "X-Dtype": "<f4", "X-Axes": json.dumps(axes)}
+        return Response(content=data.astype("<f4").tobytes(), media_type="application/octet-stream", headers=headers)
+    return {"shape": list(data.shape), **axes, "data": data.tolist()}
 
 @app.get("/listSavedFiles")
-async def list_saved_files():
-    save_dir = "/app/data"
-    os.makedirs(save_dir, exist_ok=True)
-    mat_files = [f for f in os.listdir(save_dir) if f.endswith(".mat")]
-    return JSONResponse(content={"saved_files": mat_files})
+async def list_saved_files(limit: int = None, offset: int = 0):
+    items, _ = get_catalog().query(dir_name="", limit=limit, offset=offset)
+    return JSONResponse(content={"saved_files": [item["filename"] for item in items]})
 
 @app.get("/listSavedFilesForFrontEnd")
-async def list_saved_files(year: int = None):
-    save_dir = "/app/data"
-    if year:
-        save_dir = f"/app/data/{year}"
-    
+async def list_saved_files(year: int = None, limit: int = None, offset: int = 0):
+    items, _ = get_catalog().query(dir_name=str(year) if year else "", limit=limit, offset=offset)
+    return JSONResponse(content={"saved_files": [item["filename"] for item in items]})
+
+@app.get("/catalog")
+def searchCatalog(
+    year: int = None,
+    lat_min: float = None,
+    lon_min: float = None,
+    lat_max: float = None,
+    lon_max: float = None,
+    azimuth_res: int = None,
+    slope_res: int = None,
+    fileFormat: str = None,
+    limit: int = 100,
+    offset: int = 0,
+):
+    """Stored cubes by year, bounding box and resolution, one page at a time."""
+    corners = (lat_min, lon_min, lat_max, lon_max)
+    if any(c is not None for c in corners) and any(c is None for c in corners):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "A bounding box needs all four corners"})
+    items, total = get_catalog().query(
+        year=year,
+        bbox=corners if lat_min is not None else None,
+        azimuth_res=azimuth_res,
+        slope_res=slope_res,
+        ext=f".{fileFormat}" if fileFormat else None,
+        limit=min(limit, 1000),
+        offset=offset,
+    )
+    return {"total": total, "limit": min(limit, 1000), "offset": offset, "items": items}
+
+
+# ------------------------
+# Shared volume: register content-addressed objects by name
+# ------------------------
+@app.post("/registerDataFile")
+def registerDataFile(filename: str, digest: str, year: int = 2019):
+    if not SHARED_DATA_DIR:
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Shared data volume is not configured"})
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Invalid digest"})
+
+    filename = os.path.basename(filename)
+    target = os.path.join(SHARED_DATA_DIR, "objects", digest[:2], digest + os.path.splitext(filename)[1])
+    if not os.path.exists(target):
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Object '{digest}' not found"})
+
+    # The name becomes visible atomically: symlink under a temp name, then rename
+    save_dir = f"{DATA_DIR}/{year}"
     os.makedirs(save_dir, exist_ok=True)
-    mat_files = [f for f in os.listdir(save_dir) if f.endswith(".mat")]
-    return JSONResponse(content={"saved_files": mat_files})
+    get_catalog().sync(year)
+    link_path = os.path.join(save_dir, filename)
+    tmp_link = f"{link_path}.{uuid.uuid4().hex}.tmp"
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link_path)
+    get_catalog().record(year, filename, digest)
+    return {"status": "ok", "filename": filename, "digest": digest}
+
+@app.get("/resolveFile")
+def resolveFile(filename: str, year: int):
+    """
+    Tell a caller on the shared volume where to read a stored file in place,
+    and any caller the file's SHA-256 (its identity for result caches).
+    """
+    file_path = os.path.join(f"{DATA_DIR}/{year}", os.path.basename(filename))
+    if not os.path.exists(file_path):
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"File '{filename}' not found"})
+
+    real_path = os.path.realpath(file_path)
+    shared = bool(SHARED_DATA_DIR) and real_path.startswith(os.path.realpath(SHARED_DATA_DIR) + os.sep)
+    checksum = get_catalog().checksum(year, os.path.basename(filename))
+    return {"path": real_path if shared else None, "shared": shared, "checksum": checksum}
+
+
+# ------------------------
+# Nearest stored site and inverse-distance blends
+# ------------------------
+_indexes = {}
+
+def get_index(year):
+    """Spatial index of one year's catalogued cubes, rebuilt when the directory changes."""
+    items, _ = get_catalog().query(dir_name=str(year))
+    save_dir = f"{DATA_DIR}/{year}"
+    stamp = os.stat(save_dir).st_mtime_ns if os.path.isdir(save_dir) else None
+    cached = _indexes.get((DATA_DIR, year))
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, spatial_index.SpatialIndex([item for item in items if item["lat"] is not None]))
+        _indexes[(DATA_DIR, year)] = cached
+    return cached[1]
+
+def _sources(entries, weights):
+    return [
+        {"filename": e["filename"], "lat": e["lat"], "lon": e["lon"], "distance_km": e["distance_km"], "weight": round(float(w), 6)}
+        for e, w in zip(entries, weights)
+    ]
+
+@app.get("/nearestFile")
+def nearestFile(
+    lat: float,
+    lon: float,
+    year: int,
+    azimuth_res: int = 1,
+    slope_res: int = 1,
+    fileFormat: str = "mat",
+    variant: str = "",
+    tolerance_km: float = NEAREST_TOLERANCE_KM,
+):
+    """The stored cube of the closest site within ``tolerance_km``."""
+    found = get_index(year).query(
+        lat, lon, year, azimuth_res, slope_res, ext=f".{fileFormat}", variant=variant or None, tolerance_km=tolerance_km
+    )
+    if not found:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"No cube within {tolerance_km} km"})
+    return {"filename": found[0]["filename"], "mode": "nearest", "sources": _sources(found, [1.0])}
+
+@app.post("/blendFile")
+def blendFile(
+    lat: float,
+    lon: float,
+    year: int,
+    azimuth_res: int = 1,
+    slope_res: int = 1,
+    fileFormat: str = "mat",
+    tolerance_km: float = NEAREST_TOLERANCE_KM,
+    k: int = 4,
+    power: float = 2.0,
+):
+    """
+    Inverse-distance-weighted blend of up to ``k`` stored cubes within
+    ``tolerance_km``, stored as an "idw" cube for the requested site.
+    A single or exactly matching source is returned as-is.
+    """
+    found = get_index(year).query(
+        lat, lon, year, azimuth_res, slope_res, ext=f".{fileFormat}", k=k, tolerance_km=tolerance_km
+    )
+    if not found:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"No cube within {tolerance_km} km"})
+
+    weights = spatial_index.idw_weights([e["distance_km"] for e in found], power)
+    used = [(e, w) for e, w in zip(found, weights) if w > 0]
+    if len(used) == 1:
+        return {"filename": used[0][0]["filename"], "mode": "nearest", "sources": _sources(*zip(*used))}
+
+    save_dir = f"{DATA_DIR}/{year}"
+    filename = f"all_Ppv_data_idw_azires_{azimuth_res}_sloperes_{slope_res}_{lat:.5f}_{lon:.5f}.{fileFormat}"
+    target = os.path.join(save_dir, filename)
+    sources = _sources(*zip(*used))
+    if not os.path.exists(target):
+        get_catalog().sync(year)
+        paths = [os.path.join(save_dir, e["filename"]) for e, _ in used]
+        partial = f"{target}.{uuid.uuid4().hex}.part"
+        if fileFormat == "pvc":
+            header = pvcube.read_header(paths[0])
+            out = pvcube.create_cube(
+                partial, azimuth_res, slope_res, lat, lon, year, hours=header["shape"][2],
+                blend={"method": "idw", "power": power, "sources": sources},
+            )
+            spatial_index.blend(paths, [w for _, w in used], out)
+            out.flush()
+            del out
+        elif fileFormat == "pvz":
+            header = pvcodec.read_header(paths[0])
+            out = spatial_index.blend(paths, [w for _, w in used], np.empty(header["shape"], dtype=np.float32))
+            # Same precision and chunking as the sources; site and provenance of the blend
+            kept = {k: v for k, v in header.items() if k not in ("version", "shape", "dtype", "daylight_hours", "index_offset")}
+            kept.update(lat=lat, lon=lon, blend={"method": "idw", "power": power, "sources": sources})
+            pvcodec.encode(out, partial, **kept)
+        else:
+            cube = spatial_index.load_cube(paths[0])
+            out = spatial_index.blend(paths, [w for _, w in used], np.empty(cube.shape, dtype=np.float32))
+            with open(partial, "wb") as f:  # a path would get ".mat" appended by savemat
+                pvcube.export_mat(out, f)
+        os.replace(partial, target)
+        get_catalog().record(year, filename)
+
+    return {"filename": filename, "mode": "idw", "sources": sources}
 
 
 @app.get("/checkFile")
 def checkFile(filename: str):
-    path = f"{filename}"
-    print(os.path.exists(path))
+    """Catalog lookup for paths inside DATA_DIR; anything else falls back to the filesystem."""
+    path = os.path.abspath(filename)
+    dir_path, name = os.path.split(path)
+    data_dir = os.path.abspath(DATA_DIR)
+    if name.endswith(CUBE_EXTENSIONS) and data_dir in (dir_path, os.path.dirname(dir_path)):
+        dir_name = "" if dir_path == data_dir else os.path.basename(dir_path)
+        return {"exists": get_catalog().exists(dir_name, name)}
     return {"exists": os.path.exists(path)}
 
 
@@ -0,0 +1,143 @@
+"""
+Dense PV cube file format (.pvc).
+
+A .pvc file is a fixed 4096-byte header followed by one C-ordered float32
+array of hourly PV output with shape (slopes, azimuths, hours). The header
+starts with MAGIC, then a little-endian uint32 length and a UTF-8 JSON
+object describing the grid (resolution, lat/lon, year). Readers map the
+payload with np.memmap, so nothing is parsed or copied up front.
+
+A multi-year cube has ``end_year`` in its header and its years one after
+another along the hour axis, HOURS per year; see select_year().
+
+This module is kept identical in pythoncalls, savedata and matlab, because
+every service image is built from its own directory.
+"""
+import json
+import os
+import struct
+import numpy as np
+import scipy.io
+
+MAGIC = b"PVCUBE1\n"
+HEADER_SIZE = 4096
+EXTENSION = ".pvc"
+HOURS = 8760
+
+
+def grid_axes(azimuth_res, slope_res):
+    """Azimuth and slope values (degrees) of the getData orientation grid."""
+    return np.arange(-90, 91, azimuth_res), np.arange(0, 91, slope_res)
+
+
+def _write_header(f, header):
+    payload = json.dumps(header).encode("utf-8")
+    if len(MAGIC) + 4 + len(payload) > HEADER_SIZE:
+        raise ValueError("Cube header does not fit in the reserved header block")
+    f.write(MAGIC + struct.pack("<I", len(payload)) + payload)
+    f.write(b"\0" * (HEADER_SIZE - f.tell()))
+
+
+def create_cube(path, azimuth_res, slope_res, lat, lon, year, hours=HOURS, **extra):
+    """
+    Preallocate a zero-filled cube file and return it as a writable memmap.
+
+    Extra keyword arguments are stored in the header as-is.
+    """
+    azimuths, slopes = grid_axes(azimuth_res, slope_res)
+    header = {
+        "version": 1,
+        "dtype": "float32",
+        "shape": [len(slopes), len(azimuths), hours],
+        "azimuth_res": azimuth_res,
+        "slope_res": slope_res,
+        "azimuth_start": -90,
+        "slope_start": 0,
+        "lat": lat,
+        "lon": lon,
+        "year": year,
+        **extra,
+    }
+    nbytes = int(np.prod(header["shape"])) * np.dtype(np.float32).itemsize
+    with open(path, "wb") as f:
+        _write_header(f, header)
+        f.truncate(HEADER_SIZE + nbytes)
+
+    return np.memmap(path, dtype=np.float32, mode="r+", offset=HEADER_SIZE, shape=tuple(header["shape"]))
+
+
+def is_cube(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{os.path.basename(path)}' is not a PV cube file")
+        (length,) = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+def update_header(path, **fields):
+    """Merge fields into the header of an existing cube file in place."""
+    header = {**read_header(path), **fields}
+    with open(path, "r+b") as f:
+        _write_header(f, header)
+    return header
+
+
+def open_cube(path, mode="r"):
+    """Map a cube file without copying; returns (array, header)."""
+    header = read_header(path)
+    cube = np.memmap(path, dtype=header["dtype"], mode=mode, offset=HEADER_SIZE, shape=tuple(header["shape"]))
+    return cube, header
+
+
+def cube_years(header):
+    """Years a cube covers, in the order they appear along its hour axis."""
+    return list(range(header["year"], header.get("end_year", header["year"]) + 1))
+
+
+def select_year(cube, header, weather_year=None):
+    """
+    One year of a multi-year cube as a (slopes, azimuths, HOURS) array.
+
+    ``weather_year`` is one of the cube's years, "average" (the default) for
+    the hourly mean over all of them, or "worst" for the year with the
+    lowest total yield. Single-year cubes are returned as they are.
+    """
+    years = cube_years(header)
+    if weather_year not in (None, "average", "worst"):
+        try:
+            index = years.index(int(weather_year))
+        except ValueError:
+            raise ValueError(f"Weather year must be one of {years[0]}..{years[-1]}, 'average' or 'worst'") from None
+    else:
+        index = None
+    if len(years) == 1:
+        return cube
+
+    num_slopes, num_azimuths, hours = cube.shape
+    per_year = cube.reshape(num_slopes, num_azimuths, len(years), hours // len(years))
+    if weather_year == "worst":
+        index = int(np.argmin([per_year[:, :, i].sum(dtype=np.float64) for i in range(len(years))]))
+    if index is not None:
+        return np.ascontiguousarray(per_year[:, :, index])
+
+    average = np.zeros((num_slopes, num_azimuths, per_year.shape[3]), dtype=np.float32)
+    for i in range(len(years)):
+        average += per_year[:, :, i]
+    average /= len(years)
+    return average
+
+
+def export_mat(cube, mat_path):
+    """Write a cube as the object-cell .mat layout calculation.m loads."""
+    num_slopes, num_azimuths = cube.shape[:2]
+    cells = np.empty((num_slopes, num_azimuths), dtype=object)
+    for s in range(num_slopes):
+        for a in range(num_azimuths):
+            cells[s, a] = np.asarray(cube[s, a], dtype=np.float32).reshape(-1, 1)
+    scipy.io.savemat(mat_path, {"all_Ppv_data": cells}, do_compression=False)
+    return mat_path
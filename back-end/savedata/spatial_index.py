@@ -0,0 +1,119 @@
+"""
+Spatial lookup of stored cubes by site.
+
+Cube names carry their site and grid (see pythoncalls cube_basename). Sites
+are indexed as unit vectors in a KD-tree per (year, variant, resolution,
+extension), so a nearest-neighbour query is a chord-distance search that
+converts exactly to great-circle distance, with no trouble at the date line
+or near the poles.
+"""
+import re
+import numpy as np
+from scipy.spatial import cKDTree
+import scipy.io
+import pvcodec
+import pvcube
+
+EARTH_RADIUS_KM = 6371.0088
+CUBE_NAME = re.compile(
+    r"^all_Ppv_data(?:_(?P<variant>[a-z]+))?_azires_(?P<azimuth_res>\d+)_sloperes_(?P<slope_res>\d+)"
+    r"_(?P<lat>-?\d+\.\d+)_(?P<lon>-?\d+\.\d+)(?:_years_(?P<start_year>\d+)-(?P<end_year>\d+))?(?P<ext>\.[a-z]+)$"
+)
+
+
+def parse_cube_name(filename):
+    """Site and grid of a cube file name, or None for other files."""
+    match = CUBE_NAME.match(filename)
+    if not match:
+        return None
+    return {
+        "filename": filename,
+        "variant": match["variant"],
+        "azimuth_res": int(match["azimuth_res"]),
+        "slope_res": int(match["slope_res"]),
+        "lat": float(match["lat"]),
+        "lon": float(match["lon"]),
+        "start_year": int(match["start_year"]) if match["start_year"] else None,
+        "end_year": int(match["end_year"]) if match["end_year"] else None,
+        "ext": match["ext"],
+    }
+
+
+def unit_vectors(lat, lon):
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.minimum(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+class SpatialIndex:
+    """KD-trees over cube entries (dicts from parse_cube_name), grouped by grid."""
+
+    def __init__(self, entries):
+        groups = {}
+        for entry in entries:
+            groups.setdefault(self.group_key(entry), []).append(entry)
+        self._trees = {
+            key: (cKDTree(unit_vectors([e["lat"] for e in group], [e["lon"] for e in group])), group)
+            for key, group in groups.items()
+        }
+
+    @staticmethod
+    def group_key(entry):
+        return entry.get("year"), entry.get("end_year"), entry["variant"], entry["azimuth_res"], entry["slope_res"], entry["ext"]
+
+    def __len__(self):
+        return sum(len(group) for _, group in self._trees.values())
+
+    def query(self, lat, lon, year, azimuth_res, slope_res, ext=".mat", variant=None, k=1, tolerance_km=5.0, end_year=None):
+        """
+        Up to ``k`` entries within ``tolerance_km``, nearest first, each with
+        its distance_km; multi-year cubes only match the same ``end_year``.
+        """
+        tree, group = self._trees.get((year, end_year, variant, azimuth_res, slope_res, ext), (None, None))
+        if tree is None:
+            return []
+        k = min(k, len(group))
+        chords, indices = tree.query(unit_vectors(lat, lon), k=k, distance_upper_bound=km_to_chord(tolerance_km))
+        chords, indices = np.atleast_1d(chords), np.atleast_1d(indices)
+        found = indices < len(group)
+        return [
+            {**group[i], "distance_km": round(float(d), 4)}
+            for d, i in zip(chord_to_km(chords[found]), indices[found])
+        ]
+
+
+def idw_weights(distances_km, power=2.0):
+    """Inverse-distance weights; a source at the exact site takes all the weight."""
+    distances = np.asarray(distances_km, dtype=np.float64)
+    if (distances < 1e-6).any():
+        return (distances < 1e-6) / (distances < 1e-6).sum()
+    weights = distances ** -power
+    return weights / weights.sum()
+
+
+def load_cube(path):
+    """A stored cube as a (slopes, azimuths, hours) array; .pvc files are memory-mapped, .pvz decoded."""
+    if pvcube.is_cube(path):
+        return pvcube.open_cube(path)[0]
+    if pvcodec.is_pvz(path):
+        return pvcodec.PvzReader(path).to_dense()
+    cells = next(v for k, v in scipy.io.loadmat(path).items() if not k.startswith("__"))
+    return np.stack([np.stack([np.asarray(c, dtype=np.float32).ravel() for c in row]) for row in cells])
+
+
+def blend(paths, weights, out):
+    """Weighted sum of cubes into ``out``, one slope row at a time."""
+    cubes = [load_cube(p) for p in paths]
+    for s in range(out.shape[0]):
+        row = np.zeros(out.shape[1:], dtype=np.float64)
+        for cube, weight in zip(cubes, weights):
+            row += weight * cube[s]
+        out[s] = row
+    return out
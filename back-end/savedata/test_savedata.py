@@ -1,6 +1,8 @@
 import os
 import io
+import json
 import pytest
+import numpy as np
 from fastapi.testclient import TestClient
 from main import app  # adjust if your savedata file is named differently
 
@@ -45,6 +47,22 @@ def test_getFile_existing(tmp_path):
     assert response.status_code == 200
     assert response.content == b"hello world"
 
+def test_getFile_keeps_trace_and_counts_bytes_served():
+    os.makedirs("/app/data/2019", exist_ok=True)
+    with open("/app/data/2019/test_metrics.mat", "wb") as f:
+        f.write(b"0123456789")
+
+    response = client.get(
+        "/getFile", params={"filename": "test_metrics.mat", "year": 2019},
+        headers={"X-Request-ID": "trace-7", "Range": "bytes=4-"},
+    )
+    assert response.status_code == 206
+    assert response.headers["X-Request-ID"] == "trace-7"
+
+    metrics = client.get("/metrics").text
+    assert 'savedata_bytes_served_bucket{endpoint="getFile",le="1024"}' in metrics
+    assert 'http_requests_total{route="/getFile",method="GET",status="206"}' in metrics
+
 def test_getFile_missing():
     response = client.get("/getFile", params={"filename": "nonexistent.mat", "year": 2019})
     assert response.status_code == 404
@@ -94,3 +112,238 @@ def test_checkFile_missing():
     response = client.get("/checkFile", params={"filename": "/app/data/2019/missing.mat"})
     assert response.status_code == 200
     assert response.json()["exists"] is False
+
+# ------------------------
+# Test shared volume register / resolve
+# ------------------------
+def test_registerDataFile_and_resolveFile(tmp_path, monkeypatch):
+    import main
+    shared = tmp_path / "shared"
+    digest = "ab" + "0" * 62
+    obj = shared / "objects" / "ab" / f"{digest}.pvc"
+    obj.parent.mkdir(parents=True)
+    obj.write_bytes(b"cube bytes")
+    monkeypatch.setattr(main, "SHARED_DATA_DIR", str(shared))
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path / "data"))
+
+    response = client.post("/registerDataFile", params={"filename": "cube.pvc", "digest": digest, "year": 2019})
+    assert response.status_code == 200
+    assert os.path.islink(tmp_path / "data" / "2019" / "cube.pvc")
+
+    response = client.get("/resolveFile", params={"filename": "cube.pvc", "year": 2019})
+    assert response.json() == {"path": os.path.realpath(obj), "shared": True, "checksum": digest}
+
+    # Plain HTTP consumers still get the bytes through the link
+    response = client.get("/getFile", params={"filename": "cube.pvc", "year": 2019})
+    assert response.content == b"cube bytes"
+
+def test_registerDataFile_unknown_object(tmp_path, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "SHARED_DATA_DIR", str(tmp_path))
+    response = client.post("/registerDataFile", params={"filename": "cube.pvc", "digest": "cd" * 32, "year": 2019})
+    assert response.status_code == 404
+
+# ------------------------
+# Nearest site lookup and IDW blends
+# ------------------------
+def write_site_cube(data_dir, lat, lon, value, year=2019):
+    import pvcube
+    os.makedirs(data_dir / str(year), exist_ok=True)
+    name = f"all_Ppv_data_azires_45_sloperes_45_{lat:.5f}_{lon:.5f}.pvc"
+    cube = pvcube.create_cube(str(data_dir / str(year) / name), 45, 45, lat, lon, year, hours=24)
+    cube[:] = value
+    cube.flush()
+    return name
+
+def test_nearestFile_within_tolerance(tmp_path, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    near = write_site_cube(tmp_path, 51.56048, 3.51420, 1.0)
+    write_site_cube(tmp_path, 51.83097, 4.14836, 2.0)
+
+    params = {"lat": 51.5605, "lon": 3.5142, "year": 2019, "azimuth_res": 45, "slope_res": 45, "fileFormat": "pvc"}
+    response = client.get("/nearestFile", params=params)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["filename"] == near and body["mode"] == "nearest"
+    assert body["sources"][0]["distance_km"] == pytest.approx(0.0022, abs=1e-3)
+
+    assert client.get("/nearestFile", params={**params, "lat": 52.2}).status_code == 404
+    assert client.get("/nearestFile", params={**params, "slope_res": 1}).status_code == 404
+
+    # A cube stored later is found without restarting
+    write_site_cube(tmp_path, 52.2, 3.5142, 3.0)
+    assert client.get("/nearestFile", params={**params, "lat": 52.2}).status_code == 200
+
+def test_blendFile_inverse_distance(tmp_path, monkeypatch):
+    import main, pvcube
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    write_site_cube(tmp_path, 52.0, 5.0, 10.0)
+    write_site_cube(tmp_path, 52.0, 5.2, 20.0)
+
+    # Midway between the two sites both get half the weight
+    params = {"lat": 52.0, "lon": 5.1, "year": 2019, "azimuth_res": 45, "slope_res": 45, "fileFormat": "pvc", "tolerance_km": 20}
+    body = client.post("/blendFile", params=params).json()
+    assert body["mode"] == "idw" and len(body["sources"]) == 2
+    assert [s["weight"] for s in body["sources"]] == pytest.approx([0.5, 0.5], abs=1e-3)
+    cube, header = pvcube.open_cube(str(tmp_path / "2019" / body["filename"]))
+    np.testing.assert_allclose(cube, 15.0, rtol=1e-3)
+    assert header["blend"]["method"] == "idw"
+
+    # Blends are never used as sources for nearest lookups
+    assert client.get("/nearestFile", params={**params, "tolerance_km": 1}).status_code == 404
+
+    # .mat cubes are blended into a .mat cube
+    import scipy.io
+    for lon, value in ((5.0, 10.0), (5.2, 20.0)):
+        cells = np.empty((3, 5), dtype=object)
+        for idx in np.ndindex(cells.shape):
+            cells[idx] = np.full((24, 1), value, dtype=np.float32)
+        name = f"all_Ppv_data_azires_45_sloperes_45_52.00000_{lon:.5f}.mat"
+        scipy.io.savemat(str(tmp_path / "2019" / name), {"all_Ppv_data": cells})
+    body = client.post("/blendFile", params={**params, "fileFormat": "mat"}).json()
+    assert body["mode"] == "idw" and body["filename"].endswith(".mat")
+    blended = scipy.io.loadmat(str(tmp_path / "2019" / body["filename"]))["all_Ppv_data"]
+    np.testing.assert_allclose(blended[2, 4].ravel(), 15.0, rtol=1e-3)
+
+# ------------------------
+# Catalog
+# ------------------------
+def test_catalog_records_uploads_and_answers_queries(tmp_path, monkeypatch):
+    import main, hashlib
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    sites = [(51.56048, 3.51420), (52.10147, 4.83540), (53.18345, 6.15540)]
+    for lat, lon in sites:
+        name = f"all_Ppv_data_azires_5_sloperes_5_{lat:.5f}_{lon:.5f}.mat"
+        client.post("/saveDataFile", files={"file": (name, io.BytesIO(name.encode()))}, params={"year": 2021})
+    write_site_cube(tmp_path, 52.0, 5.0, 1.0, year=2021)  # written behind savedata's back
+
+    body = client.get("/catalog", params={"year": 2021, "azimuth_res": 5}).json()
+    assert body["total"] == 3
+    item = body["items"][0]
+    assert item["checksum"] == hashlib.sha256(item["filename"].encode()).hexdigest()
+    assert item["shape"] == [19, 37, 8760] and item["size"] == len(item["filename"])
+
+    box = {"lat_min": 51.9, "lon_min": 4.0, "lat_max": 53.0, "lon_max": 5.5}
+    body = client.get("/catalog", params={"year": 2021, **box}).json()
+    assert sorted((i["lat"], i["lon"]) for i in body["items"]) == [(52.0, 5.0), (52.10147, 4.8354)]
+    pvc = next(i for i in body["items"] if i["ext"] == ".pvc")
+    assert pvc["shape"] == [3, 5, 24] and pvc["checksum"] is None
+
+    pages = [client.get("/catalog", params={"year": 2021, "limit": 3, "offset": o}).json() for o in (0, 3)]
+    assert [len(p["items"]) for p in pages] == [3, 1] and pages[0]["total"] == 4
+    assert client.get("/catalog", params={"lat_min": 50}).status_code == 400
+
+    # Files removed from disk drop out of listings and existence checks
+    os.remove(tmp_path / "2021" / item["filename"])
+    listed = client.get("/listSavedFilesForFrontEnd", params={"year": 2021}).json()["saved_files"]
+    assert item["filename"] not in listed and len(listed) == 3
+    path = str(tmp_path / "2021" / item["filename"])
+    assert client.get("/checkFile", params={"filename": path}).json() == {"exists": False}
+    assert client.get("/checkFile", params={"filename": path.replace(item["filename"], listed[0])}).json() == {"exists": True}
+
+# ------------------------
+# Slices
+# ------------------------
+def test_getSlice_ranges_aggregation_and_binary(tmp_path, monkeypatch):
+    import main, pvcube
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    os.makedirs(tmp_path / "2019")
+    name = "all_Ppv_data_azires_45_sloperes_45_52.00000_5.00000.pvc"
+    cube = pvcube.create_cube(str(tmp_path / "2019" / name), 45, 45, 52.0, 5.0, 2019)
+    cube[:] = np.arange(8760, dtype=np.float32) % 24  # 276 per day
+    cube[1, 2] += 1000
+    cube.flush()
+
+    params = {"filename": name, "year": 2019, "slope_min": 40, "slope_max": 50, "azimuth_min": 0, "azimuth_max": 0}
+    body = client.get("/getSlice", params={**params, "hour_start": 24, "hour_end": 30}).json()
+    assert body["shape"] == [1, 1, 6] and body["slopes"] == [45] and body["azimuths"] == [0]
+    assert body["data"] == [[[1000, 1001, 1002, 1003, 1004, 1005]]]
+
+    body = client.get("/getSlice", params={**params, "aggregation": "monthly"}).json()
+    assert body["months"] == list(range(1, 13))
+    assert body["data"][0][0][1] == pytest.approx(28 * (276 + 24000))
+
+    response = client.get("/getSlice", params={"filename": name, "year": 2019, "hour_start": 36, "hour_end": 96,
+                                               "aggregation": "daily", "format": "binary"})
+    assert response.headers["X-Shape"] == "3,5,3"
+    data = np.frombuffer(response.content, dtype="<f4").reshape(3, 5, 3)
+    assert json.loads(response.headers["X-Axes"])["days"] == [2, 3, 4]
+    np.testing.assert_allclose(data[0, 0], [sum(range(12, 24)), 276, 276])
+
+    assert client.get("/getSlice", params={**params, "slope_min": 50, "slope_max": 60}).status_code == 400
+    assert client.get("/getSlice", params={**params, "hour_end": 9000}).status_code == 400
+    assert client.get("/getSlice", params={**params, "aggregation": "weekly"}).status_code == 400
+    assert client.get("/getSlice", params={**params, "filename": "missing.pvc"}).status_code == 404
+
+
+def test_getSlice_and_catalog_read_pvz(tmp_path, monkeypatch):
+    import main, pvcodec
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    os.makedirs(tmp_path / "2019")
+    name = "all_Ppv_data_azires_45_sloperes_45_52.00000_5.00000.pvz"
+    cube = np.zeros((3, 5, 8760), dtype=np.float32)
+    cube[:] = np.arange(8760, dtype=np.float32) % 24
+    cube[1, 2] += 1000
+    axes = {"azimuth_res": 45, "slope_res": 45, "azimuth_start": -90, "slope_start": 0}
+    pvcodec.encode(cube, str(tmp_path / "2019" / name), chunk_orientations=4, chunk_hours=256, **axes)
+
+    params = {"filename": name, "year": 2019, "slope_min": 45, "slope_max": 45, "azimuth_min": 0, "azimuth_max": 0}
+    body = client.get("/getSlice", params={**params, "hour_start": 24, "hour_end": 30}).json()
+    assert body["data"] == [[[1000, 1001, 1002, 1003, 1004, 1005]]]
+
+    body = client.get("/catalog", params={"year": 2019, "ext": ".pvz"}).json()
+    assert body["items"][0]["shape"] == [3, 5, 8760]
+
+
+def test_multi_year_cube_is_catalogued_and_sliced_per_year(tmp_path, monkeypatch):
+    import main, pvcube
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    os.makedirs(tmp_path / "2019")
+    name = "all_Ppv_data_azires_45_sloperes_45_52.00000_5.00000_years_2019-2020.pvc"
+    cube = pvcube.create_cube(str(tmp_path / "2019" / name), 45, 45, 52.0, 5.0, 2019, hours=2 * 8760, end_year=2020)
+    cube[:, :, :8760], cube[:, :, 8760:] = 1.0, 2.0
+    cube.flush()
+
+    body = client.get("/getSlice", params={"filename": name, "year": 2019, "aggregation": "monthly"}).json()
+    assert body["months"] == list(range(1, 25))
+    assert body["data"][0][0][0] == 744 and body["data"][0][0][12] == 2 * 744
+
+    item = client.get("/catalog", params={"year": 2019}).json()["items"][0]
+    assert item["end_year"] == 2020 and item["shape"] == [3, 5, 2 * 8760]
+    # Nearest-site lookups never hand a multi-year cube to a single-year request
+    params = {"lat": 52.0, "lon": 5.0, "year": 2019, "azimuth_res": 45, "slope_res": 45, "fileFormat": "pvc"}
+    assert client.get("/nearestFile", params=params).status_code == 404
+
+
+# ------------------------
+# Streaming transfers
+# ------------------------
+def test_resumable_upload_commits_only_a_verified_file(tmp_path, monkeypatch):
+    import hashlib, main
+    monkeypatch.setattr(main, "DATA_DIR", str(tmp_path))
+    content = os.urandom(3000)
+    digest = hashlib.sha256(content).hexdigest()
+    url = "/uploads/2019/all_Ppv_data_azires_45_sloperes_45_52.00000_5.00000.pvc"
+
+    def put(offset, body, checksum=digest):
+        headers = {"X-Checksum-Sha256": checksum, "Upload-Offset": str(offset), "Upload-Length": str(len(content))}
+        return client.put(url, content=body, headers=headers)
+
+    assert client.head(url, headers={"X-Checksum-Sha256": digest}).headers["Upload-Offset"] == "0"
+    response = put(0, content[:1200])  # connection dropped after 1200 bytes
+    assert response.status_code == 409 and response.headers["Upload-Offset"] == "1200"
+    assert not client.get("/checkFile", params={"filename": str(tmp_path / "2019" / url.split("/")[-1])}).json()["exists"]
+    assert client.head(url, headers={"X-Checksum-Sha256": digest}).headers["Upload-Offset"] == "1200"
+    assert put(0, content).status_code == 409
+
+    response = put(1200, content[1200:])
+    assert response.status_code == 200 and response.json()["checksum"] == digest
+    assert (tmp_path / "2019" / url.split("/")[-1]).read_bytes() == content
+    assert [p.name for p in (tmp_path / "2019").iterdir() if p.name.endswith(".part")] == []
+
+    assert put(0, content, checksum="0" * 64).status_code == 422
+
+    response = client.get("/getFile", params={"filename": url.split("/")[-1], "year": 2019}, headers={"Range": "bytes=1000-"})
+    assert response.status_code == 206 and response.content == content[1000:]
+    assert response.headers["X-Checksum-Sha256"] == digest